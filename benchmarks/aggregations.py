@@ -0,0 +1,127 @@
+"""
+Measures how long a refresh takes to apply a `sync/maindata` delta and add up
+torrent fields by (category, state), both with a loop over torrent dicts and
+with the aggregations kept by `TorrentTable`, as the number of torrents and of
+added up fields grows.
+
+Every delta changes the transfer fields of `CHANGED` of the torrents, like the
+deltas of a busy server do.
+
+Run it from the repository root with:
+
+    python -m benchmarks.aggregations
+"""
+
+import argparse
+import random
+import timeit
+from collections import defaultdict
+
+from qbittorrent_exporter.torrents import TorrentTable
+from tests.fake_qbittorrent import synthetic_torrents
+
+TORRENT_COUNTS = [10_000, 50_000, 100_000]
+FIELDS = [
+    "dlspeed",
+    "upspeed",
+    "size",
+    "downloaded",
+    "uploaded",
+    "amount_left",
+    "num_seeds",
+    "num_leechs",
+]
+FIELD_COUNTS = [1, 4, 8]
+KEYS = ("category", "state")
+CHANGED = 0.05
+REPEAT = 5
+
+
+def build_delta(
+    torrents: dict[str, dict], rng: random.Random, churn: float = CHANGED
+) -> dict[str, dict]:
+    changed = rng.sample(sorted(torrents), int(len(torrents) * churn))
+    return {
+        torrent_hash: {
+            "dlspeed": rng.randint(0, 1 << 22),
+            "upspeed": rng.randint(0, 1 << 22),
+            "downloaded": torrents[torrent_hash]["downloaded"] + 1,
+            "uploaded": torrents[torrent_hash]["uploaded"] + 1,
+        }
+        for torrent_hash in changed
+    }
+
+
+def refresh_dicts(
+    torrents: dict[str, dict], delta: dict[str, dict], fields: list[str]
+) -> dict:
+    """Patches the torrent dicts and adds up every field of every torrent."""
+    for torrent_hash, changes in delta.items():
+        torrents[torrent_hash].update(changes)
+    sums: dict = defaultdict(lambda: dict.fromkeys(fields, 0))
+    for torrent in torrents.values():
+        totals = sums[(torrent["category"], torrent["state"])]
+        for field_name in fields:
+            totals[field_name] += torrent[field_name]
+    return sums
+
+
+def refresh_table(
+    table: TorrentTable, delta: dict[str, dict], fields: list[str]
+) -> dict:
+    """Patches the table, which updates its aggregations, and reads them."""
+    for torrent_hash, changes in delta.items():
+        table.update(torrent_hash, changes)
+    return table.sum_by(KEYS, fields)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--torrents", type=int, nargs="+", default=TORRENT_COUNTS)
+    parser.add_argument(
+        "--fields",
+        type=int,
+        nargs="+",
+        default=FIELD_COUNTS,
+        help=f"numbers of added up fields, up to {len(FIELDS)}",
+    )
+    parser.add_argument("--churn", type=float, default=CHANGED)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'torrents':>9} {'fields':>6} {'dicts (s)':>10} {'table (s)':>10}")
+    for count in args.torrents:
+        torrents = synthetic_torrents(count)
+        deltas = [build_delta(torrents, rng, args.churn) for _ in range(args.repeat)]
+
+        for field_count in args.fields:
+            fields = FIELDS[:field_count]
+            table = TorrentTable(aggregations=[(KEYS, fields)])
+            for torrent_hash, torrent in torrents.items():
+                table.update(torrent_hash, torrent)
+            dicts = {h: dict(torrent) for h, torrent in torrents.items()}
+
+            loop = min(
+                timeit.repeat(
+                    lambda dicts=dicts, fields=fields, deltas=deltas: refresh_dicts(
+                        dicts, rng.choice(deltas), fields
+                    ),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            kept = min(
+                timeit.repeat(
+                    lambda table=table, fields=fields, deltas=deltas: refresh_table(
+                        table, rng.choice(deltas), fields
+                    ),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(f"{count:>9} {field_count:>6} {loop:>10.4f} {kept:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
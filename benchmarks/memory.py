@@ -0,0 +1,111 @@
+"""
+Compares the memory used to ingest a full `sync/maindata` response as the
+exporter used to, parsing it with `qbittorrentapi` and keeping a dict with every
+field of each torrent, with parsing it torrent by torrent and keeping only the
+fields needed by the metrics in a `TorrentTable`.
+
+Each measurement runs in a fresh process so its peak RSS isn't inherited from
+the previous one. Run it from the repository root with:
+
+    python -m benchmarks.memory
+"""
+
+import argparse
+import gc
+import json
+import resource
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from qbittorrentapi import SyncMainDataDictionary
+
+from qbittorrent_exporter.exporter import QbittorrentMetricsCollector
+from qbittorrent_exporter.torrents import TorrentTable, load_maindata
+from tests.fake_qbittorrent import synthetic_torrents
+
+TORRENT_COUNTS = [10_000, 50_000, 100_000]
+CONFIG = {
+    "host": "localhost",
+    "port": "8080",
+    "ssl": False,
+    "url_base": "",
+    "metrics_prefix": "qbittorrent",
+    "export_metrics_by_torrent": True,
+}
+
+
+def ingest_dicts(payload: bytes) -> object:
+    """The previous implementation: a dict with every field for each torrent."""
+    maindata = SyncMainDataDictionary(json.loads(payload))
+    return {
+        torrent_hash: dict(torrent)
+        for torrent_hash, torrent in maindata["torrents"].items()
+    }
+
+
+def ingest_table(payload: bytes) -> object:
+    """Keeps only the fields used by the enabled metrics, by column."""
+    fields = QbittorrentMetricsCollector(CONFIG)._get_torrent_fields()
+    table = TorrentTable(fields)
+    for torrent_hash, torrent in load_maindata(payload, fields)["torrents"].items():
+        table.update(torrent_hash, torrent)
+    return table
+
+
+def build_payload(torrents: int, chunk_size: int = 1_000) -> bytes:
+    """
+    Builds a full `sync/maindata` response in chunks, so that building it
+    doesn't raise the peak RSS of the process above the response size.
+    """
+    chunks = []
+    for start in range(0, torrents, chunk_size):
+        chunk = synthetic_torrents(min(chunk_size, torrents - start), seed=start)
+        chunks.append(json.dumps(chunk)[1:-1].encode())
+    return b'{"rid": 1, "full_update": true, "torrents": {%b}}' % b", ".join(chunks)
+
+
+def measure(ingest_name: str, torrents: int) -> dict[str, float]:
+    payload = build_payload(torrents)
+    gc.collect()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    result = globals()[ingest_name](payload)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        "peak": peak / 2**20,
+        "retained": retained / 2**20,
+        # ru_maxrss is in KiB on Linux
+        "rss": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss)
+        / 2**10,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--torrents", type=int, nargs="+", default=TORRENT_COUNTS)
+    args = parser.parse_args()
+
+    print(
+        f"{'torrents':>9} {'ingest':>7} {'peak MiB':>9} "
+        f"{'retained MiB':>13} {'RSS growth MiB':>15}"
+    )
+    with ProcessPoolExecutor(
+        mp_context=get_context("spawn"), max_tasks_per_child=1
+    ) as pool:
+        for torrents in args.torrents:
+            for ingest_name in ("ingest_dicts", "ingest_table"):
+                result = pool.submit(measure, ingest_name, torrents).result()
+                print(
+                    f"{torrents:>9} {ingest_name.removeprefix('ingest_'):>7} "
+                    f"{result['peak']:>9.1f} {result['retained']:>13.1f} "
+                    f"{result['rss']:>15.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
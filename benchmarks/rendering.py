@@ -0,0 +1,124 @@
+"""
+Measures how long building and rendering the per torrent metrics takes, with
+plain gauges rendered by `generate_latest` and with the prerendered labels kept
+between scrapes, in the text format or in the OpenMetrics one Prometheus asks
+for.
+
+Run it from the repository root with:
+
+    python -m benchmarks.rendering [--format openmetrics]
+"""
+
+import argparse
+import timeit
+
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.exposition import generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics
+
+from qbittorrent_exporter.exporter import QbittorrentMetricsCollector, Snapshot
+from qbittorrent_exporter.rendering import generate_openmetrics, generate_text
+from qbittorrent_exporter.torrents import TorrentTable
+from tests.fake_qbittorrent import synthetic_torrents
+
+# Plain and prerendered encoders by format
+ENCODERS = {
+    "text": (generate_latest, generate_text),
+    "openmetrics": (openmetrics.generate_latest, generate_openmetrics),
+}
+
+
+class Families:
+    def __init__(self, families: list) -> None:
+        self.families = families
+
+    def collect(self) -> list:
+        return self.families
+
+
+def build_plain_gauges(
+    collector: QbittorrentMetricsCollector, snapshot: Snapshot
+) -> list[GaugeMetricFamily]:
+    """The previous implementation: new label lists for every torrent."""
+    size = GaugeMetricFamily(
+        "qbittorrent_torrent_size",
+        "Size of the torrent",
+        labels=["name", "category", "server"],
+    )
+    downloaded = GaugeMetricFamily(
+        "qbittorrent_torrent_downloaded",
+        "Downloaded data for the torrent",
+        labels=["name", "category", "server"],
+    )
+    torrents = snapshot.torrents
+    names = torrents.column("name")
+    categories = torrents.column("category")
+    sizes = torrents.column("size")
+    downloads = torrents.column("downloaded")
+    for row in range(len(torrents)):
+        size.add_metric(
+            value=sizes[row], labels=[names[row], categories[row], collector.server]
+        )
+        downloaded.add_metric(
+            value=downloads[row],
+            labels=[names[row], categories[row], collector.server],
+        )
+    return [size, downloaded]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--torrents", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--format", choices=list(ENCODERS), default="text")
+    args = parser.parse_args()
+    plain_encoder, prerendered_encoder = ENCODERS[args.format]
+
+    collector = QbittorrentMetricsCollector(
+        {
+            "host": "localhost",
+            "port": "8080",
+            "ssl": False,
+            "url_base": "",
+            "metrics_prefix": "qbittorrent",
+            "export_metrics_by_torrent": True,
+        }
+    )
+
+    print(f"{'torrents':>9} {'plain (s)':>10} {'prerendered (s)':>16}")
+    for count in args.torrents:
+        snapshot = Snapshot(
+            torrents=TorrentTable.from_dicts(
+                (
+                    {"hash": torrent_hash, **torrent}
+                    for torrent_hash, torrent in synthetic_torrents(count).items()
+                ),
+                ["name", "category", "size", "downloaded"],
+            )
+        )
+        plain = min(
+            timeit.repeat(
+                lambda snapshot=snapshot: plain_encoder(
+                    Families(build_plain_gauges(collector, snapshot))
+                ),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        # The first scrape fills the label cache, the next ones reuse it
+        prerendered = min(
+            timeit.repeat(
+                lambda snapshot=snapshot: prerendered_encoder(
+                    Families(
+                        collector._get_qbittorrent_by_torrent_metric_gauges(snapshot)
+                    )
+                ),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{count:>9} {plain:>10.4f} {prerendered:>16.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Measures whole scrapes of the exporter against a fake qBittorrent WebUI serving
+synthetic torrents: `/metrics` latency, CPU time, peak memory and the number of
+series, for each number of torrents.
+
+The fake server runs in this process and every scenario runs the exporter in a
+fresh process, so CPU time and peak RSS are the exporter's own. The first
+scrape gets every torrent; the next ones get deltas changing `--churn` of the
+torrents, as a busy server sends.
+
+Results are printed and, with `--output`, saved as JSON. `--baseline` compares
+them with a previous JSON file. Run it from the repository root with e.g.:
+
+    python -m benchmarks.scrape --torrents 10000 50000 --output results.json
+"""
+
+import argparse
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import Any
+
+from prometheus_client import CollectorRegistry
+
+from qbittorrent_exporter.exporter import QbittorrentMetricsCollector
+from qbittorrent_exporter.server import start_http_server
+from tests.fake_qbittorrent import FakeQbittorrent, FakeQbittorrentServer
+
+# Results compared with `--baseline`; lower is better for all of them
+COMPARED = ["first_scrape_seconds", "scrape_p50_seconds", "cpu_seconds", "peak_rss_mib"]
+
+# The Accept header Prometheus scrapes with, which asks for OpenMetrics
+PROMETHEUS_ACCEPT = (
+    "application/openmetrics-text;version=1.0.0;escaping=allow-utf-8;q=0.6,"
+    "application/openmetrics-text;version=0.0.1;q=0.5,"
+    "text/plain;version=1.0.0;escaping=allow-utf-8;q=0.4,"
+    "text/plain;version=0.0.4;q=0.3,*/*;q=0.2"
+)
+
+
+def run_exporter(port: int, config: dict[str, Any], scrapes: int) -> dict[str, Any]:
+    """Scrapes an exporter polling the fake server at `port` in this process."""
+    collector = QbittorrentMetricsCollector(
+        {
+            "host": "127.0.0.1",
+            "port": str(port),
+            "ssl": False,
+            "url_base": "",
+            "username": "",
+            "password": "",
+            "api_key": "",
+            "verify_webui_certificate": True,
+            "metrics_prefix": "qbittorrent",
+            **config,
+        }
+    )
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(collector)
+    server, _ = start_http_server(0, "127.0.0.1", registry=registry)
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_address[1]}/metrics",
+        headers={"Accept": PROMETHEUS_ACCEPT},
+    )
+
+    durations = []
+    body = b""
+    cpu_started = time.process_time()
+    for _ in range(scrapes + 1):
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+        durations.append(time.perf_counter() - started)
+    cpu = time.process_time() - cpu_started
+    server.shutdown()
+
+    return {
+        "first_scrape_seconds": durations[0],
+        "scrape_p50_seconds": statistics.median(durations[1:]),
+        "scrape_max_seconds": max(durations[1:]),
+        "cpu_seconds": cpu / len(durations),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        "series": sum(
+            1 for line in body.splitlines() if line and not line.startswith(b"#")
+        ),
+        "response_bytes": len(body),
+    }
+
+
+def run_scenario(
+    pool: ProcessPoolExecutor, args: argparse.Namespace, torrents: int
+) -> dict[str, Any]:
+    fake = FakeQbittorrent.synthetic(
+        torrents, categories=args.categories, tags=args.tags, churn=args.churn
+    )
+    latency = {"sync/maindata": args.latency, "app/version": args.latency}
+    config = {
+        "export_metrics_by_torrent": args.by_torrent,
+        "aggregate_metrics_by": args.aggregate_by,
+    }
+    with FakeQbittorrentServer(fake, latency) as server:
+        result = pool.submit(run_exporter, server.port, config, args.scrapes).result()
+    return {
+        "torrents": torrents,
+        "categories": args.categories,
+        "tags": args.tags,
+        **result,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: list[dict], baseline: list[dict]) -> None:
+    by_torrents = {result["torrents"]: result for result in baseline}
+    print(f"\nChange from baseline:\n{'torrents':>9}", *(f"{k:>22}" for k in COMPARED))
+    for result in results:
+        previous = by_torrents.get(result["torrents"])
+        if previous is None:
+            continue
+        changes = [
+            f"{(result[key] - previous[key]) / previous[key]:>+22.1%}"
+            for key in COMPARED
+        ]
+        print(f"{result['torrents']:>9}", *changes)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--torrents", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--tags", type=int, default=10)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per API request"
+    )
+    parser.add_argument("--scrapes", type=int, default=10)
+    parser.add_argument("--by-torrent", action="store_true")
+    parser.add_argument(
+        "--aggregate-by", nargs="*", default=[], choices=["category", "tag", "status"]
+    )
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'torrents':>9} {'first (s)':>10} {'p50 (s)':>8} {'max (s)':>8}"
+        f" {'CPU (s)':>8} {'RSS MiB':>8} {'series':>8}"
+    )
+    with ProcessPoolExecutor(
+        mp_context=get_context("spawn"), max_tasks_per_child=1
+    ) as pool:
+        for torrents in args.torrents:
+            result = run_scenario(pool, args, torrents)
+            results.append(result)
+            print(
+                f"{torrents:>9} {result['first_scrape_seconds']:>10.3f}"
+                f" {result['scrape_p50_seconds']:>8.3f}"
+                f" {result['scrape_max_seconds']:>8.3f}"
+                f" {result['cpu_seconds']:>8.3f} {result['peak_rss_mib']:>8.1f}"
+                f" {result['series']:>8}"
+            )
+
+    settings = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("torrents", "output", "baseline")
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "date": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "settings": settings,
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["settings"] != settings:
+            print(f"\nThe baseline used other settings: {baseline['settings']}")
+        compare(results, baseline["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Measures how long building the `torrents_count` gauge takes as the number of
+categories and torrents grows.
+
+Run it from the repository root with:
+
+    python -m benchmarks.torrents_count
+"""
+
+import argparse
+import random
+import timeit
+
+from qbittorrentapi import TorrentStates
+
+from qbittorrent_exporter.exporter import QbittorrentMetricsCollector, Snapshot
+from qbittorrent_exporter.torrents import TorrentTable
+
+CATEGORY_COUNTS = [10, 100, 300]
+TORRENT_COUNTS = [1_000, 10_000, 40_000]
+REPEAT = 3
+
+
+def build_snapshot(categories: int, torrents: int) -> Snapshot:
+    """Builds a snapshot with randomly distributed torrents."""
+    rng = random.Random(42)
+    category_names = [f"category{i}" for i in range(categories)]
+    states = [state.value for state in TorrentStates]
+    return Snapshot(
+        categories={name: {"name": name} for name in category_names},
+        torrents=TorrentTable.from_dicts(
+            {
+                "name": f"Torrent {i}",
+                "category": rng.choice(category_names + [""]),
+                "state": rng.choice(states),
+            }
+            for i in range(torrents)
+        ),
+    )
+
+
+def count_by_filtering(snapshot: Snapshot) -> int:
+    """
+    The previous implementation: filter the torrent list for every category and
+    then for every state.
+    """
+    categories = dict(snapshot.categories)
+    categories["Uncategorized"] = {}
+    torrents = snapshot.torrents.to_dicts()
+    series = 0
+    for category in categories:
+        category_torrents = [
+            torrent
+            for torrent in torrents
+            if torrent["category"] == category
+            or (category == "Uncategorized" and torrent["category"] == "")
+        ]
+        for state in TorrentStates:
+            len([t for t in category_torrents if t["state"] == state.value])
+            series += 1
+    return series
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--categories", type=int, nargs="+", default=CATEGORY_COUNTS)
+    parser.add_argument("--torrents", type=int, nargs="+", default=TORRENT_COUNTS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    collector = QbittorrentMetricsCollector(
+        {
+            "host": "localhost",
+            "port": "8080",
+            "ssl": False,
+            "url_base": "",
+            "metrics_prefix": "qbittorrent",
+        }
+    )
+
+    print(
+        f"{'categories':>10} {'torrents':>9} {'filtering (s)':>14} {'single pass (s)':>16}"
+    )
+    for categories in args.categories:
+        for torrents in args.torrents:
+            snapshot = build_snapshot(categories, torrents)
+            filtering = min(
+                timeit.repeat(
+                    lambda snapshot=snapshot: count_by_filtering(snapshot),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            single_pass = min(
+                timeit.repeat(
+                    lambda snapshot=snapshot: (
+                        collector._get_qbittorrent_torrent_tags_metrics_gauge(snapshot)
+                    ),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(
+                f"{categories:>10} {torrents:>9} {filtering:>14.4f} {single_pass:>16.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
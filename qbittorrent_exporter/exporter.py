@@ -1,22 +1,195 @@
+import copy
 import faulthandler
+import heapq
+import json
 import logging
+import math
 import os
 import signal
 import sys
+import threading
 import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
 from dataclasses import dataclass, field
 from enum import StrEnum, auto
-from typing import Any, Iterable
+from functools import partial
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Iterable, Sequence
+from urllib.parse import urlsplit
 
-from prometheus_client import start_http_server
-from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+from prometheus_client import Histogram
+from prometheus_client.core import (
+    REGISTRY,
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+)
+from prometheus_client.utils import floatToGoString
 from pythonjsonlogger import jsonlogger
-from qbittorrentapi import Client, TorrentStates
+from qbittorrentapi import (
+    APIConnectionError,
+    APINames,
+    Client,
+    HTTPError,
+    TorrentStates,
+)
+from requests.exceptions import ReadTimeout
+
+from qbittorrent_exporter.instrumentation import BUCKETS, Instrumentation
+from qbittorrent_exporter.rendering import (
+    CounterStarts,
+    LabelCache,
+    PrerenderedCounterFamily,
+    PrerenderedGaugeFamily,
+)
+from qbittorrent_exporter.scheduler import AdaptiveScheduler
+from qbittorrent_exporter.server import (
+    Exposition,
+    ExpositionCache,
+    scrape_deadline,
+    start_http_server,
+)
+from qbittorrent_exporter.singleflight import SingleFlight
+from qbittorrent_exporter.torrents import (
+    FLOAT_FIELDS,
+    INT_FIELDS,
+    TorrentTable,
+    load_maindata,
+)
+from qbittorrent_exporter.trackers import TrackerCrawler, tracker_host
 
 # Enable dumps on stderr in case of segfault
 faulthandler.enable()
 logger = logging.getLogger()
 
+# Name of the series adding up the torrents not selected for per torrent metrics
+OTHER_TORRENTS = "__other__"
+
+# Labels of the per torrent series for each way of identifying the torrents.
+# With "info", the name and category are only in the torrent info series.
+TORRENT_IDENTITY_LABELS = {
+    "name": ["name", "category", "server"],
+    "hash": ["name", "category", "hash", "server"],
+    "info": ["hash", "server"],
+}
+TORRENT_INFO_LABELS = ["hash", "name", "category", "server"]
+
+# Torrent fields added up by the aggregate metrics, with their description
+AGGREGATED_TORRENT_FIELDS = {
+    "dlspeed": "Download speed of the torrents, in bytes per second",
+    "upspeed": "Upload speed of the torrents, in bytes per second",
+    "size": "Size of the torrents, in bytes",
+    "downloaded": "Data downloaded by the torrents, in bytes",
+    "uploaded": "Data uploaded by the torrents, in bytes",
+    "amount_left": "Data left to download by the torrents, in bytes",
+    "num_seeds": "Number of seeds the torrents are connected to",
+    "num_leechs": "Number of leechers the torrents are connected to",
+}
+
+# Labels the aggregate metrics can be grouped by, with the torrent field of each
+AGGREGATE_LABELS = {"category": "category", "tag": "tags", "status": "state"}
+
+
+@dataclass(frozen=True)
+class TorrentHistogram:
+    """A distribution of a torrent field, exported as a histogram."""
+
+    field: str
+    name: str
+    help_text: str
+    buckets: tuple[float, ...]
+    # Whether the field is a Unix time, whose histogram is of the seconds since
+    since: bool = False
+
+
+_HOUR = 3600
+_DAY = 24 * _HOUR
+_GIB = 2**30
+
+# Distributions of the torrents that can be exported, with their default buckets
+TORRENT_HISTOGRAMS = {
+    "size": TorrentHistogram(
+        "size",
+        "torrents_by_size_bytes",
+        "Torrents by size, in bytes",
+        (2**20, 10 * 2**20, 100 * 2**20, _GIB, 4 * _GIB, 10 * _GIB, 50 * _GIB),
+    ),
+    "ratio": TorrentHistogram(
+        "ratio",
+        "torrents_by_ratio",
+        "Torrents by share ratio",
+        (0.1, 0.25, 0.5, 1, 2, 5, 10),
+    ),
+    "seeding_time": TorrentHistogram(
+        "seeding_time",
+        "torrents_by_seeding_time_seconds",
+        "Torrents by time spent seeding, in seconds",
+        (_HOUR, _DAY, 7 * _DAY, 30 * _DAY, 90 * _DAY, 365 * _DAY),
+    ),
+    "age": TorrentHistogram(
+        "added_on",
+        "torrents_by_age_seconds",
+        "Torrents by time since they were added, in seconds",
+        (_HOUR, _DAY, 7 * _DAY, 30 * _DAY, 90 * _DAY, 365 * _DAY),
+        since=True,
+    ),
+    "availability": TorrentHistogram(
+        "availability",
+        "torrents_by_availability",
+        "Torrents by number of distributed copies available to download",
+        (0.5, 1, 2, 5, 10),
+    ),
+    "seeds": TorrentHistogram(
+        "num_seeds",
+        "torrents_by_seeds",
+        "Torrents by number of seeds they are connected to",
+        (0, 1, 2, 5, 10, 50, 100),
+    ),
+}
+
+
+@dataclass(frozen=True)
+class TorrentFieldMetric:
+    """A torrent field that can be exported by the per torrent metrics."""
+
+    help_text: str
+    counter: bool = False
+    # Whether the field of the torrents not exported can be added up. Counters
+    # can't, as the torrents not exported change between scrapes, and their sum
+    # would jump up and down.
+    summable: bool = True
+
+
+# Optional per torrent metrics, named `torrent_<field>`, by torrent field
+TORRENT_FIELD_METRICS = {
+    "uploaded": TorrentFieldMetric(
+        "Uploaded data for the torrent", counter=True, summable=False
+    ),
+    "dlspeed": TorrentFieldMetric("Download speed of the torrent, in bytes per second"),
+    "upspeed": TorrentFieldMetric("Upload speed of the torrent, in bytes per second"),
+    "ratio": TorrentFieldMetric("Share ratio of the torrent", summable=False),
+    "num_seeds": TorrentFieldMetric("Number of seeds the torrent is connected to"),
+    "num_leechs": TorrentFieldMetric("Number of leechers the torrent is connected to"),
+    "eta": TorrentFieldMetric(
+        "Estimated time until the torrent is downloaded, in seconds",
+        summable=False,
+    ),
+    "progress": TorrentFieldMetric(
+        "Downloaded fraction of the torrent, from 0 to 1", summable=False
+    ),
+}
+
+# Polls the worker process may miss before its metrics are considered stale
+WORKER_STALE_POLLS = 3
+
+# Runs the qbittorrent API calls of every collector that must happen concurrently
+_api_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="qbittorrent-api")
+
 
 class MetricType(StrEnum):
     """
@@ -40,23 +213,260 @@ class Metric:
     metric_type: MetricType = MetricType.GAUGE
 
 
+@dataclass
+class Snapshot:
+    """
+    Data fetched from qbittorrent once per scrape and shared by every metric.
+    """
+
+    server_state: dict[str, Any] = field(default_factory=lambda: {})
+    version: str = ""
+    categories: dict[str, dict] = field(default_factory=lambda: {})
+    tags: list[str] = field(default_factory=lambda: [])
+    torrents: TorrentTable = field(default_factory=TorrentTable)
+    # Whether the data is the one of a previous scrape, as the server didn't
+    # answer in time
+    stale: bool = False
+
+
+class MaindataMirror:
+    """
+    Local copy of the qbittorrent state built from the incremental updates
+    returned by `sync/maindata`.
+
+    Each update only carries what changed since the `rid` sent in the request.
+    When the server can't produce a delta (first request, new session, server
+    restart...) it answers with `full_update` and the mirror starts over.
+
+    Only the given `torrent_fields` of every torrent are kept, the given
+    `aggregations` of the torrents are kept up to date and the last change of
+    the `tracked_fields` of every torrent is recorded (see `TorrentTable`).
+    """
+
+    def __init__(
+        self,
+        torrent_fields: Iterable[str] = (),
+        aggregations: Iterable[tuple[Sequence[str], Sequence[str]]] = (),
+        tracked_fields: Iterable[str] = (),
+    ) -> None:
+        self.torrent_fields = tuple(torrent_fields)
+        self.aggregations = tuple(aggregations)
+        self.tracked_fields = tuple(tracked_fields)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets everything, so the next update will be a full one."""
+        self.rid: int = 0
+        self.server_state: dict[str, Any] = {}
+        self.categories: dict[str, dict] = {}
+        self.tags: set[str] = set()
+        self.torrents = TorrentTable(
+            self.torrent_fields, self.aggregations, self.tracked_fields
+        )
+
+    def apply(self, maindata: dict[str, Any]) -> None:
+        """Merges a `sync/maindata` response into the mirror."""
+        if maindata.get("full_update", False):
+            rid = self.rid
+            self.reset()
+            self.rid = rid
+
+        for torrent_hash, torrent in maindata.get("torrents", {}).items():
+            self.torrents.update(torrent_hash, torrent)
+        for torrent_hash in maindata.get("torrents_removed", []):
+            self.torrents.remove(torrent_hash)
+
+        for name, category in maindata.get("categories", {}).items():
+            self.categories.setdefault(name, {}).update(category)
+        for name in maindata.get("categories_removed", []):
+            self.categories.pop(name, None)
+
+        self.tags.update(maindata.get("tags", []))
+        self.tags.difference_update(maindata.get("tags_removed", []))
+
+        self.server_state.update(maindata.get("server_state", {}))
+        self.rid = maindata.get("rid", self.rid)
+
+
+def _is_connection_failure(error: Exception) -> bool:
+    """
+    Whether an API call failed to reach the server, e.g. on a connection or SSL
+    error, so the client must be created again. After an error response, an
+    unreadable one or a read timeout, the session and the mirror are still good.
+    """
+    return (
+        isinstance(error, APIConnectionError)
+        and not isinstance(error, HTTPError)
+        and not isinstance(error.__context__, ReadTimeout)
+    )
+
+
+def _server_name(config: dict) -> str:
+    """Returns the `server` label of the qbittorrent server in `config`."""
+    server = f"{config['host']}:{config['port']}"
+    if config["url_base"]:
+        server = f"{server}/{config['url_base']}"
+    return server
+
+
 class QbittorrentMetricsCollector:
     def __init__(self, config: dict) -> None:
         self.config = config
-        self.server = f"{config['host']}:{config['port']}"
+        self.server = _server_name(config)
         self.protocol = "http"
 
-        if config["url_base"]:
-            self.server = f"{self.server}/{config['url_base']}"
         if config["ssl"] or config["port"] == "443":
             self.protocol = "https"
         self.connection_string = f"{self.protocol}://{self.server}"
 
+        # The client is long-lived so its HTTP session (and the keep-alive
+        # connections and SID cookie it holds) survives between scrapes.
+        self.client: Client | None = None
+        self._client_lock = threading.Lock()
+        self._client_invalid = False
+        self.logins = 0
+        self.reconnects = 0
+
+        self.mirror = MaindataMirror(
+            self._get_torrent_fields(),
+            self._get_torrent_aggregations(),
+            self._get_tracked_torrent_fields(),
+        )
+        self._mirror_lock = threading.Lock()
+        self._version = ""
+
+        # Metric families built by the last refresh, served as they are when
+        # a `Poller` refreshes them in the background.
+        self._families: list[GaugeMetricFamily | CounterMetricFamily] = []
+        self.last_successful_refresh: float | None = None
+        self._single_flight: SingleFlight[
+            list[GaugeMetricFamily | CounterMetricFamily]
+        ] = SingleFlight(self.config.get("min_refresh_interval", 0))
+
+        self.instrumentation = Instrumentation(
+            self.config["metrics_prefix"], self.server
+        )
+        # Rendered labels of the per torrent series, by torrent hash
+        self._torrent_labels = LabelCache(
+            TORRENT_IDENTITY_LABELS[self.config.get("torrent_metrics_identity", "name")]
+        )
+        self._torrent_info_labels = LabelCache(TORRENT_INFO_LABELS)
+        # Created times of the per torrent counters, by field
+        self._torrent_counter_starts = {
+            field_name: CounterStarts()
+            for field_name in self.config.get("torrent_metrics_fields", [])
+            if TORRENT_FIELD_METRICS[field_name].counter
+        }
+
+        # Spaces out the fetches when the server fails or slows down
+        self.scheduler: AdaptiveScheduler | None = None
+        if self.config.get("max_backoff"):
+            self.scheduler = AdaptiveScheduler(
+                self.config.get("poll_interval", 0), self.config["max_backoff"]
+            )
+
+        self.tracker_crawler: TrackerCrawler | None = None
+        self._tracker_crawler_started = False
+        if self.config.get("tracker_crawl_rate"):
+            self.tracker_crawler = TrackerCrawler(
+                self._get_torrent_hashes,
+                lambda torrent_hash: self.instrumentation.count_errors(
+                    "torrents/trackers",
+                    partial(
+                        self._get_client().torrents_trackers, torrent_hash=torrent_hash
+                    ),
+                ),
+                rate=self.config["tracker_crawl_rate"],
+                ttl=self.config.get("tracker_crawl_ttl", 3600),
+            )
+
+    def _get_torrent_fields(self) -> set[str]:
+        """Returns the torrent fields used by the enabled metrics."""
+        fields = {"name", "category", "state"}
+        if self.config.get("export_metrics_by_torrent", False):
+            fields.update(["size", "downloaded"])
+            fields.update(self.config.get("torrent_metrics_fields", []))
+            if self.config.get("torrent_metrics_top_k"):
+                fields.add(self.config.get("torrent_metrics_top_k_by", "upspeed"))
+            fields.update(self._get_tracked_torrent_fields())
+        for keys, field_names in self._get_torrent_aggregations():
+            fields.update(keys, field_names)
+        for name in self.config.get("torrent_histograms", []):
+            fields.add(TORRENT_HISTOGRAMS[name].field)
+        return fields
+
+    def _get_tracked_torrent_fields(self) -> set[str]:
+        """
+        Returns the torrent fields whose changes make a torrent exported by the
+        per torrent metrics, when only recently changed torrents are.
+        """
+        if not (
+            self.config.get("export_metrics_by_torrent", False)
+            and self.config.get("torrent_metrics_changed_within")
+        ):
+            return set()
+        # Speeds keep changing while a torrent is active
+        return {"name", "category", "size", "downloaded", "dlspeed", "upspeed"}
+
+    def _get_torrent_aggregations(
+        self,
+    ) -> list[tuple[tuple[str, ...], tuple[str, ...]]]:
+        """
+        Returns the aggregations of the torrents used by the metrics, as pairs of
+        the fields to group by and the fields to add up.
+        """
+        aggregations = [(("category", "state"), ())]
+        if self.config.get("aggregate_metrics_by"):
+            aggregations.append(
+                (
+                    tuple(
+                        AGGREGATE_LABELS[label]
+                        for label in self.config["aggregate_metrics_by"]
+                    ),
+                    tuple(AGGREGATED_TORRENT_FIELDS),
+                )
+            )
+        if self.config.get("tracker_metrics"):
+            aggregations.append((("tracker",), ("dlspeed", "upspeed")))
+        return aggregations
+
+    def _get_torrent_hashes(self) -> list[str]:
+        with self._mirror_lock:
+            return list(self.mirror.torrents.index)
+
+    def _get_client(self) -> Client:
+        """
+        Returns the shared client, creating a new one on first use or after the
+        previous one failed.
+        """
+        with self._client_lock:
+            if self.client is None or self._client_invalid:
+                if self.client is not None:
+                    self.reconnects += 1
+                    logger.info("Reconnecting to qBittorrent server")
+                self._create_client()
+                self._client_invalid = False
+            return self.client  # type: ignore[return-value]
+
+    def _invalidate_client(self) -> None:
+        """
+        Flags the client as broken so the next scrape starts from a fresh one,
+        instead of reusing any stale state (e.g. the HTTP fallback triggered by
+        qbittorrentapi after an SSL failure).
+        """
+        self._client_invalid = True
+
     def _create_client(self) -> None:
         client_args: dict[str, Any] = {
             "host": self.connection_string,
             "VERIFY_WEBUI_CERTIFICATE": self.config["verify_webui_certificate"],
         }
+        requests_args: dict[str, Any] = {
+            "hooks": {"response": [self.instrumentation.record_response]}
+        }
+        if self.config.get("timeout"):
+            requests_args["timeout"] = self.config["timeout"]
+        client_args["REQUESTS_ARGS"] = requests_args
 
         # qBittorrent 5.2+ supports API key auth via bearer tokens
         if self.config.get("api_key"):
@@ -69,80 +479,411 @@ class QbittorrentMetricsCollector:
             client_args["username"] = self.config["username"]
             client_args["password"] = self.config["password"]
 
-        self.client = Client(**client_args)
+        client = Client(**client_args)
+
+        # qbittorrentapi logs in again by itself when the session cookie expires
+        # (the server answers 403), so count every login attempt it makes.
+        log_in = client.auth_log_in
+
+        def _counted_log_in(*args: Any, **kwargs: Any) -> None:
+            self.logins += 1
+            with self.instrumentation.phase("login"):
+                log_in(*args, **kwargs)
+
+        client.auth_log_in = _counted_log_in  # type: ignore[method-assign]
+        self.client = client
+
+        # A new client means a new session on the server, whose sync state
+        # starts over.
+        with self._mirror_lock:
+            self.mirror.reset()
+            self._version = ""
 
     def collect(self) -> Iterable[GaugeMetricFamily | CounterMetricFamily]:
         """
         Yields Prometheus gauges and counters from metrics collected from qbittorrent.
+
+        When polling in the background, the metrics from the last poll are
+        yielded instead of querying qbittorrent.
         """
-        self._create_client()
-        for metric in self._get_qbittorrent_status_metrics():
-            if metric.metric_type == MetricType.COUNTER:
-                prom_metric = CounterMetricFamily(
-                    metric.name, metric.help_text, labels=list(metric.labels.keys())
-                )
-            else:
-                prom_metric = GaugeMetricFamily(
-                    metric.name, metric.help_text, labels=list(metric.labels.keys())
-                )
-            prom_metric.add_metric(
-                value=metric.value, labels=list(metric.labels.values())
+        if self.config.get("poll_interval"):
+            families = self._families
+        else:
+            families = self.refresh(scrape_deadline.get())
+        yield from families
+        yield from self._get_exporter_families()
+
+    def refresh(
+        self, deadline: float | None = None
+    ) -> list[GaugeMetricFamily | CounterMetricFamily]:
+        """
+        Fetches fresh data from qbittorrent and builds the metric families,
+        giving up on the requests at the `deadline` (in `time.monotonic()` time).
+
+        Concurrent scrapes share a single refresh, as do scrapes coming within
+        `min_refresh_interval` seconds of the last one. A scrape that can't
+        wait for the shared refresh until its `deadline` gets the families of
+        the previous refresh.
+        """
+        try:
+            return self._single_flight.run(
+                partial(self._refresh, deadline), timeout=_seconds_left(deadline)
             )
-            yield prom_metric
+        except FutureTimeoutError:
+            logger.error("Timed out waiting for a concurrent scrape to get server info")
+            return self._families
 
-        for gauge in self._get_qbittorrent_by_torrent_metric_gauges():
-            yield gauge
+    def _refresh(
+        self, deadline: float | None = None
+    ) -> list[GaugeMetricFamily | CounterMetricFamily]:
+        """
+        Refreshes the metric families. While the scheduler holds the fetches
+        back, the families of the last refresh are returned instead.
+        """
+        if self.scheduler and not self.scheduler.due():
+            self.scheduler.skip()
+            return self._families
 
-        yield self._get_qbittorrent_torrent_tags_metrics_gauge()
+        self._get_client()
+        snapshot = self._fetch_snapshot(deadline)
+        if (
+            self.tracker_crawler
+            and not self._tracker_crawler_started
+            and self.last_successful_refresh is not None
+        ):
+            # Once the server answered, so the crawler doesn't start failing
+            self._tracker_crawler_started = True
+            self.tracker_crawler.start()
 
-    def _get_qbittorrent_by_torrent_metric_gauges(self) -> list[GaugeMetricFamily]:
+        with self.instrumentation.phase("build"):
+            families: list[GaugeMetricFamily | CounterMetricFamily] = [
+                self._metric_to_family(metric)
+                for metric in self._get_qbittorrent_status_metrics(snapshot)
+            ]
+            families.extend(self._get_qbittorrent_by_torrent_metric_gauges(snapshot))
+            families.append(self._get_qbittorrent_torrent_tags_metrics_gauge(snapshot))
+            families.extend(self._get_qbittorrent_aggregate_metric_gauges(snapshot))
+            families.extend(self._get_qbittorrent_tracker_metric_gauges(snapshot))
+            families.extend(self._get_qbittorrent_torrent_histograms(snapshot))
+        self.instrumentation.record_series(families)
+
+        self._families = families
+        return families
+
+    def seconds_to_next_fetch(self) -> float:
+        """Returns the seconds until the scheduler lets the next fetch happen."""
+        return self.scheduler.seconds_to_next_fetch() if self.scheduler else 0.0
+
+    def _metric_to_family(
+        self, metric: Metric
+    ) -> GaugeMetricFamily | CounterMetricFamily:
+        """Converts a single `Metric` into a Prometheus metric family."""
+        prom_metric: GaugeMetricFamily | CounterMetricFamily
+        if metric.metric_type == MetricType.COUNTER:
+            prom_metric = CounterMetricFamily(
+                metric.name, metric.help_text, labels=list(metric.labels.keys())
+            )
+        else:
+            prom_metric = GaugeMetricFamily(
+                metric.name, metric.help_text, labels=list(metric.labels.keys())
+            )
+        prom_metric.add_metric(value=metric.value, labels=list(metric.labels.values()))
+        return prom_metric
+
+    def _get_exporter_families(self) -> list[Any]:
+        """
+        Returns the metric families about the exporter itself.
+        """
+        return [
+            *(
+                self._metric_to_family(metric)
+                for metric in self._get_exporter_metrics()
+            ),
+            *self.instrumentation.collect(),
+        ]
+
+    def _get_exporter_metrics(self) -> list[Metric]:
+        """
+        Returns metrics about the exporter itself.
+        """
+        metrics = [
+            Metric(
+                name=f"{self.config['metrics_prefix']}_exporter_logins",
+                value=self.logins,
+                labels={"server": self.server},
+                help_text="Number of login attempts made to the qBittorrent server.",
+                metric_type=MetricType.COUNTER,
+            ),
+            Metric(
+                name=f"{self.config['metrics_prefix']}_exporter_client_reconnects",
+                value=self.reconnects,
+                labels={"server": self.server},
+                help_text=(
+                    "Number of times the client was recreated after a failed"
+                    " request to the qBittorrent server."
+                ),
+                metric_type=MetricType.COUNTER,
+            ),
+        ]
+
+        if self.scheduler:
+            metrics.extend(
+                [
+                    Metric(
+                        name=(
+                            f"{self.config['metrics_prefix']}"
+                            "_exporter_poll_interval_seconds"
+                        ),
+                        value=self.scheduler.interval,
+                        labels={"server": self.server},
+                        help_text=(
+                            "Current seconds between requests to the qBittorrent"
+                            " server, stretched when it answers slowly and backed"
+                            " off when it fails."
+                        ),
+                    ),
+                    Metric(
+                        name=(
+                            f"{self.config['metrics_prefix']}"
+                            "_exporter_consecutive_failures"
+                        ),
+                        value=self.scheduler.failures,
+                        labels={"server": self.server},
+                        help_text=(
+                            "Failed refreshes since the last successful one. The"
+                            " exporter is backing off while it's greater than 0."
+                        ),
+                    ),
+                    Metric(
+                        name=(
+                            f"{self.config['metrics_prefix']}"
+                            "_exporter_skipped_refreshes"
+                        ),
+                        value=self.scheduler.skipped,
+                        labels={"server": self.server},
+                        help_text=(
+                            "Refreshes answered with the previous data to spare"
+                            " the qBittorrent server."
+                        ),
+                        metric_type=MetricType.COUNTER,
+                    ),
+                ]
+            )
+
+        if self.last_successful_refresh is not None:
+            metrics.extend(
+                [
+                    Metric(
+                        name=(
+                            f"{self.config['metrics_prefix']}"
+                            "_exporter_last_successful_poll_timestamp_seconds"
+                        ),
+                        value=self.last_successful_refresh,
+                        labels={"server": self.server},
+                        help_text=(
+                            "Unix time of the last successful poll of the"
+                            " qBittorrent server."
+                        ),
+                    ),
+                    Metric(
+                        name=f"{self.config['metrics_prefix']}_exporter_data_age_seconds",
+                        value=time.time() - self.last_successful_refresh,
+                        labels={"server": self.server},
+                        help_text=(
+                            "Seconds since the data of the exported metrics was"
+                            " fetched from the qBittorrent server."
+                        ),
+                    ),
+                ]
+            )
+
+        return metrics
+
+    def _get_qbittorrent_by_torrent_metric_gauges(
+        self, snapshot: Snapshot
+    ) -> list[GaugeMetricFamily]:
         if not self.config.get("export_metrics_by_torrent", False):
             return []
 
-        torrent_size_gauge = GaugeMetricFamily(
+        identity = self.config.get("torrent_metrics_identity", "name")
+        label_cache = self._torrent_labels
+        torrent_size_gauge = PrerenderedGaugeFamily(
             f"{self.config['metrics_prefix']}_torrent_size",
             "Size of the torrent",
-            labels=["name", "category", "server"],
+            labels=label_cache.label_names,
         )
 
-        torrent_downloaded_gauge = GaugeMetricFamily(
+        torrent_downloaded_gauge = PrerenderedGaugeFamily(
             f"{self.config['metrics_prefix']}_torrent_downloaded",
             "Downloaded data for the torrent",
-            labels=["name", "category", "server"],
+            labels=label_cache.label_names,
         )
+        gauges: list[GaugeMetricFamily | CounterMetricFamily] = [
+            torrent_size_gauge,
+            torrent_downloaded_gauge,
+        ]
 
-        for torrent in self._fetch_torrents():
-            torrent_size_gauge.add_metric(
-                value=torrent["size"],
-                labels=[torrent["name"], torrent["category"], self.server],
+        torrents = snapshot.torrents
+        # Every field is read from the same snapshot, without asking the server
+        field_families = []
+        for field_name in self.config.get("torrent_metrics_fields", []):
+            metric = TORRENT_FIELD_METRICS[field_name]
+            family_class = (
+                PrerenderedCounterFamily if metric.counter else PrerenderedGaugeFamily
+            )
+            family = family_class(
+                f"{self.config['metrics_prefix']}_torrent_{field_name}",
+                metric.help_text,
+                labels=label_cache.label_names,
             )
-            torrent_downloaded_gauge.add_metric(
-                value=torrent["downloaded"],
-                labels=[torrent["name"], torrent["category"], self.server],
+            field_families.append(
+                (family, torrents.column(field_name), metric.summable, field_name)
             )
+            gauges.append(family)
+        now = time.time()
 
-        return [torrent_size_gauge, torrent_downloaded_gauge]
+        info_cache = self._torrent_info_labels
+        torrent_info_gauge = None
+        if identity == "info":
+            torrent_info_gauge = PrerenderedGaugeFamily(
+                f"{self.config['metrics_prefix']}_torrent_info",
+                "Name and category of the torrent with each hash",
+                labels=info_cache.label_names,
+            )
+            gauges.append(torrent_info_gauge)
 
-    def _get_qbittorrent_status_metrics(self) -> list[Metric]:
+        hashes = torrents.column("hash")
+        names = torrents.column("name")
+        categories = torrents.column("category")
+        sizes = torrents.column("size")
+        downloaded = torrents.column("downloaded")
+
+        # The labels of a torrent are only rendered again when they change
+        if len(label_cache) > len(torrents):
+            label_cache.retain(hashes)
+        if len(info_cache) > len(torrents):
+            info_cache.retain(hashes)
+        # Unlike labels, a removed torrent must be forgotten at once, so its
+        # counters start over if it's added again
+        for starts in self._torrent_counter_starts.values():
+            starts.retain(hashes)
+
+        columns = {"hash": hashes, "name": names, "category": categories}
+        label_columns = [columns[name] for name in label_cache.label_names[:-1]]
+        rows = self._select_top_torrents(torrents)
+        for row in rows:
+            labels = label_cache.get(
+                hashes[row],
+                (*[column[row] for column in label_columns], self.server),
+            )
+            torrent_size_gauge.add_rendered(labels, sizes[row])
+            torrent_downloaded_gauge.add_rendered(labels, downloaded[row])
+            for family, column, _, field_name in field_families:
+                if isinstance(family, PrerenderedCounterFamily):
+                    value = column[row]
+                    family.add_rendered(
+                        labels,
+                        value,
+                        self._torrent_counter_starts[field_name].created(
+                            hashes[row], value, now
+                        ),
+                    )
+                else:
+                    family.add_rendered(labels, column[row])
+            if torrent_info_gauge is not None:
+                torrent_info_gauge.add_rendered(
+                    info_cache.get(
+                        hashes[row],
+                        (hashes[row], names[row], categories[row], self.server),
+                    ),
+                    1,
+                )
+
+        if not (
+            self.config.get("torrent_metrics_top_k")
+            or self.config.get("torrent_metrics_changed_within")
+        ):
+            return gauges
+
+        # The rest of the torrents are added up in a single series
+        others = len(torrents) - len(rows)
+        if others:
+            other_values = {
+                "hash": OTHER_TORRENTS,
+                "name": OTHER_TORRENTS,
+                "category": "",
+                "server": self.server,
+            }
+            labels = label_cache.render(
+                tuple(other_values[name] for name in label_cache.label_names)
+            )
+            torrent_size_gauge.add_rendered(
+                labels, sum(sizes) - sum(sizes[row] for row in rows)
+            )
+            torrent_downloaded_gauge.add_rendered(
+                labels, sum(downloaded) - sum(downloaded[row] for row in rows)
+            )
+            for family, column, summable, _ in field_families:
+                if summable:
+                    family.add_rendered(
+                        labels, sum(column) - sum(column[row] for row in rows)
+                    )
+            if torrent_info_gauge is not None:
+                torrent_info_gauge.add_rendered(
+                    info_cache.render(
+                        tuple(other_values[name] for name in info_cache.label_names)
+                    ),
+                    1,
+                )
+
+        torrents_dropped_gauge = GaugeMetricFamily(
+            f"{self.config['metrics_prefix']}_torrents_dropped",
+            f"Number of torrents added up in the {OTHER_TORRENTS} series of the"
+            " per torrent metrics",
+            labels=["server"],
+        )
+        torrents_dropped_gauge.add_metric(value=others, labels=[self.server])
+
+        return [*gauges, torrents_dropped_gauge]
+
+    def _select_top_torrents(self, torrents: TorrentTable) -> Sequence[int]:
         """
-        Returns metrics about the state of the qbittorrent server.
+        Returns the rows of the `torrent_metrics_top_k` torrents with the highest
+        `torrent_metrics_top_k_by` field, or every row when no limit is set.
+        When `torrent_metrics_changed_within` is set, they are chosen among the
+        active torrents and those changed within that many seconds only.
         """
-        maindata: dict[str, Any] = {}
-        version: str = ""
+        rows: Sequence[int] = range(len(torrents))
+        window = self.config.get("torrent_metrics_changed_within")
+        if window:
+            since = time.monotonic() - window
+            changed_at = torrents.changed_at
+            dlspeeds = torrents.column("dlspeed")
+            upspeeds = torrents.column("upspeed")
+            rows = [
+                row
+                for row in rows
+                if changed_at[row] >= since or dlspeeds[row] or upspeeds[row]
+            ]
 
-        # Fetch data from API
-        try:
-            maindata = self.client.sync_maindata()
-            version = self.client.app.version
-        except Exception as e:
-            logger.error(f"Couldn't get server info: {e}")
+        top_k = self.config.get("torrent_metrics_top_k", 0)
+        if not top_k or len(rows) <= top_k:
+            return rows
 
-        server_state = maindata.get("server_state", {})
+        column = torrents.column(self.config.get("torrent_metrics_top_k_by", "upspeed"))
+        return heapq.nlargest(top_k, rows, key=column.__getitem__)
+
+    def _get_qbittorrent_status_metrics(self, snapshot: Snapshot) -> list[Metric]:
+        """
+        Returns metrics about the state of the qbittorrent server.
+        """
+        version = snapshot.version
+        server_state = snapshot.server_state
 
         return [
             Metric(
                 name=f"{self.config['metrics_prefix']}_up",
-                value=bool(server_state),
+                value=bool(server_state) and not snapshot.stale,
                 labels={"version": version, "server": self.server},
                 help_text=(
                     "Whether the qBittorrent server is answering requests from this"
@@ -209,47 +950,163 @@ class QbittorrentMetricsCollector:
             ),
         ]
 
-    def _fetch_categories(self) -> dict:
-        """Fetches all categories in use from qbittorrent."""
-        try:
-            categories = dict(self.client.torrent_categories.categories)
-            for key, value in categories.items():
-                categories[key] = dict(value)  # type: ignore
-            return categories
-        except Exception as e:
-            logger.error(f"Couldn't fetch categories: {e}")
-            return {}
-
-    def _fetch_torrents(self) -> list[dict]:
-        """Fetches torrents from qbittorrent"""
+    def _fetch_snapshot(self, deadline: float | None = None) -> Snapshot:
+        """
+        Updates the local mirror with the changes since the previous scrape and
+        returns its current contents.
+
+        The API calls run concurrently and must finish by the `deadline`, or
+        within `scrape_timeout` when it's set. Otherwise the contents of the
+        mirror are returned as they are, flagged as stale.
+        """
+        client = self.client
+        if self.config.get("scrape_timeout"):
+            timeout_deadline = time.monotonic() + self.config["scrape_timeout"]
+            deadline = (
+                timeout_deadline
+                if deadline is None
+                else min(deadline, timeout_deadline)
+            )
+
+        # Another scrape may be fetching already; it has its own deadline
+        if not self._mirror_lock.acquire(timeout=_seconds_left(deadline, -1)):
+            logger.error("Timed out waiting for another scrape to get server info")
+            return Snapshot(torrents=TorrentTable(self.mirror.torrent_fields))
         try:
-            return [dict(_attr_dict) for _attr_dict in self.client.torrents.info()]
-        except Exception as e:
-            logger.error(f"Couldn't fetch torrents: {e}")
-            return []
+            requests_args = self._requests_args(deadline)
+            calls: dict[str, Callable[[], Any]] = {
+                "sync/maindata": partial(
+                    self._sync_maindata, client, self.mirror.rid, requests_args
+                ),
+            }
+            # The version only changes when the server restarts, which also
+            # means a new session and so a new client
+            if not self._version:
+                calls["app/version"] = partial(
+                    client.app_version, requests_args=requests_args
+                )
 
-    def _filter_torrents_by_category(
-        self, category: str, torrents: list[dict]
-    ) -> list[dict]:
-        """Filters torrents by the given category."""
-        return [
-            torrent
-            for torrent in torrents
-            if torrent["category"] == category
-            or (category == "Uncategorized" and torrent["category"] == "")
-        ]
+            started = time.monotonic()
+            try:
+                with self.instrumentation.phase("fetch"):
+                    results = self._call_api(calls, deadline)
+            except FutureTimeoutError:
+                logger.error(
+                    f"Timed out getting server info after"
+                    f" {time.monotonic() - started:.1f} seconds"
+                )
+                self._back_off(started)
+                return self._mirror_snapshot(stale=True)
+            except Exception as e:
+                logger.error(f"Couldn't get server info: {e}")
+                if _is_connection_failure(e):
+                    self._invalidate_client()
+                self._back_off(started)
+                return Snapshot(torrents=TorrentTable(self.mirror.torrent_fields))
+            if self.scheduler:
+                self.scheduler.record_success(started, time.monotonic() - started)
 
-    def _filter_torrents_by_state(
-        self, state: TorrentStates, torrents: list[dict]
-    ) -> list[dict]:
-        """Filters torrents by the given state."""
-        return [torrent for torrent in torrents if torrent["state"] == state.value]
+            with self.instrumentation.phase("apply"):
+                self._version = results.get("app/version", self._version)
+                self.mirror.apply(results["sync/maindata"])
+                self.last_successful_refresh = time.time()
+                return self._mirror_snapshot()
+        finally:
+            self._mirror_lock.release()
 
-    def _get_qbittorrent_torrent_tags_metrics_gauge(self) -> GaugeMetricFamily:
-        categories = self._fetch_categories()
-        torrents = self._fetch_torrents()
+    def _mirror_snapshot(self, stale: bool = False) -> Snapshot:
+        """Copies the contents of the mirror. The mirror lock must be held."""
+        return Snapshot(
+            server_state=dict(self.mirror.server_state),
+            version=self._version,
+            categories=dict(self.mirror.categories),
+            tags=sorted(self.mirror.tags),
+            torrents=self.mirror.torrents.copy(),
+            stale=stale,
+        )
+
+    def _requests_args(self, deadline: float | None) -> dict[str, Any]:
+        """
+        Returns the `requests` arguments of the API calls of a refresh, so no
+        request outlives its `deadline`, which would keep a worker busy.
+        """
+        timeout = self.config.get("timeout") or None
+        seconds_left = _seconds_left(deadline)
+        if seconds_left is not None:
+            # requests doesn't accept a timeout of 0
+            seconds_left = max(seconds_left, 0.001)
+            timeout = min(timeout or seconds_left, seconds_left)
+        return {"timeout": timeout} if timeout else {}
+
+    def _back_off(self, started: float) -> None:
+        if not self.scheduler:
+            return
+        self.scheduler.record_failure(started)
+        logger.warning(
+            f"Waiting {self.scheduler.delay:.1f} seconds before asking the server"
+            f" again, after {self.scheduler.failures} failed attempts"
+        )
+
+    def _sync_maindata(
+        self, client: Client, rid: int, requests_args: dict[str, Any] | None = None
+    ) -> dict:
+        """
+        Gets the changes since `rid`. The response is parsed here instead of by
+        `client.sync_maindata()` so only the torrent fields used by the metrics
+        are ever kept.
+        """
+        payload = client._post(
+            _name=APINames.Sync,
+            _method="maindata",
+            data={"rid": rid},
+            requests_args=requests_args,
+            response_class=bytes,
+        )
+        with self.instrumentation.phase("decode"):
+            maindata = load_maindata(payload, self.mirror.torrent_fields)
+        self.instrumentation.torrents_processed.labels(self.server).inc(
+            len(maindata.get("torrents", {}))
+        )
+        return maindata
 
-        metrics: list[Metric] = []
+    def _call_api(
+        self, calls: dict[str, Callable[[], Any]], deadline: float | None = None
+    ) -> dict[str, Any]:
+        """
+        Runs the given API calls concurrently and returns their results by
+        endpoint.
+
+        Raises the first error found, or `TimeoutError` if the calls haven't
+        finished by the `deadline` (in `time.monotonic()` time).
+        """
+        futures = {
+            endpoint: _api_executor.submit(
+                self.instrumentation.count_errors, endpoint, call
+            )
+            for endpoint, call in calls.items()
+        }
+        _, not_done = wait(futures.values(), timeout=_seconds_left(deadline))
+        if not_done:
+            raise FutureTimeoutError()
+        return {name: future.result() for name, future in futures.items()}
+
+    def _count_torrents_by_category_and_state(
+        self, torrents: TorrentTable
+    ) -> Counter[tuple[str, str]]:
+        """
+        Counts torrents for each (category, state) pair. Torrents without a
+        category are counted as "Uncategorized".
+        """
+        counts: Counter[tuple[str, str]] = Counter()
+        for (category, state), count in torrents.count_by("category", "state").items():
+            counts[(category or "Uncategorized", state)] += count
+        return counts
+
+    def _get_qbittorrent_torrent_tags_metrics_gauge(
+        self, snapshot: Snapshot
+    ) -> GaugeMetricFamily:
+        counts = self._count_torrents_by_category_and_state(snapshot.torrents)
+        categories = dict(snapshot.categories)
         categories["Uncategorized"] = {"name": "Uncategorized", "savePath": ""}
 
         torrents_count_gauge = GaugeMetricFamily(
@@ -259,18 +1116,523 @@ class QbittorrentMetricsCollector:
         )
 
         for category in categories:
-            category_torrents = self._filter_torrents_by_category(category, torrents)
             for state in TorrentStates:
-                state_torrents = self._filter_torrents_by_state(
-                    state, category_torrents
-                )
                 torrents_count_gauge.add_metric(
-                    value=len(state_torrents),
+                    value=counts[(category, state.value)],
                     labels=[state.value, category, self.server],
                 )
 
         return torrents_count_gauge
 
+    def _get_qbittorrent_aggregate_metric_gauges(
+        self, snapshot: Snapshot
+    ) -> list[GaugeMetricFamily]:
+        """
+        Adds up the transfer and size fields of the torrents, grouped by the
+        labels in `aggregate_metrics_by`. Torrents with several tags are added
+        to every one of them.
+        """
+        labels = self.config.get("aggregate_metrics_by")
+        if not labels:
+            return []
+
+        sums = snapshot.torrents.sum_by(
+            [AGGREGATE_LABELS[label] for label in labels],
+            list(AGGREGATED_TORRENT_FIELDS),
+        )
+        # Torrents without a category or tag go together with the ones in an
+        # "Uncategorized" category or with an "Untagged" tag
+        totals: dict[tuple[str, ...], Counter[str]] = {}
+        for key, key_sums in sums.items():
+            label_values = tuple(
+                value or {"category": "Uncategorized", "tag": "Untagged"}.get(label, "")
+                for label, value in zip(labels, key)
+            )
+            totals.setdefault(label_values, Counter()).update(key_sums)
+
+        gauges = []
+        for field_name, help_text in AGGREGATED_TORRENT_FIELDS.items():
+            gauge = GaugeMetricFamily(
+                f"{self.config['metrics_prefix']}_torrents_{field_name}",
+                help_text,
+                labels=[*labels, "server"],
+            )
+            for label_values, field_sums in totals.items():
+                gauge.add_metric(
+                    value=field_sums[field_name],
+                    labels=[*label_values, self.server],
+                )
+            gauges.append(gauge)
+        return gauges
+
+    def _get_qbittorrent_tracker_metric_gauges(
+        self, snapshot: Snapshot
+    ) -> list[GaugeMetricFamily]:
+        """
+        Builds the per tracker host metrics: the torrents using each tracker and
+        their speeds when `tracker_metrics` is enabled, and the status of the
+        trackers of every torrent when the tracker crawler runs.
+        """
+        prefix = self.config["metrics_prefix"]
+        gauges = []
+
+        if self.config.get("tracker_metrics"):
+            counts = snapshot.torrents.count_by("tracker")
+            without_tracker = counts.pop(("",), 0)
+            sums = snapshot.torrents.sum_by(["tracker"], ["dlspeed", "upspeed"])
+            by_host: dict[str, Counter[str]] = {}
+            for (url,), count in counts.items():
+                totals = by_host.setdefault(tracker_host(url), Counter())
+                totals.update(sums[(url,)])
+                totals["count"] += count
+
+            torrents_gauge = GaugeMetricFamily(
+                f"{prefix}_tracker_torrents",
+                "Number of torrents using each tracker host",
+                labels=["tracker", "server"],
+            )
+            dlspeed_gauge = GaugeMetricFamily(
+                f"{prefix}_tracker_dlspeed",
+                "Download speed of the torrents using each tracker host, in bytes"
+                " per second",
+                labels=["tracker", "server"],
+            )
+            upspeed_gauge = GaugeMetricFamily(
+                f"{prefix}_tracker_upspeed",
+                "Upload speed of the torrents using each tracker host, in bytes"
+                " per second",
+                labels=["tracker", "server"],
+            )
+            for host, totals in by_host.items():
+                torrents_gauge.add_metric([host, self.server], totals["count"])
+                dlspeed_gauge.add_metric([host, self.server], totals["dlspeed"])
+                upspeed_gauge.add_metric([host, self.server], totals["upspeed"])
+            without_tracker_gauge = GaugeMetricFamily(
+                f"{prefix}_torrents_without_tracker",
+                "Number of torrents not using any tracker at the moment, because"
+                " they are stopped or none of their trackers work",
+                labels=["server"],
+            )
+            without_tracker_gauge.add_metric([self.server], without_tracker)
+            gauges.extend(
+                [torrents_gauge, dlspeed_gauge, upspeed_gauge, without_tracker_gauge]
+            )
+
+        if self.tracker_crawler:
+            status_gauge = GaugeMetricFamily(
+                f"{prefix}_tracker_status_torrents",
+                "Number of torrents with a tracker on each host in each status,"
+                " as last seen by the tracker crawler",
+                labels=["tracker", "status", "server"],
+            )
+            for (host, status), count in self.tracker_crawler.status_counts().items():
+                status_gauge.add_metric([host, status, self.server], count)
+            crawled_gauge = GaugeMetricFamily(
+                f"{prefix}_tracker_crawled_torrents",
+                "Number of torrents whose trackers were fetched by the tracker"
+                " crawler",
+                labels=["server"],
+            )
+            crawled_gauge.add_metric(
+                [self.server], self.tracker_crawler.crawled_torrents()
+            )
+            gauges.extend([status_gauge, crawled_gauge])
+
+        return gauges
+
+    def _get_qbittorrent_torrent_histograms(
+        self, snapshot: Snapshot
+    ) -> list[HistogramMetricFamily]:
+        """
+        Returns the distributions of the torrents in `torrent_histograms`,
+        by category when `torrent_histograms_by_category` is enabled.
+        """
+        names = self.config.get("torrent_histograms")
+        if not names:
+            return []
+
+        by_category = self.config.get("torrent_histograms_by_category", False)
+        keys = ("category",) if by_category else ()
+        custom_buckets = self.config.get("torrent_histogram_buckets", {})
+        now = time.time()
+
+        histograms = []
+        for name in names:
+            histogram = TORRENT_HISTOGRAMS[name]
+            bounds = sorted(custom_buckets.get(name, histogram.buckets))
+            by_key = snapshot.torrents.histogram_by(
+                keys,
+                histogram.field,
+                bounds,
+                (lambda value: now - value) if histogram.since else None,
+            )
+            family = HistogramMetricFamily(
+                f"{self.config['metrics_prefix']}_{histogram.name}",
+                histogram.help_text,
+                labels=[*keys, "server"],
+            )
+            for key, (counts, total) in by_key.items():
+                label_values = [value or "Uncategorized" for value in key]
+                family.add_metric(
+                    [*label_values, self.server],
+                    buckets=[
+                        (floatToGoString(bound), count)
+                        for bound, count in zip([*bounds, math.inf], counts)
+                    ],
+                    sum_value=total,
+                )
+            histograms.append(family)
+        return histograms
+
+
+class MultiTargetCollector:
+    """
+    Collects metrics from several qbittorrent servers concurrently, using a
+    bounded pool of workers. A target that doesn't answer within its timeout is
+    reported as down without delaying the others.
+    """
+
+    def __init__(self, config: dict) -> None:
+        self.config = config
+        self.collectors = [
+            QbittorrentMetricsCollector({**config, **target})
+            for target in config["targets"]
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.get("max_workers", 8),
+            thread_name_prefix="qbittorrent-target",
+        )
+        # Refreshes still running, so a hung target never takes more than one
+        # worker
+        self._pending: dict[QbittorrentMetricsCollector, Future] = {}
+        self._families: list[GaugeMetricFamily | CounterMetricFamily] = []
+
+    def collect(self) -> Iterable[GaugeMetricFamily | CounterMetricFamily]:
+        """
+        Yields the metrics of every target, each family merged across targets.
+        """
+        if self.config.get("poll_interval"):
+            families = self._families
+        else:
+            families = self.refresh(scrape_deadline.get())
+        yield from families
+
+        yield from _merge_families(
+            family
+            for collector in self.collectors
+            for family in collector._get_exporter_families()
+        )
+
+    def seconds_to_next_fetch(self) -> float:
+        """Returns the seconds until the first target may be fetched again."""
+        return min(
+            (collector.seconds_to_next_fetch() for collector in self.collectors),
+            default=0.0,
+        )
+
+    def refresh(
+        self, deadline: float | None = None
+    ) -> list[GaugeMetricFamily | CounterMetricFamily]:
+        """
+        Refreshes every target concurrently and merges their metric families.
+        Targets that haven't answered by the `deadline` are reported as down.
+        """
+        started = time.monotonic()
+        futures: dict[QbittorrentMetricsCollector, Future] = {}
+        for collector in self.collectors:
+            future = self._pending.get(collector)
+            if future is None or future.done():
+                future = self._executor.submit(collector.refresh, deadline)
+                self._pending[collector] = future
+            futures[collector] = future
+
+        families: list[GaugeMetricFamily | CounterMetricFamily] = []
+        for collector, future in futures.items():
+            target_deadline = deadline
+            if collector.config.get("timeout"):
+                target_deadline = min(
+                    deadline or math.inf, started + collector.config["timeout"]
+                )
+            timeout = _seconds_left(target_deadline)
+            try:
+                families.extend(future.result(timeout=timeout))
+            except FutureTimeoutError:
+                logger.warning(f"Timed out collecting metrics from {collector.server}")
+                families.extend(self._get_down_metrics(collector))
+            except Exception as e:
+                logger.error(f"Couldn't collect metrics from {collector.server}: {e}")
+                families.extend(self._get_down_metrics(collector))
+
+        self._families = _merge_families(families)
+        return self._families
+
+    def _get_down_metrics(
+        self, collector: QbittorrentMetricsCollector
+    ) -> list[GaugeMetricFamily | CounterMetricFamily]:
+        """Returns the metrics of a target that didn't answer."""
+        return [
+            collector._metric_to_family(metric)
+            for metric in collector._get_qbittorrent_status_metrics(Snapshot())
+        ]
+
+
+def _seconds_left(deadline: float | None, default: Any = None) -> Any:
+    """
+    Returns the seconds left until a `time.monotonic()` deadline, or `default`
+    when there's no deadline.
+    """
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+def _merge_families(
+    families: Iterable[GaugeMetricFamily | CounterMetricFamily],
+) -> list[GaugeMetricFamily | CounterMetricFamily]:
+    """
+    Merges the samples of families with the same name, as every family must be
+    exposed only once.
+    """
+    merged: dict[str, GaugeMetricFamily | CounterMetricFamily] = {}
+    for family in families:
+        if family.name not in merged:
+            # Copy it, so the family cached by its collector is left untouched
+            merged[family.name] = copy.copy(family)
+            merged[family.name].samples = list(family.samples)
+        else:
+            merged[family.name].samples.extend(family.samples)
+    return list(merged.values())
+
+
+# Settings of the single server that are never used for probes
+PROBE_SECRET_SETTINGS = ["username", "password", "api_key"]
+
+
+class ProbeCollectorPool:
+    """
+    Keeps the collectors used by the `/probe` endpoint, so their clients stay
+    logged in between probes. Collectors idle for longer than
+    `probe_idle_timeout` are dropped, as are the least recently used ones when
+    there are more than `probe_cache_size`.
+    """
+
+    def __init__(self, config: dict) -> None:
+        # Probes may target any server, so they never get the credentials of
+        # the single server: only those of the module asked for
+        self.config = {
+            **config,
+            **{setting: "" for setting in PROBE_SECRET_SETTINGS},
+        }
+        self.modules: dict[str, dict] = config.get("modules", {})
+        self._collectors: OrderedDict[
+            tuple[str, str], tuple[QbittorrentMetricsCollector, float]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, target: str, module: str = "default") -> QbittorrentMetricsCollector:
+        """
+        Returns the collector for the given `host:port` target and module.
+
+        Raises `ValueError` when the target is invalid or the module is unknown.
+        """
+        if module not in self.modules:
+            raise ValueError(f"Unknown module {module!r}")
+
+        key = (target, module)
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if key in self._collectors:
+                collector, _ = self._collectors.pop(key)
+            else:
+                collector = QbittorrentMetricsCollector(
+                    {
+                        **self.config,
+                        **self.modules[module],
+                        **_parse_probe_target(target),
+                        "poll_interval": 0,
+                        "tracker_crawl_rate": 0,
+                    }
+                )
+            self._collectors[key] = (collector, now)
+            while len(self._collectors) > self.config.get("probe_cache_size", 100):
+                self._collectors.popitem(last=False)
+        return collector
+
+    def _evict(self, now: float) -> None:
+        idle_timeout = self.config.get("probe_idle_timeout", 600)
+        for key, (_, last_used) in list(self._collectors.items()):
+            if now - last_used > idle_timeout:
+                del self._collectors[key]
+
+
+def _parse_probe_target(target: str) -> dict:
+    """
+    Parses a probe target like `host:port`, `https://host:port` or
+    `http://host:port/url_base` into collector settings.
+    """
+    url = urlsplit(target if "://" in target else f"//{target}")
+    try:
+        port = url.port
+    except ValueError:
+        port = None
+    if not url.hostname or (not port and not url.scheme):
+        raise ValueError(f"Invalid target {target!r}")
+
+    settings: dict[str, Any] = {
+        "host": url.hostname,
+        "port": str(port or (443 if url.scheme == "https" else 80)),
+    }
+    if url.path.strip("/"):
+        settings["url_base"] = url.path.strip("/")
+    if url.scheme:
+        settings["ssl"] = url.scheme == "https"
+    return settings
+
+
+class Poller(threading.Thread):
+    """
+    Refreshes the metrics of a collector every `interval` seconds, so scrapes are
+    answered from memory and don't depend on how fast qbittorrent answers. The
+    interval is longer while the collector backs off from a failing or slow
+    server.
+
+    `on_refresh` is called after every refresh, e.g. to render the new metrics.
+    """
+
+    def __init__(
+        self,
+        collector: QbittorrentMetricsCollector | MultiTargetCollector,
+        interval: float,
+        on_refresh: Callable[[], None] | None = None,
+    ):
+        super().__init__(name="qbittorrent-poller", daemon=True)
+        self.collector = collector
+        self.interval = interval
+        self.on_refresh = on_refresh
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.collector.refresh()
+                if self.on_refresh:
+                    self.on_refresh()
+            except Exception as e:
+                logger.error(f"Couldn't refresh metrics: {e}")
+            elapsed = time.monotonic() - started
+            self._stop_event.wait(
+                max(self.interval - elapsed, self.collector.seconds_to_next_fetch())
+            )
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+class WorkerProcess(threading.Thread):
+    """
+    Polls qbittorrent from a separate process, which fetches, aggregates and
+    renders the metrics, and only sends the rendered exposition back through
+    a pipe. However big the library is, this process stays free to answer
+    scrapes from the `exposition_cache`.
+
+    The worker is started again whenever it exits. Until it sends metrics
+    again, or when it stops sending them for `WORKER_STALE_POLLS` polls, the
+    cache has none to serve. Scrapes then render the registry of this process,
+    where this thread, registered as a collector, reports the servers as down.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        exposition_cache: ExpositionCache,
+        restart_delay: float = 5,
+    ):
+        super().__init__(name="qbittorrent-worker", daemon=True)
+        self.config = config
+        self.exposition_cache = exposition_cache
+        self.restart_delay = restart_delay
+        self.process: BaseProcess | None = None
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        context = get_context("spawn")
+        while not self._stop_event.is_set():
+            receiver, sender = context.Pipe(duplex=False)
+            self.process = context.Process(
+                target=_run_worker,
+                args=(self.config, sender),
+                name="qbittorrent-worker",
+                daemon=True,
+            )
+            self.process.start()
+            # Only the worker writes, so reading stops when it exits
+            sender.close()
+            try:
+                while True:
+                    self.exposition_cache.set(receiver.recv())
+            except EOFError:
+                pass
+            finally:
+                receiver.close()
+            # The metrics of a dead worker would look up to date forever
+            self.exposition_cache.set(None)
+            self.process.join()
+
+            if not self._stop_event.is_set():
+                logger.error(
+                    f"Worker process exited with code {self.process.exitcode},"
+                    f" starting it again in {self.restart_delay} seconds"
+                )
+                self._stop_event.wait(self.restart_delay)
+
+    def collect(self) -> list[GaugeMetricFamily]:
+        up = GaugeMetricFamily(
+            f"{self.config['metrics_prefix']}_up",
+            "Whether the qBittorrent server is answering requests from this"
+            " exporter. A `version` label with the server version is added.",
+            labels=["version", "server"],
+        )
+        for target in self.config["targets"] or [{}]:
+            up.add_metric(["", _server_name({**self.config, **target})], 0)
+        return [up]
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def _run_worker(config: dict, connection: Connection) -> None:
+    """Polls qbittorrent and sends each rendered exposition to `connection`."""
+    # The exporter process handles the shutdown, and stops the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _add_log_handler()
+    logger.setLevel(config["log_level"])
+
+    collector: QbittorrentMetricsCollector | MultiTargetCollector
+    if config["targets"]:
+        collector = MultiTargetCollector(config)
+    else:
+        collector = QbittorrentMetricsCollector(config)
+    REGISTRY.register(collector)  # type: ignore
+
+    def send() -> None:
+        try:
+            connection.send(Exposition.render(REGISTRY))
+        except OSError:
+            # The exporter process is gone
+            poller.stop()
+
+    poller = Poller(
+        collector,
+        config["poll_interval"],
+        on_refresh=_timed_render(config, send),
+    )
+    poller.run()
+
 
 class ShutdownSignalHandler:
     def __init__(self):
@@ -303,6 +1665,46 @@ def _get_config_value(key: str, default: str = "") -> str:
     return os.environ.get(key, default)
 
 
+def _get_json_config_value(key: str, default: Any) -> Any:
+    value = _get_config_value(key, "")
+    if not value:
+        return default
+
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        logger.error(f"Unable to parse {key}: {e}")
+        sys.exit(1)
+
+
+def _get_targets_config() -> list[dict]:
+    """
+    Loads the list of qbittorrent servers to collect metrics from, if any. Keys
+    missing from a target take the value of the single server settings.
+    """
+    targets = _get_json_config_value("QBITTORRENT_TARGETS", [])
+    if not isinstance(targets, list) or not all(
+        isinstance(target, dict) for target in targets
+    ):
+        logger.error("QBITTORRENT_TARGETS must be a JSON list of objects")
+        sys.exit(1)
+    for target in targets:
+        if "port" in target:
+            target["port"] = str(target["port"])
+    return targets
+
+
+def _get_modules_config() -> dict[str, dict]:
+    """Loads the settings of the modules usable by the `/probe` endpoint."""
+    modules = _get_json_config_value("EXPORTER_MODULES", {})
+    if not isinstance(modules, dict) or not all(
+        isinstance(module, dict) for module in modules.values()
+    ):
+        logger.error("EXPORTER_MODULES must be a JSON object of objects")
+        sys.exit(1)
+    return modules
+
+
 def get_config() -> dict:
     """Loads all config values."""
     return {
@@ -313,27 +1715,95 @@ def get_config() -> dict:
         "username": _get_config_value("QBITTORRENT_USER", ""),
         "password": _get_config_value("QBITTORRENT_PASS", ""),
         "api_key": _get_config_value("QBITTORRENT_API_KEY", ""),
+        "timeout": float(_get_config_value("QBITTORRENT_TIMEOUT", "10")),
+        "scrape_timeout": float(_get_config_value("EXPORTER_SCRAPE_TIMEOUT", "0")),
+        "scrape_timeout_offset": float(
+            _get_config_value("EXPORTER_SCRAPE_TIMEOUT_OFFSET", "0.5")
+        ),
+        "targets": _get_targets_config(),
+        "max_workers": int(_get_config_value("EXPORTER_MAX_WORKERS", "8")),
+        "modules": _get_modules_config(),
+        "probe_cache_size": int(_get_config_value("EXPORTER_PROBE_CACHE_SIZE", "100")),
+        "probe_idle_timeout": float(
+            _get_config_value("EXPORTER_PROBE_IDLE_TIMEOUT", "600")
+        ),
         "exporter_address": _get_config_value("EXPORTER_ADDRESS", "0.0.0.0"),
         "exporter_port": int(_get_config_value("EXPORTER_PORT", "8000")),
         "log_level": _get_config_value("EXPORTER_LOG_LEVEL", "INFO"),
+        "poll_interval": float(_get_config_value("EXPORTER_POLL_INTERVAL", "0")),
+        "worker_process": (
+            _get_config_value("EXPORTER_WORKER_PROCESS", "False") == "True"
+        ),
+        "min_refresh_interval": float(
+            _get_config_value("EXPORTER_MIN_REFRESH_INTERVAL", "0")
+        ),
+        "max_backoff": float(_get_config_value("EXPORTER_MAX_BACKOFF", "0")),
         "metrics_prefix": _get_config_value("METRICS_PREFIX", "qbittorrent"),
         "export_metrics_by_torrent": (
             _get_config_value("EXPORT_METRICS_BY_TORRENT", "False") == "True"
         ),
+        "aggregate_metrics_by": [
+            label.strip()
+            for label in _get_config_value("AGGREGATE_METRICS_BY", "").split(",")
+            if label.strip()
+        ],
+        "tracker_metrics": _get_config_value("TRACKER_METRICS", "False") == "True",
+        "tracker_crawl_rate": float(_get_config_value("TRACKER_CRAWL_RATE", "0")),
+        "tracker_crawl_ttl": float(_get_config_value("TRACKER_CRAWL_TTL", "3600")),
+        "torrent_histograms": [
+            name.strip()
+            for name in _get_config_value("TORRENT_HISTOGRAMS", "").split(",")
+            if name.strip()
+        ],
+        "torrent_histograms_by_category": (
+            _get_config_value("TORRENT_HISTOGRAMS_BY_CATEGORY", "False") == "True"
+        ),
+        "torrent_histogram_buckets": _get_json_config_value(
+            "TORRENT_HISTOGRAM_BUCKETS", {}
+        ),
+        "torrent_metrics_fields": [
+            name.strip()
+            for name in _get_config_value("TORRENT_METRICS_FIELDS", "").split(",")
+            if name.strip()
+        ],
+        "torrent_metrics_identity": _get_config_value(
+            "TORRENT_METRICS_IDENTITY", "name"
+        ),
+        "torrent_metrics_changed_within": float(
+            _get_config_value("TORRENT_METRICS_CHANGED_WITHIN", "0")
+        ),
+        "torrent_metrics_top_k": int(_get_config_value("TORRENT_METRICS_TOP_K", "0")),
+        "torrent_metrics_top_k_by": _get_config_value(
+            "TORRENT_METRICS_TOP_K_BY", "upspeed"
+        ),
         "verify_webui_certificate": (
             _get_config_value("VERIFY_WEBUI_CERTIFICATE", "True") == "True"
         ),
     }
 
 
-def main():
-    # Init logger so it can be used
+def _add_log_handler() -> None:
     logHandler = logging.StreamHandler()
     formatter = jsonlogger.JsonFormatter(
         "%(asctime) %(levelname) %(message)", datefmt="%Y-%m-%d %H:%M:%S"
     )
     logHandler.setFormatter(formatter)
     logger.addHandler(logHandler)
+
+
+def _timed_render(config: dict, render: Callable[[], None]) -> Callable[[], None]:
+    """Wraps `render` to observe how long it takes in a histogram."""
+    render_seconds = Histogram(
+        f"{config['metrics_prefix']}_exporter_render_seconds",
+        "Time spent rendering the metrics after each poll",
+        buckets=BUCKETS,
+    )
+    return render_seconds.time()(render)
+
+
+def main():
+    # Init logger so it can be used
+    _add_log_handler()
     logger.setLevel("INFO")  # default until config is loaded
 
     config = get_config()
@@ -344,23 +1814,130 @@ def main():
     # Register signal handler
     signal_handler = ShutdownSignalHandler()
 
-    if not config["host"]:
+    if config["targets"]:
+        for index, target in enumerate(config["targets"]):
+            if not target.get("host") or not target.get("port"):
+                logger.error(
+                    f"Target #{index} in QBITTORRENT_TARGETS has no host or port"
+                )
+                sys.exit(1)
+    elif config["host"] or not config["modules"]:
+        # Without any fixed server, the exporter can still be used for probing
+        if not config["host"]:
+            logger.error(
+                "No host specified, please set QBITTORRENT_HOST environment variable"
+            )
+            sys.exit(1)
+        if not config["port"]:
+            logger.error(
+                "No port specified, please set QBITTORRENT_PORT environment variable"
+            )
+            sys.exit(1)
+
+    for label in config["aggregate_metrics_by"]:
+        if label not in AGGREGATE_LABELS:
+            logger.error(
+                f"Unknown label {label!r} in AGGREGATE_METRICS_BY, use any of"
+                f" {', '.join(AGGREGATE_LABELS)}"
+            )
+            sys.exit(1)
+
+    if config["torrent_metrics_top_k_by"] not in INT_FIELDS | FLOAT_FIELDS:
         logger.error(
-            "No host specified, please set QBITTORRENT_HOST environment variable"
+            f"Unknown TORRENT_METRICS_TOP_K_BY {config['torrent_metrics_top_k_by']!r},"
+            f" use any numeric torrent field, e.g. upspeed, dlspeed or ratio"
         )
         sys.exit(1)
-    if not config["port"]:
+
+    for name in config["torrent_metrics_fields"]:
+        if name not in TORRENT_FIELD_METRICS:
+            logger.error(
+                f"Unknown field {name!r} in TORRENT_METRICS_FIELDS, use any of"
+                f" {', '.join(TORRENT_FIELD_METRICS)}"
+            )
+            sys.exit(1)
+
+    if config["torrent_metrics_identity"] not in TORRENT_IDENTITY_LABELS:
+        logger.error(
+            f"Unknown TORRENT_METRICS_IDENTITY {config['torrent_metrics_identity']!r},"
+            f" use any of {', '.join(TORRENT_IDENTITY_LABELS)}"
+        )
+        sys.exit(1)
+
+    buckets = config["torrent_histogram_buckets"]
+    if not isinstance(buckets, dict) or not all(
+        isinstance(bounds, list)
+        and all(
+            isinstance(bound, (int, float)) and not isinstance(bound, bool)
+            for bound in bounds
+        )
+        for bounds in buckets.values()
+    ):
         logger.error(
-            "No port specified, please set QBITTORRENT_PORT environment variable"
+            "TORRENT_HISTOGRAM_BUCKETS must be a JSON object of lists of numbers,"
+            ' e.g. {"ratio": [0.1, 1, 2]}'
         )
         sys.exit(1)
 
-    # Register our custom collector
+    for name in [*config["torrent_histograms"], *buckets]:
+        if name not in TORRENT_HISTOGRAMS:
+            logger.error(
+                f"Unknown torrent histogram {name!r}, use any of"
+                f" {', '.join(TORRENT_HISTOGRAMS)}"
+            )
+            sys.exit(1)
+
+    if config["worker_process"] and not config["poll_interval"]:
+        logger.error("EXPORTER_WORKER_PROCESS needs EXPORTER_POLL_INTERVAL to be set")
+        sys.exit(1)
+
     logger.info("Exporter is starting up")
-    REGISTRY.register(QbittorrentMetricsCollector(config))  # type: ignore
+    poller: Poller | WorkerProcess | None = None
+    exposition_cache = None
+    if (config["targets"] or config["host"]) and config["worker_process"]:
+        # The collector lives in the worker, which renders the metrics for us
+        logger.info(
+            f"Polling qBittorrent every {config['poll_interval']} seconds"
+            " from a worker process"
+        )
+        exposition_cache = ExpositionCache(
+            REGISTRY,
+            max_age=WORKER_STALE_POLLS
+            * max(config["poll_interval"], config["max_backoff"]),
+        )
+        poller = WorkerProcess(config, exposition_cache)
+        REGISTRY.register(poller)  # type: ignore
+        poller.start()
+    else:
+        # Register our custom collector
+        collector: QbittorrentMetricsCollector | MultiTargetCollector | None = None
+        if config["targets"]:
+            collector = MultiTargetCollector(config)
+        elif config["host"]:
+            collector = QbittorrentMetricsCollector(config)
+        if collector:
+            REGISTRY.register(collector)  # type: ignore
+
+        if collector and config["poll_interval"]:
+            # Metrics only change after each poll, so render them once per poll
+            logger.info(f"Polling qBittorrent every {config['poll_interval']} seconds")
+            exposition_cache = ExpositionCache(REGISTRY)
+            poller = Poller(
+                collector,
+                config["poll_interval"],
+                on_refresh=_timed_render(config, exposition_cache.update),
+            )
+            poller.start()
 
     # Start server
-    start_http_server(config["exporter_port"], config["exporter_address"])
+    server, _ = start_http_server(
+        config["exporter_port"],
+        config["exporter_address"],
+        exposition_cache=exposition_cache,
+        # Probing is only enabled by configuring the modules it can use
+        probe_pool=ProbeCollectorPool(config) if config["modules"] else None,
+        timeout_offset=config["scrape_timeout_offset"],
+    )
     logger.info(
         f"Exporter listening on {config['exporter_address']}:{config['exporter_port']}"
     )
@@ -368,6 +1945,10 @@ def main():
     while not signal_handler.is_shutting_down():
         time.sleep(1)
 
+    if poller:
+        poller.stop()
+    server.shutdown()
+
     logger.info("Exporter has shutdown")
 
 
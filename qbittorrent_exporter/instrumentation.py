@@ -0,0 +1,137 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.metrics_core import Metric
+from qbittorrentapi import HTTPError
+from requests import Response
+
+from qbittorrent_exporter.rendering import PrerenderedFamily
+
+T = TypeVar("T")
+
+# From 1ms to 10s, as most phases take a few milliseconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+API_PATH = "/api/v2/"
+
+
+def endpoint_of(url: str) -> str:
+    """Returns the API endpoint requested by a URL, e.g. `sync/maindata`."""
+    path = urlsplit(url).path
+    _, found, endpoint = path.partition(API_PATH)
+    return endpoint if found else ""
+
+
+class Instrumentation:
+    """
+    The metrics of the exporter about its own work for one qbittorrent server:
+    how long each phase of a refresh takes, and how each API endpoint answers.
+
+    The metrics aren't registered anywhere; the collector yields them along
+    with the rest of its metrics.
+    """
+
+    def __init__(self, prefix: str, server: str) -> None:
+        self.server = server
+        self.phase_seconds = Histogram(
+            f"{prefix}_exporter_phase_seconds",
+            "Time spent in each phase of a refresh: login, fetch (all the API"
+            " requests of a refresh, decoding included), decode, apply and build",
+            ["phase", "server"],
+            registry=None,
+            buckets=BUCKETS,
+        )
+        self.request_seconds = Histogram(
+            f"{prefix}_exporter_request_seconds",
+            "Time until the qBittorrent server answered each API endpoint",
+            ["endpoint", "server"],
+            registry=None,
+            buckets=BUCKETS,
+        )
+        self.response_bytes = Counter(
+            f"{prefix}_exporter_response_bytes",
+            "Bytes received from each API endpoint of the qBittorrent server",
+            ["endpoint", "server"],
+            registry=None,
+        )
+        self.request_errors = Counter(
+            f"{prefix}_exporter_request_errors",
+            "Failed requests to each API endpoint of the qBittorrent server",
+            ["endpoint", "server"],
+            registry=None,
+        )
+        self.torrents_processed = Counter(
+            f"{prefix}_exporter_torrents_processed",
+            "Torrents added or changed by the updates received from the"
+            " qBittorrent server",
+            ["server"],
+            registry=None,
+        )
+        self.series = Gauge(
+            f"{prefix}_exporter_series",
+            "Series of each metric family in the last refresh",
+            ["family", "server"],
+            registry=None,
+        )
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.perf_counter() - started)
+
+    def observe_phase(self, name: str, seconds: float) -> None:
+        self.phase_seconds.labels(name, self.server).observe(seconds)
+
+    def record_response(self, response: Response, *args: Any, **kwargs: Any) -> None:
+        """A `requests` response hook recording every API response."""
+        endpoint = endpoint_of(response.url)
+        if not endpoint:
+            return
+        self.request_seconds.labels(endpoint, self.server).observe(
+            response.elapsed.total_seconds()
+        )
+        self.response_bytes.labels(endpoint, self.server).inc(len(response.content))
+        if response.status_code >= 400:
+            self.request_errors.labels(endpoint, self.server).inc()
+
+    def count_errors(self, endpoint: str, call: Callable[[], T]) -> T:
+        """
+        Runs an API call, recording it as failed if it raises anything but an
+        error response, which `record_response` has recorded already.
+        """
+        try:
+            return call()
+        except HTTPError:
+            raise
+        except Exception:
+            self.request_errors.labels(endpoint, self.server).inc()
+            raise
+
+    def record_series(self, families: Iterable[Metric]) -> None:
+        for family in families:
+            self.series.labels(family.name, self.server).set(
+                # Without turning prerendered samples into `Sample`s
+                family.count_samples()
+                if isinstance(family, PrerenderedFamily)
+                else len(family.samples)
+            )
+
+    def collect(self) -> list[Metric]:
+        return [
+            family
+            for metric in (
+                self.phase_seconds,
+                self.request_seconds,
+                self.response_bytes,
+                self.request_errors,
+                self.torrents_processed,
+                self.series,
+            )
+            for family in metric.collect()
+        ]
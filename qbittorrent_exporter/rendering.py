@@ -0,0 +1,278 @@
+from typing import Any, Iterable, NamedTuple, Sequence
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.exposition import generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics_exposition
+from prometheus_client.registry import Collector
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+
+
+def escape_label_value(value: str) -> str:
+    """Escapes a label value like the Prometheus text format requires."""
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+class RenderedLabels(NamedTuple):
+    """Label values, and the label set rendered from them, e.g. `{a="1"} `."""
+
+    values: tuple[str, ...]
+    text: str
+
+
+class LabelCache:
+    """
+    Rendered label sets by key, e.g. torrent hash, so the labels of a series
+    are only escaped again when their values change.
+    """
+
+    def __init__(self, label_names: Sequence[str]) -> None:
+        self.label_names = tuple(label_names)
+        # Labels are rendered sorted by name, like `generate_latest` does
+        self._order = sorted(range(len(label_names)), key=label_names.__getitem__)
+        self._entries: dict[str, RenderedLabels] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, values: tuple[str, ...]) -> RenderedLabels:
+        entry = self._entries.get(key)
+        if entry is None or entry.values != values:
+            entry = self._entries[key] = self.render(values)
+        return entry
+
+    def render(self, values: tuple[str, ...]) -> RenderedLabels:
+        """Renders labels without caching them."""
+        text = ",".join(
+            f'{self.label_names[i]}="{escape_label_value(values[i])}"'
+            for i in self._order
+        )
+        return RenderedLabels(values, f"{{{text}}} ")
+
+    def retain(self, keys: Iterable[str]) -> None:
+        """Forgets the entries of every key but the given ones."""
+        keys = set(keys)
+        self._entries = {
+            key: entry for key, entry in self._entries.items() if key in keys
+        }
+
+
+class CounterStarts:
+    """
+    Unix times at which counters exported by key, e.g. torrent hash, started
+    counting: when their key was first seen, or their value last went down.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def created(self, key: str, value: float, now: float) -> float:
+        """Returns the time the counter of `key`, now at `value`, started."""
+        entry = self._entries.get(key)
+        created = now if entry is None or value < entry[0] else entry[1]
+        self._entries[key] = (value, created)
+        return created
+
+    def retain(self, keys: Iterable[str]) -> None:
+        """Forgets the counters of every key but the given ones."""
+        keys = set(keys)
+        self._entries = {
+            key: entry for key, entry in self._entries.items() if key in keys
+        }
+
+
+class PrerenderedFamily:
+    """
+    Keeps the samples of a family as rendered labels and values, written as
+    they are by `generate_text()` and `generate_openmetrics()`. Reading
+    `samples` returns them as regular samples, without changing the family,
+    so it works anywhere a regular one does.
+    """
+
+    name: str
+    documentation: str
+    _labelnames: tuple[str, ...]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._labels: list[RenderedLabels] = []
+        self._values: list[float] = []
+        self._samples: list[Sample] = []
+        super().__init__(*args, **kwargs)
+
+    @property
+    def samples(self) -> list[Sample]:
+        if not self._labels:
+            return self._samples
+        # A new list, as the family may be rendered by several scrapes at once
+        return [*self._samples, *self._prerendered_samples()]
+
+    @samples.setter
+    def samples(self, samples: list[Sample]) -> None:
+        self._samples = samples
+        self._clear_prerendered()
+
+    def add_metric(self, *args: Any, **kwargs: Any) -> None:
+        # The parent appends to `samples`, which is only the list of regular
+        # samples while there are no prerendered ones
+        labels, self._labels = self._labels, []
+        try:
+            super().add_metric(*args, **kwargs)
+        finally:
+            self._labels = labels
+
+    def count_samples(self) -> int:
+        return len(self._labels) + len(self._samples)
+
+    def render(self, openmetrics: bool = False) -> bytes | None:
+        """
+        Renders the family in the Prometheus text format, or the OpenMetrics
+        one, or returns None if it has samples that weren't added with
+        `add_rendered()`.
+        """
+        if self._samples:
+            return None
+        return "".join(self._render_lines(openmetrics)).encode("utf-8")
+
+    def _header(self, name: str, metric_type: str, openmetrics: bool) -> str:
+        documentation = self.documentation.replace("\\", r"\\").replace("\n", r"\n")
+        if openmetrics:
+            documentation = documentation.replace('"', r"\"")
+        return f"# HELP {name} {documentation}\n# TYPE {name} {metric_type}\n"
+
+    def _prerendered_samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+    def _render_lines(self, openmetrics: bool) -> Iterable[str]:
+        raise NotImplementedError
+
+    def _clear_prerendered(self) -> None:
+        self._labels, self._values = [], []
+
+
+class PrerenderedGaugeFamily(PrerenderedFamily, GaugeMetricFamily):
+    """A gauge whose samples can be added already rendered."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]) -> None:
+        super().__init__(name, documentation, labels=labels)
+
+    def add_rendered(self, labels: RenderedLabels, value: float) -> None:
+        self._labels.append(labels)
+        self._values.append(value)
+
+    def _prerendered_samples(self) -> Iterable[Sample]:
+        for labels, value in zip(self._labels, self._values):
+            yield Sample(self.name, dict(zip(self._labelnames, labels.values)), value)
+
+    def _render_lines(self, openmetrics: bool) -> Iterable[str]:
+        name = self.name
+        yield self._header(name, "gauge", openmetrics)
+        for labels, value in zip(self._labels, self._values):
+            yield f"{name}{labels.text}{floatToGoString(value)}\n"
+
+
+class PrerenderedCounterFamily(PrerenderedFamily, CounterMetricFamily):
+    """
+    A counter whose samples can be added already rendered, each with the
+    unix time it was created at.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]) -> None:
+        self._created: list[float] = []
+        super().__init__(name, documentation, labels=labels)
+
+    def add_rendered(
+        self, labels: RenderedLabels, value: float, created: float
+    ) -> None:
+        self._labels.append(labels)
+        self._values.append(value)
+        self._created.append(created)
+
+    def _prerendered_samples(self) -> Iterable[Sample]:
+        for labels, value, created in zip(self._labels, self._values, self._created):
+            label_dict = dict(zip(self._labelnames, labels.values))
+            yield Sample(f"{self.name}_total", label_dict, value)
+            yield Sample(f"{self.name}_created", dict(label_dict), created)
+
+    def _render_lines(self, openmetrics: bool) -> Iterable[str]:
+        total, created = f"{self.name}_total", f"{self.name}_created"
+        if openmetrics:
+            # Each total is followed by its created time, in the same family
+            yield self._header(self.name, "counter", openmetrics)
+            for labels, value, start in zip(self._labels, self._values, self._created):
+                yield f"{total}{labels.text}{floatToGoString(value)}\n"
+                yield f"{created}{labels.text}{floatToGoString(start)}\n"
+            return
+        # Like `generate_latest`, the created times are a gauge of their own
+        yield self._header(total, "counter", openmetrics)
+        for labels, value in zip(self._labels, self._values):
+            yield f"{total}{labels.text}{floatToGoString(value)}\n"
+        if self._labels:
+            yield self._header(created, "gauge", openmetrics)
+        for labels, value in zip(self._labels, self._created):
+            yield f"{created}{labels.text}{floatToGoString(value)}\n"
+
+    def count_samples(self) -> int:
+        return 2 * len(self._labels) + len(self._samples)
+
+    def _clear_prerendered(self) -> None:
+        super()._clear_prerendered()
+        self._created = []
+
+
+class _Families:
+    def __init__(self, families: list[Any]) -> None:
+        self.families = families
+
+    def collect(self) -> list[Any]:
+        return self.families
+
+
+def generate_text(registry: Collector) -> bytes:
+    """
+    Renders the metrics of a registry in the Prometheus text format, exactly
+    like `generate_latest`, but writes prerendered families as they are.
+    """
+    output = []
+    for family in registry.collect():
+        rendered = None
+        if isinstance(family, PrerenderedFamily):
+            rendered = family.render()
+        output.append(
+            rendered if rendered is not None else generate_latest(_Families([family]))
+        )
+    return b"".join(output)
+
+
+# Escapings under which the names of the exporter's metrics and labels are
+# written as they are, so prerendered families can be used
+OPENMETRICS_PRERENDERED_ESCAPINGS = {
+    openmetrics_exposition.UNDERSCORES,
+    openmetrics_exposition.ALLOWUTF8,
+}
+
+
+def generate_openmetrics(
+    registry: Collector,
+    escaping: str = openmetrics_exposition.UNDERSCORES,
+    version: str = "1.0.0",
+) -> bytes:
+    """
+    Renders the metrics of a registry in the OpenMetrics format, exactly like
+    its `generate_latest`, but writes prerendered families as they are.
+    """
+    prerendered = escaping in OPENMETRICS_PRERENDERED_ESCAPINGS
+    output = []
+    for family in registry.collect():
+        rendered = None
+        if prerendered and isinstance(family, PrerenderedFamily):
+            rendered = family.render(openmetrics=True)
+        if rendered is None:
+            rendered = openmetrics_exposition.generate_latest(
+                _Families([family]), escaping=escaping, version=version
+            ).removesuffix(b"# EOF\n")
+        output.append(rendered)
+    output.append(b"# EOF\n")
+    return b"".join(output)
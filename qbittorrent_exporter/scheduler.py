@@ -0,0 +1,66 @@
+import random
+import time
+
+# Seconds to wait after the first failure when nothing sets a longer interval
+MIN_BACKOFF = 1.0
+
+# Fetches are spaced by at least this many times how long the last one took, so
+# a slow server spends at most a fifth of its time answering the exporter
+STRETCH_FACTOR = 5
+
+
+class AdaptiveScheduler:
+    """
+    Decides when the qbittorrent server may be asked for data again, so the
+    exporter doesn't make a struggling server worse.
+
+    After a failed fetch, the next one waits for an exponential backoff with
+    jitter. After a slow one, the next one waits `STRETCH_FACTOR` times as long
+    as it took. Both waits are capped at `max_interval` seconds, and a single
+    success brings the schedule back to normal.
+
+    Fetches are never scheduled more often than `interval` seconds, which is
+    the poll interval when polling in the background, or 0 when each scrape
+    fetches.
+    """
+
+    def __init__(self, interval: float, max_interval: float) -> None:
+        self.base_interval = interval
+        self.max_interval = max_interval
+        # Seconds from the start of the last fetch until the next one is due
+        self.delay = 0.0
+        self.failures = 0
+        self.skipped = 0
+        self._next_fetch = 0.0
+
+    @property
+    def interval(self) -> float:
+        """The current interval between fetches."""
+        return max(self.base_interval, self.delay)
+
+    def due(self) -> bool:
+        return time.monotonic() >= self._next_fetch
+
+    def seconds_to_next_fetch(self) -> float:
+        return max(0.0, self._next_fetch - time.monotonic())
+
+    def skip(self) -> None:
+        self.skipped += 1
+
+    def record_success(self, started: float, duration: float) -> None:
+        """Records a fetch that started at `started` and took `duration`."""
+        self.failures = 0
+        self.delay = min(self.max_interval, duration * STRETCH_FACTOR)
+        self._next_fetch = started + self.delay
+
+    def record_failure(self, started: float) -> None:
+        """Records a fetch that started at `started` and failed."""
+        self.failures += 1
+        backoff = min(
+            self.max_interval,
+            max(self.base_interval, MIN_BACKOFF) * 2 ** min(self.failures - 1, 32),
+        )
+        # Random between half and all of the backoff, so exporters that lost
+        # the same server don't all come back at once
+        self.delay = random.uniform(backoff / 2, backoff)
+        self._next_fetch = started + self.delay
@@ -0,0 +1,258 @@
+import functools
+import gzip
+import hashlib
+import socket
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer
+from typing import Protocol
+from urllib.parse import parse_qs, urlparse
+
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.exposition import (
+    MetricsHandler,
+    choose_encoder,
+    generate_latest,
+    gzip_accepted,
+)
+from prometheus_client.openmetrics import exposition as openmetrics
+from prometheus_client.registry import Collector
+
+from qbittorrent_exporter.rendering import generate_openmetrics, generate_text
+
+SCRAPE_TIMEOUT_HEADER = "X-Prometheus-Scrape-Timeout-Seconds"
+
+# Content type of the text format, as prometheus_client sends it when rendering
+TEXT_CONTENT_TYPE = choose_encoder(None)[1]
+
+# `time.monotonic()` time by which the collectors must have returned their
+# metrics, for the scrape being answered by the current thread
+scrape_deadline: ContextVar[float | None] = ContextVar("scrape_deadline", default=None)
+
+
+@dataclass(frozen=True)
+class Exposition:
+    """
+    Metrics rendered in the Prometheus text format, both plain and gzipped, so
+    they can be written as they are to every request.
+    """
+
+    body: bytes
+    gzipped_body: bytes
+    etag: str
+
+    @classmethod
+    def render(cls, registry: CollectorRegistry) -> "Exposition":
+        body = generate_text(registry)
+        return cls(
+            body=body,
+            gzipped_body=gzip.compress(body),
+            etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+        )
+
+
+class ExpositionCache:
+    """
+    Holds the last rendered exposition of a registry. It must be updated every
+    time the data behind the registry changes, e.g. after each background poll.
+
+    An exposition older than `max_age` seconds isn't served anymore, and the
+    registry is rendered on every request instead.
+    """
+
+    def __init__(
+        self, registry: CollectorRegistry = REGISTRY, max_age: float | None = None
+    ) -> None:
+        self.registry = registry
+        self.max_age = max_age
+        self.exposition: Exposition | None = None
+        self.updated_at = 0.0
+
+    def update(self) -> None:
+        self.set(Exposition.render(self.registry))
+
+    def set(self, exposition: Exposition | None) -> None:
+        """Stores an exposition rendered elsewhere, or forgets it with None."""
+        self.exposition = exposition
+        self.updated_at = time.monotonic()
+
+    def current(self) -> Exposition | None:
+        """Returns the exposition to serve, if there is a fresh enough one."""
+        exposition = self.exposition
+        if (
+            self.max_age is not None
+            and time.monotonic() - self.updated_at > self.max_age
+        ):
+            return None
+        return exposition
+
+
+class ProbePool(Protocol):
+    def get(self, target: str, module: str = "default") -> Collector: ...
+
+
+class ExporterRequestHandler(MetricsHandler):
+    """
+    Serves the cached exposition when there is one, and falls back to rendering
+    the registry on every request like `prometheus_client` does otherwise.
+
+    `/probe?target=host:port&module=name` collects the metrics of any target,
+    with the settings of the given module.
+
+    Metrics collected for a request must be ready before the scrape timeout
+    sent by Prometheus, minus the server `timeout_offset`, and collectors get
+    that deadline from `scrape_deadline`.
+    """
+
+    server: "ExporterServer"
+
+    def do_GET(self) -> None:
+        token = scrape_deadline.set(self._deadline())
+        try:
+            self._get()
+        finally:
+            scrape_deadline.reset(token)
+
+    def _deadline(self) -> float | None:
+        try:
+            timeout = float(self.headers.get(SCRAPE_TIMEOUT_HEADER, ""))
+        except ValueError:
+            return None
+        if timeout <= 0:
+            return None
+        return time.monotonic() + max(0.0, timeout - self.server.timeout_offset)
+
+    def _get(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/probe":
+            self._probe(parse_qs(url.query))
+            return
+
+        cache = self.server.exposition_cache
+        exposition = cache.current() if cache else None
+        if exposition is None:
+            if "name[]" in parse_qs(url.query):
+                # Only prometheus_client filters the metrics by name
+                super().do_GET()
+            else:
+                self._send_rendered(self.registry)
+            return
+
+        if self._etag_matches(exposition.etag):
+            self.send_response(304)
+            self.send_header("ETag", exposition.etag)
+            self.end_headers()
+            return
+
+        gzipped = gzip_accepted(self.headers.get("Accept-Encoding", ""))
+        self._send(
+            200,
+            exposition.gzipped_body if gzipped else exposition.body,
+            TEXT_CONTENT_TYPE,
+            gzipped=gzipped,
+            headers={"ETag": exposition.etag, "Vary": "Accept-Encoding"},
+        )
+
+    def _probe(self, params: dict[str, list[str]]) -> None:
+        pool = self.server.probe_pool
+        if pool is None:
+            self._send(404, b"Probing is disabled\n", "text/plain")
+            return
+
+        target = params.get("target", [""])[0]
+        if not target:
+            self._send(400, b"Missing target parameter\n", "text/plain")
+            return
+        try:
+            collector = pool.get(target, params.get("module", ["default"])[0])
+        except ValueError as e:
+            self._send(400, f"{e}\n".encode(), "text/plain")
+            return
+
+        registry = CollectorRegistry(auto_describe=False)
+        registry.register(collector)
+        self._send_rendered(registry)
+
+    def _send_rendered(self, registry: CollectorRegistry) -> None:
+        """Renders the registry in the format asked for by the request."""
+        encoder, content_type = choose_encoder(self.headers.get("Accept"))
+        if encoder is generate_latest:
+            encoder = generate_text
+        elif getattr(encoder, "func", None) is openmetrics.generate_latest:
+            # What Prometheus asks for, unless told to scrape the text format
+            encoder = functools.partial(generate_openmetrics, **encoder.keywords)
+        body = encoder(registry)
+        gzipped = gzip_accepted(self.headers.get("Accept-Encoding", ""))
+        self._send(200, gzip.compress(body) if gzipped else body, content_type, gzipped)
+
+    def _send(
+        self,
+        status: int,
+        body: bytes,
+        content_type: str,
+        gzipped: bool = False,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _etag_matches(self, etag: str) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates
+
+
+class ExporterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        registry: CollectorRegistry = REGISTRY,
+        exposition_cache: ExpositionCache | None = None,
+        probe_pool: ProbePool | None = None,
+        timeout_offset: float = 0.5,
+    ) -> None:
+        self.exposition_cache = exposition_cache
+        self.probe_pool = probe_pool
+        self.timeout_offset = timeout_offset
+        super().__init__(address, ExporterRequestHandler.factory(registry))
+
+
+def start_http_server(
+    port: int,
+    addr: str = "0.0.0.0",
+    registry: CollectorRegistry = REGISTRY,
+    exposition_cache: ExpositionCache | None = None,
+    probe_pool: ProbePool | None = None,
+    timeout_offset: float = 0.5,
+) -> tuple[ExporterServer, threading.Thread]:
+    """Starts the HTTP server serving the metrics in a daemon thread."""
+    family, _, _, _, sockaddr = next(
+        iter(
+            socket.getaddrinfo(
+                addr, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+            )
+        )
+    )
+
+    class Server(ExporterServer):
+        address_family = family
+
+    server = Server(
+        (sockaddr[0], port), registry, exposition_cache, probe_pool, timeout_offset
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
@@ -0,0 +1,61 @@
+import math
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    Runs a function for many concurrent callers at once: while a call is in
+    flight, other callers wait for it and share its result instead of running
+    the function again.
+
+    A successful result is also shared with the callers that come within
+    `min_interval` seconds after it was returned.
+    """
+
+    def __init__(self, min_interval: float = 0) -> None:
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._future: Future[T] | None = None
+        self._finished_at = -math.inf
+
+    def run(self, function: Callable[[], T], timeout: float | None = None) -> T:
+        """
+        Returns the result of `function`, or of the call already in flight.
+
+        Raises `TimeoutError` if the call in flight doesn't finish within
+        `timeout` seconds. The caller running the function isn't limited.
+        """
+        with self._lock:
+            future = self._future
+            leader = future is None or (future.done() and not self._reusable(future))
+            if leader:
+                future = self._future = Future()
+        assert future is not None
+
+        if not leader:
+            return future.result(timeout)
+
+        try:
+            result = function()
+        except BaseException as e:
+            self._finish()
+            future.set_exception(e)
+            raise
+        self._finish()
+        future.set_result(result)
+        return result
+
+    def _reusable(self, future: Future[T]) -> bool:
+        return (
+            future.exception() is None
+            and time.monotonic() - self._finished_at < self.min_interval
+        )
+
+    def _finish(self) -> None:
+        with self._lock:
+            self._finished_at = time.monotonic()
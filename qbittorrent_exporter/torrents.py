@@ -0,0 +1,461 @@
+import json
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate, product, repeat
+from json.decoder import scanstring
+from typing import Any, Callable, Iterable, Iterator, MutableSequence, Sequence
+
+# Torrent fields stored in typed arrays, as documented in
+# https://github.com/qbittorrent/qBittorrent/wiki/WebUI-API-(qBittorrent-5.0)
+INT_FIELDS = frozenset(
+    {
+        "added_on",
+        "amount_left",
+        "completed",
+        "completion_on",
+        "dl_limit",
+        "dlspeed",
+        "downloaded",
+        "downloaded_session",
+        "eta",
+        "last_activity",
+        "num_complete",
+        "num_incomplete",
+        "num_leechs",
+        "num_seeds",
+        "priority",
+        "reannounce",
+        "seeding_time",
+        "seen_complete",
+        "size",
+        "time_active",
+        "total_size",
+        "up_limit",
+        "uploaded",
+        "uploaded_session",
+        "upspeed",
+    }
+)
+FLOAT_FIELDS = frozenset(
+    {"availability", "max_ratio", "popularity", "progress", "ratio", "ratio_limit"}
+)
+
+
+# String fields shared by many torrents, stored as codes into a list of their
+# distinct values
+INTERNED_FIELDS = frozenset({"category", "state", "tags", "tracker"})
+
+
+def _new_column(field_name: str) -> MutableSequence:
+    if field_name in INT_FIELDS:
+        return array("q")
+    if field_name in FLOAT_FIELDS:
+        return array("d")
+    if field_name in INTERNED_FIELDS:
+        return array("l")
+    return []
+
+
+def _default_value(field_name: str) -> Any:
+    if field_name in INT_FIELDS:
+        return 0
+    if field_name in FLOAT_FIELDS:
+        return 0.0
+    return ""
+
+
+def _split_tags(tags: str) -> tuple[str, ...]:
+    """Splits the comma separated `tags` of a torrent; "" when it has none."""
+    return tuple(tag.strip() for tag in tags.split(",")) if tags else ("",)
+
+
+class Aggregation:
+    """
+    The number of torrents, and the sums of some of their fields, for each
+    combination of values of the `keys` fields. Totals are kept by encoded key
+    in `[count, *sums]` lists.
+    """
+
+    def __init__(self, keys: Iterable[str], field_names: Iterable[str] = ()) -> None:
+        self.keys = tuple(keys)
+        self.field_names = tuple(field_names)
+        self.watched = frozenset(self.keys) | frozenset(self.field_names)
+        self.totals: dict[tuple, list[int | float]] = {}
+
+    def copy(self) -> "Aggregation":
+        aggregation = Aggregation(self.keys, self.field_names)
+        aggregation.totals = {key: totals[:] for key, totals in self.totals.items()}
+        return aggregation
+
+
+class TorrentTable:
+    """
+    Torrents stored by column, keeping only the given fields. Numbers are kept
+    in typed arrays, the strings in `INTERNED_FIELDS` as codes into a list of
+    their distinct values and everything else in lists, which takes a fraction
+    of the memory of a dict per torrent.
+
+    The table keeps the given `aggregations` (pairs of keys and fields to add
+    up) up to date as torrents are added, updated and removed, so reading them
+    costs the same with any number of torrents.
+
+    Rows have no particular order: removing a torrent moves the last row into
+    its place. `index` maps every torrent hash to its row.
+
+    `changed_at` holds the `time.monotonic()` time each torrent was added, or
+    last had any of the `tracked_fields` change value.
+    """
+
+    def __init__(
+        self,
+        fields: Iterable[str] = (),
+        aggregations: Iterable[tuple[Sequence[str], Sequence[str]]] = (),
+        tracked_fields: Iterable[str] = (),
+    ) -> None:
+        self.aggregations = [
+            Aggregation(keys, field_names) for keys, field_names in aggregations
+        ]
+        self.fields = tuple(
+            dict.fromkeys(
+                [
+                    "hash",
+                    *fields,
+                    *(name for a in self.aggregations for name in a.keys),
+                    *(name for a in self.aggregations for name in a.field_names),
+                ]
+            )
+        )
+        self.columns: dict[str, MutableSequence] = {
+            field_name: _new_column(field_name) for field_name in self.fields
+        }
+        self.index: dict[str, int] = {}
+        # Distinct values of the interned fields, and their codes
+        self.interned: dict[str, list[str]] = {
+            field_name: []
+            for field_name in self.fields
+            if field_name in INTERNED_FIELDS
+        }
+        self._codes: dict[str, dict[str, int]] = {
+            field_name: {} for field_name in self.interned
+        }
+        self.tracked_fields = frozenset(tracked_fields) & frozenset(self.fields)
+        self.changed_at = array("d")
+
+    @classmethod
+    def from_dicts(
+        cls, torrents: Iterable[dict], fields: Iterable[str] | None = None
+    ) -> "TorrentTable":
+        """
+        Builds a table from torrent dicts, with all their fields unless `fields`
+        is given. Torrents without a hash are given their position as hash.
+        """
+        torrents = list(torrents)
+        if fields is None:
+            fields = dict.fromkeys(key for torrent in torrents for key in torrent)
+        table = cls(fields)
+        for position, torrent in enumerate(torrents):
+            table.update(str(torrent.get("hash", position)), torrent)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, torrent_hash: str) -> bool:
+        return torrent_hash in self.index
+
+    def _encode(self, field_name: str, value: Any) -> Any:
+        codes = self._codes.get(field_name)
+        if codes is None:
+            return value
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.interned[field_name].append(value)
+        return code
+
+    def update(self, torrent_hash: str, torrent: dict[str, Any]) -> None:
+        """
+        Adds a torrent, or updates the fields of an existing one with the given
+        (possibly partial) dict. Fields not in the table are ignored.
+        """
+        columns = self.columns
+        row = self.index.get(torrent_hash)
+        if row is None:
+            row = self.index[torrent_hash] = len(self.index)
+            for field_name, column in columns.items():
+                column.append(
+                    self._encode(
+                        field_name,
+                        torrent.get(field_name, _default_value(field_name)),
+                    )
+                    if field_name != "hash"
+                    else torrent_hash
+                )
+            for aggregation in self.aggregations:
+                self._aggregate_row(aggregation, row, 1)
+            self.changed_at.append(time.monotonic())
+            return
+
+        # The row is taken out of the aggregations it is part of while it changes
+        touched = [a for a in self.aggregations if not a.watched.isdisjoint(torrent)]
+        for aggregation in touched:
+            self._aggregate_row(aggregation, row, -1)
+        tracked = self.tracked_fields
+        for field_name, value in torrent.items():
+            if field_name in columns and field_name != "hash":
+                value = self._encode(field_name, value)
+                column = columns[field_name]
+                if field_name in tracked and column[row] != value:
+                    self.changed_at[row] = time.monotonic()
+                column[row] = value
+        for aggregation in touched:
+            self._aggregate_row(aggregation, row, 1)
+
+    def remove(self, torrent_hash: str) -> None:
+        row = self.index.pop(torrent_hash, None)
+        if row is None:
+            return
+
+        for aggregation in self.aggregations:
+            self._aggregate_row(aggregation, row, -1)
+        last = len(self.index)
+        for column in [*self.columns.values(), self.changed_at]:
+            if row != last:
+                column[row] = column[last]
+            column.pop()
+        if row != last:
+            self.index[self.columns["hash"][row]] = row
+
+    def _aggregate_row(self, aggregation: Aggregation, row: int, sign: int) -> None:
+        """Adds (`sign` 1) or subtracts (`sign` -1) a row to an aggregation."""
+        columns = self.columns
+        key = tuple(columns[key][row] for key in aggregation.keys)
+        totals = aggregation.totals.get(key)
+        if totals is None:
+            totals = aggregation.totals[key] = [0] * (1 + len(aggregation.field_names))
+        totals[0] += sign
+        if not totals[0]:
+            del aggregation.totals[key]
+            return
+        for i, field_name in enumerate(aggregation.field_names, 1):
+            totals[i] += sign * columns[field_name][row]
+
+    def column(self, field_name: str) -> Sequence:
+        """Returns the values of a field, indexed by row."""
+        column = self.columns[field_name]
+        if field_name in self.interned:
+            return list(map(self.interned[field_name].__getitem__, column))
+        return column
+
+    def rows(self, *field_names: str) -> Iterator[tuple]:
+        """Iterates over the values of the given fields of every torrent."""
+        return zip(*(self.column(field_name) for field_name in field_names))
+
+    def get(self, torrent_hash: str) -> dict[str, Any] | None:
+        """Returns the stored fields of a torrent as a dict."""
+        row = self.index.get(torrent_hash)
+        if row is None:
+            return None
+        return {
+            field_name: self._decode_value(field_name, column[row])
+            for field_name, column in self.columns.items()
+        }
+
+    def _decode_value(self, field_name: str, value: Any) -> Any:
+        values = self.interned.get(field_name)
+        return value if values is None else values[value]
+
+    def to_dicts(self) -> list[dict[str, Any]]:
+        return [dict(zip(self.fields, values)) for values in self.rows(*self.fields)]
+
+    def copy(self) -> "TorrentTable":
+        table = TorrentTable(self.fields, tracked_fields=self.tracked_fields)
+        table.aggregations = [aggregation.copy() for aggregation in self.aggregations]
+        table.columns = {
+            field_name: column[:] for field_name, column in self.columns.items()
+        }
+        table.index = self.index.copy()
+        table.interned = {
+            field_name: values[:] for field_name, values in self.interned.items()
+        }
+        table._codes = {
+            field_name: codes.copy() for field_name, codes in self._codes.items()
+        }
+        table.changed_at = self.changed_at[:]
+        return table
+
+    def _decode_key(
+        self, keys: Sequence[str], coded_key: tuple
+    ) -> Iterator[tuple[str, ...]]:
+        """
+        Decodes a group key. A torrent with several tags belongs to one group
+        per tag, so grouping by "tags" can give several keys.
+        """
+        key = tuple(map(self._decode_value, keys, coded_key))
+        if "tags" not in keys:
+            return iter((key,))
+        return product(
+            *(
+                _split_tags(value) if name == "tags" else (value,)
+                for name, value in zip(keys, key)
+            )
+        )
+
+    def _find_aggregation(
+        self, keys: Sequence[str], field_names: Sequence[str]
+    ) -> Aggregation | None:
+        """Returns the kept aggregation by `keys` with all the `field_names`."""
+        for aggregation in self.aggregations:
+            if aggregation.keys == tuple(keys) and set(field_names).issubset(
+                aggregation.field_names
+            ):
+                return aggregation
+        return None
+
+    def count_by(self, *keys: str) -> Counter[tuple[str, ...]]:
+        """Counts the torrents for each combination of values of the `keys`."""
+        aggregation = self._find_aggregation(keys, ())
+        if aggregation is None:
+            coded_counts = Counter(zip(*(self.columns[key] for key in keys)))
+        else:
+            coded_counts = Counter(
+                {
+                    coded_key: totals[0]
+                    for coded_key, totals in aggregation.totals.items()
+                }
+            )
+
+        counts: Counter[tuple[str, ...]] = Counter()
+        for coded_key, count in coded_counts.items():
+            for key in self._decode_key(keys, coded_key):
+                counts[key] += count
+        return counts
+
+    def sum_by(
+        self, keys: Sequence[str], field_names: Sequence[str]
+    ) -> dict[tuple[str, ...], dict[str, int | float]]:
+        """
+        Adds up the `field_names` of the torrents for each combination of values
+        of the `keys`. Unless the table keeps that aggregation, it goes through
+        every torrent.
+        """
+        aggregation = self._find_aggregation(keys, field_names)
+        if aggregation is None:
+            aggregation = Aggregation(keys, field_names)
+            for row in range(len(self)):
+                self._aggregate_row(aggregation, row, 1)
+
+        positions = [aggregation.field_names.index(name) + 1 for name in field_names]
+        sums: dict[tuple[str, ...], dict[str, int | float]] = {}
+        for coded_key, totals in aggregation.totals.items():
+            for key in self._decode_key(keys, coded_key):
+                key_sums = sums.setdefault(key, dict.fromkeys(field_names, 0))
+                for field_name, position in zip(field_names, positions):
+                    key_sums[field_name] += totals[position]
+        return sums
+
+    def histogram_by(
+        self,
+        keys: Sequence[str],
+        field_name: str,
+        bounds: Sequence[float],
+        transform: Callable[[Any], float] | None = None,
+    ) -> dict[tuple[str, ...], tuple[list[int], float]]:
+        """
+        Counts the torrents whose `field_name` is at most each of the sorted
+        `bounds`, and at most infinity, for each combination of values of the
+        `keys`. Returns these cumulative counts with the sum of the values.
+        `transform` is applied to every value first.
+        """
+        values: Iterable[Any] = self.column(field_name)
+        if transform is not None:
+            values = map(transform, values)
+        coded_keys = zip(*(self.columns[key] for key in keys)) if keys else repeat(())
+
+        groups: dict[tuple, tuple[list[int], list[float]]] = {}
+        for coded_key, value in zip(coded_keys, values):
+            group = groups.get(coded_key)
+            if group is None:
+                group = groups[coded_key] = ([0] * (len(bounds) + 1), [0.0])
+            group[0][bisect_left(bounds, value)] += 1
+            group[1][0] += value
+
+        histograms: dict[tuple[str, ...], tuple[list[int], float]] = {}
+        for coded_key, (counts, total) in groups.items():
+            cumulative = list(accumulate(counts))
+            for key in self._decode_key(keys, coded_key):
+                previous = histograms.get(key)
+                if previous is None:
+                    histograms[key] = (cumulative, total[0])
+                else:
+                    histograms[key] = (
+                        [a + b for a, b in zip(previous[0], cumulative)],
+                        previous[1] + total[0],
+                    )
+        return histograms
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def _skip_whitespace(text: str, idx: int) -> int:
+    return _whitespace.match(text, idx).end()
+
+
+def _expect(text: str, idx: int, char: str) -> int:
+    if text[idx : idx + 1] != char:
+        raise json.JSONDecodeError(f"Expecting '{char}'", text, idx)
+    return _skip_whitespace(text, idx + 1)
+
+
+def _decode_object(
+    text: str, idx: int, decode_value: Callable[[str, int], tuple[Any, int]]
+) -> tuple[dict[str, Any], int]:
+    """
+    Decodes the JSON object starting at `idx`, using `decode_value(key, idx)`
+    to decode each of its values. Returns the object and where it ends.
+    """
+    idx = _expect(text, idx, "{")
+    result: dict[str, Any] = {}
+    if text[idx : idx + 1] == "}":
+        return result, idx + 1
+    while True:
+        if text[idx : idx + 1] != '"':
+            raise json.JSONDecodeError("Expecting property name", text, idx)
+        key, idx = scanstring(text, idx + 1)
+        idx = _expect(text, _skip_whitespace(text, idx), ":")
+        result[key], idx = decode_value(key, idx)
+        idx = _skip_whitespace(text, idx)
+        if text[idx : idx + 1] == "}":
+            return result, idx + 1
+        idx = _expect(text, idx, ",")
+
+
+def load_maindata(payload: bytes | str, torrent_fields: Iterable[str]) -> dict:
+    """
+    Parses a `sync/maindata` response keeping only the given fields of every
+    torrent. Torrents are decoded one at a time and projected right away, so
+    the complete torrent objects (about 50 fields each) never pile up.
+    """
+    text = payload.decode() if isinstance(payload, bytes) else payload
+    fields = frozenset(torrent_fields)
+
+    def decode_torrent(key: str, idx: int) -> tuple[Any, int]:
+        torrent, idx = _decoder.raw_decode(text, idx)
+        if isinstance(torrent, dict):
+            torrent = {name: value for name, value in torrent.items() if name in fields}
+        return torrent, idx
+
+    def decode_value(key: str, idx: int) -> tuple[Any, int]:
+        if key == "torrents" and text[idx : idx + 1] == "{":
+            return _decode_object(text, idx, decode_torrent)
+        return _decoder.raw_decode(text, idx)
+
+    maindata, idx = _decode_object(text, _skip_whitespace(text, 0), decode_value)
+    if _skip_whitespace(text, idx) != len(text):
+        raise json.JSONDecodeError("Extra data", text, idx)
+    return maindata
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Iterable
+from urllib.parse import urlsplit
+
+from qbittorrentapi import TrackerStatus
+
+logger = logging.getLogger()
+
+# Seconds the crawler waits at most before listing the torrents again, so new
+# torrents are crawled soon even when every known one is fresh
+RELIST_INTERVAL = 60
+
+
+def tracker_host(url: str) -> str:
+    """Returns the host of a tracker URL, or the URL itself if it has none."""
+    try:
+        return urlsplit(url).hostname or url
+    except ValueError:
+        return url
+
+
+class TrackerCrawler(threading.Thread):
+    """
+    Fetches the trackers of every torrent in turn, sending at most `rate`
+    requests per second, and keeps the status of each tracker host. The
+    trackers of a torrent are fetched again once they are `ttl` seconds old,
+    and new torrents within `RELIST_INTERVAL` seconds.
+
+    Scrapes only read the kept counts, so they cost the same with any number of
+    torrents. `list_torrents` returns the hashes of the current torrents, and
+    `fetch_trackers` the trackers of one of them.
+    """
+
+    def __init__(
+        self,
+        list_torrents: Callable[[], Iterable[str]],
+        fetch_trackers: Callable[[str], list[dict[str, Any]]],
+        rate: float,
+        ttl: float,
+    ):
+        super().__init__(name="qbittorrent-tracker-crawler", daemon=True)
+        self.list_torrents = list_torrents
+        self.fetch_trackers = fetch_trackers
+        self.rate = rate
+        self.ttl = ttl
+        self.requests = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        # Torrent hash -> (time of the fetch, (host, status) of its trackers)
+        self._entries: dict[str, tuple[float, frozenset[tuple[str, str]]]] = {}
+        # Torrents by (host, status), kept in step with `_entries`
+        self._counts: Counter[tuple[str, str]] = Counter()
+        self._queue: deque[str] = deque()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                delay = self.crawl_next()
+            except Exception as e:
+                logger.error(f"Couldn't crawl the trackers: {e}")
+                delay = 1 / self.rate
+            self._stop_event.wait(delay)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def crawl_next(self) -> float:
+        """
+        Fetches the trackers of the next torrent whose trackers are unknown or
+        stale, and returns the seconds to wait before the next one.
+        """
+        torrent_hash = self._next_stale_torrent()
+        if torrent_hash is None:
+            return self._seconds_to_next_expiry()
+
+        self.requests += 1
+        try:
+            self._store(torrent_hash, self.fetch_trackers(torrent_hash))
+        except Exception as e:
+            # Unexpected trackers, e.g. of an unknown status, are errors too
+            self.errors += 1
+            logger.error(f"Couldn't get the trackers of torrent {torrent_hash}: {e}")
+        return 1 / self.rate
+
+    def _next_stale_torrent(self) -> str | None:
+        """
+        Goes round the torrents, starting a new round with the current torrents
+        when the previous one is done. Returns None if no torrent in the rest of
+        the round needs its trackers fetched.
+        """
+        if not self._queue:
+            self._start_round()
+        now = time.monotonic()
+        while self._queue:
+            torrent_hash = self._queue.popleft()
+            entry = self._entries.get(torrent_hash)
+            if entry is None or now - entry[0] >= self.ttl:
+                return torrent_hash
+        return None
+
+    def _start_round(self) -> None:
+        torrents = list(self.list_torrents())
+        current = set(torrents)
+        with self._lock:
+            for torrent_hash in [h for h in self._entries if h not in current]:
+                _, statuses = self._entries.pop(torrent_hash)
+                self._counts.subtract(statuses)
+            self._counts = +self._counts
+        self._queue.extend(torrents)
+
+    def _seconds_to_next_expiry(self) -> float:
+        with self._lock:
+            oldest = min((entry[0] for entry in self._entries.values()), default=None)
+        if oldest is None:
+            return min(self.ttl, RELIST_INTERVAL)
+        return max(
+            1 / self.rate,
+            min(oldest + self.ttl - time.monotonic(), RELIST_INTERVAL),
+        )
+
+    def _store(self, torrent_hash: str, trackers: list[dict[str, Any]]) -> None:
+        statuses = frozenset(
+            (tracker_host(tracker["url"]), TrackerStatus(tracker["status"]).display)
+            for tracker in trackers
+            # DHT, PeX and LSD are listed as "** [DHT] **" and so on
+            if not tracker["url"].startswith("** [")
+        )
+        with self._lock:
+            previous = self._entries.get(torrent_hash)
+            if previous is not None:
+                self._counts.subtract(previous[1])
+            self._entries[torrent_hash] = (time.monotonic(), statuses)
+            self._counts.update(statuses)
+            self._counts = +self._counts
+
+    def status_counts(self) -> dict[tuple[str, str], int]:
+        """Returns the number of torrents by tracker host and status."""
+        with self._lock:
+            return dict(self._counts)
+
+    def crawled_torrents(self) -> int:
+        """Returns the number of torrents whose trackers are known."""
+        with self._lock:
+            return len(self._entries)
@@ -1,20 +1,30 @@
+import os
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
 
 from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
-from qbittorrentapi import TorrentStates
+from qbittorrentapi import APIConnectionError, HTTP500Error, TorrentStates
+from requests.exceptions import ReadTimeout
 
 from qbittorrent_exporter.exporter import (
     Metric,
     MetricType,
     QbittorrentMetricsCollector,
+    Snapshot,
+    get_config,
 )
+from qbittorrent_exporter.torrents import TorrentTable
+from tests.fake_qbittorrent import answer_with_sync_maindata
 
 
 class TestQbittorrentMetricsCollector(unittest.TestCase):
     def setUp(self):
         self.patcher = patch("qbittorrent_exporter.exporter.Client")
         self.mock_client = self.patcher.start()
+        answer_with_sync_maindata(self.mock_client.return_value)
         self.config = {
             "host": "localhost",
             "port": "8080",
@@ -27,20 +37,6 @@ class TestQbittorrentMetricsCollector(unittest.TestCase):
             "metrics_prefix": "qbittorrent",
             "export_metrics_by_torrent": True,
         }
-        self.torrentsState = [
-            {"name": "Torrent DOWNLOADING 1", "state": TorrentStates.DOWNLOADING},
-            {"name": "Torrent UPLOADING 1", "state": TorrentStates.UPLOADING},
-            {"name": "Torrent DOWNLOADING 2", "state": TorrentStates.DOWNLOADING},
-            {"name": "Torrent UPLOADING 2", "state": TorrentStates.UPLOADING},
-        ]
-        self.torrentsCategories = [
-            {"name": "Torrent Movies 1", "category": "Movies"},
-            {"name": "Torrent Music 1", "category": "Music"},
-            {"name": "Torrent Movies 2", "category": "Movies"},
-            {"name": "Torrent unknown", "category": ""},
-            {"name": "Torrent Music 2", "category": "Music"},
-            {"name": "Torrent Uncategorized 1", "category": "Uncategorized"},
-        ]
         self.collector = QbittorrentMetricsCollector(self.config)
         # Pre-create the client so tests that manipulate self.collector.client directly work.
         self.collector._create_client()
@@ -63,16 +59,70 @@ class TestQbittorrentMetricsCollector(unittest.TestCase):
             username=self.config["username"],
             password=self.config["password"],
             VERIFY_WEBUI_CERTIFICATE=self.config["verify_webui_certificate"],
+            REQUESTS_ARGS={
+                "hooks": {"response": [self.collector.instrumentation.record_response]}
+            },
         )
 
-    def test_collect_recreates_client(self):
-        """Each call to collect() must create a fresh Client so that
-        stale internal state (e.g. the HTTP fallback triggered by qbittorrentapi after
-        an SSL failure) does not persist across scrapes."""
+    def test_collect_reuses_client(self):
+        """The client (and its HTTP session) must be kept between scrapes."""
         self.mock_client.reset_mock()
-        list(self.collector.collect())
-        list(self.collector.collect())
+        collector = QbittorrentMetricsCollector(self.config)
+        list(collector.collect())
+        list(collector.collect())
+        self.assertEqual(self.mock_client.call_count, 1)
+        self.assertEqual(collector.reconnects, 0)
+
+    def test_collect_recreates_client_after_failure(self):
+        """A failed request must drop the client so that stale internal state
+        (e.g. the HTTP fallback triggered by qbittorrentapi after an SSL
+        failure) does not persist across scrapes."""
+        self.mock_client.reset_mock()
+        collector = QbittorrentMetricsCollector(self.config)
+        self.mock_client.return_value.sync_maindata.side_effect = APIConnectionError(
+            "Boom"
+        )
+        list(collector.collect())
+        list(collector.collect())
         self.assertEqual(self.mock_client.call_count, 2)
+        self.assertEqual(collector.reconnects, 1)
+
+    def test_collect_keeps_client_after_error_responses(self):
+        """Only failures to reach the server need a new client and session."""
+        self.mock_client.reset_mock()
+        collector = QbittorrentMetricsCollector(self.config)
+        client = self.mock_client.return_value
+
+        def time_out(**kwargs):
+            # Like qbittorrentapi wraps the errors of requests
+            try:
+                raise ReadTimeout()
+            except ReadTimeout:
+                raise APIConnectionError("Timeout Error")
+
+        for error in [
+            HTTP500Error("Internal Server Error"),
+            ValueError("Expecting value: line 1 column 1 (char 0)"),
+            time_out,
+        ]:
+            client.sync_maindata.side_effect = error
+            list(collector.collect())
+        client.sync_maindata.side_effect = None
+        list(collector.collect())
+
+        self.assertEqual(self.mock_client.call_count, 1)
+        self.assertEqual(collector.reconnects, 0)
+
+    def test_logins_are_counted(self):
+        self.collector.client.auth_log_in()
+        self.collector.client.auth_log_in()
+        self.assertEqual(self.collector.logins, 2)
+
+        metrics = {m.name: m for m in self.collector._get_exporter_metrics()}
+        logins = metrics["qbittorrent_exporter_logins"]
+        self.assertEqual(logins.value, 2)
+        self.assertEqual(logins.metric_type, MetricType.COUNTER)
+        self.assertEqual(metrics["qbittorrent_exporter_client_reconnects"].value, 0)
 
     def test_create_client_with_api_key(self):
         self.mock_client.reset_mock()
@@ -91,35 +141,40 @@ class TestQbittorrentMetricsCollector(unittest.TestCase):
         self.assertNotIn("password", kwargs)
 
     def test_collect_by_torrent_metric_gauges(self):
-        # Mock the return value of self.client.torrents.info()
-        self.collector.client.torrents.info.return_value = [
-            {
-                "name": "Torrent 1",
-                "size": 100,
-                "category": "category1",
-                "downloaded": 100,
-            },
-            {
-                "name": "Torrent 2",
-                "size": 200,
-                "category": "category2",
-                "downloaded": 200,
+        # Mock the torrents and categories returned by self.client.sync_maindata()
+        self.collector.client.sync_maindata.return_value = {
+            "rid": 1,
+            "full_update": True,
+            "torrents": {
+                "hash1": {
+                    "name": "Torrent 1",
+                    "size": 100,
+                    "category": "category1",
+                    "downloaded": 100,
+                },
+                "hash2": {
+                    "name": "Torrent 2",
+                    "size": 200,
+                    "category": "category2",
+                    "downloaded": 200,
+                },
+                "hash3": {
+                    "name": "Torrent 3",
+                    "size": 300,
+                    "category": "category3",
+                    "downloaded": 300,
+                },
             },
-            {
-                "name": "Torrent 3",
-                "size": 300,
-                "category": "category3",
-                "downloaded": 300,
+            "categories": {
+                "category1": {"name": "Category 1"},
+                "category2": {"name": "Category 2"},
+                "category3": {"name": "Category 3"},
             },
-        ]
-        # Mock the client.torrent_categories.categories attribute
-        self.collector.client.torrent_categories.categories = {
-            "category1": {"name": "Category 1"},
-            "category2": {"name": "Category 2"},
-            "category3": {"name": "Category 3"},
         }
 
-        result = self.collector._get_qbittorrent_by_torrent_metric_gauges()
+        result = self.collector._get_qbittorrent_by_torrent_metric_gauges(
+            self.collector._fetch_snapshot()
+        )
 
         torrent_size_metric = result[0]
         self.assertIsInstance(torrent_size_metric, GaugeMetricFamily)
@@ -153,8 +208,251 @@ class TestQbittorrentMetricsCollector(unittest.TestCase):
         )
         self.assertEqual(torrent_downloaded_metric.samples[0].value, 100)
 
+    def test_by_torrent_metric_gauges_top_k(self):
+        self.collector.config["torrent_metrics_top_k"] = 2
+        self.collector.config["torrent_metrics_top_k_by"] = "upspeed"
+        snapshot = Snapshot(
+            torrents=TorrentTable.from_dicts(
+                {
+                    "name": f"Torrent {i}",
+                    "category": "Movies",
+                    "size": 100 * i,
+                    "downloaded": 10 * i,
+                    "upspeed": upspeed,
+                }
+                for i, upspeed in enumerate([5, 50, 0, 500, 1])
+            )
+        )
+
+        size, downloaded, dropped = (
+            self.collector._get_qbittorrent_by_torrent_metric_gauges(snapshot)
+        )
+
+        self.assertEqual(
+            [(s.labels["name"], s.labels["category"], s.value) for s in size.samples],
+            [
+                ("Torrent 3", "Movies", 300),
+                ("Torrent 1", "Movies", 100),
+                ("__other__", "", 600),
+            ],
+        )
+        self.assertEqual(
+            [(s.labels["name"], s.value) for s in downloaded.samples],
+            [("Torrent 3", 30), ("Torrent 1", 10), ("__other__", 60)],
+        )
+        self.assertEqual(dropped.name, "qbittorrent_torrents_dropped")
+        self.assertEqual(dropped.samples[0].value, 3)
+
+    def test_by_torrent_labels_are_cached(self):
+        torrents = TorrentTable.from_dicts(
+            [
+                {
+                    "hash": "a",
+                    "name": "Torrent A",
+                    "category": "",
+                    "size": 1,
+                    "downloaded": 0,
+                },
+                {
+                    "hash": "b",
+                    "name": "Torrent B",
+                    "category": "",
+                    "size": 2,
+                    "downloaded": 0,
+                },
+            ]
+        )
+        self.collector._get_qbittorrent_by_torrent_metric_gauges(
+            Snapshot(torrents=torrents)
+        )
+        torrents.update("a", {"name": "Renamed"})
+        torrents.remove("b")
+
+        size, _ = self.collector._get_qbittorrent_by_torrent_metric_gauges(
+            Snapshot(torrents=torrents)
+        )
+
+        self.assertEqual([s.labels["name"] for s in size.samples], ["Renamed"])
+        self.assertEqual(len(self.collector._torrent_labels), 1)
+
+    def test_by_torrent_metric_gauges_identified_by_hash(self):
+        self.collector.config["torrent_metrics_identity"] = "hash"
+        collector = QbittorrentMetricsCollector(self.collector.config)
+        torrents = TorrentTable.from_dicts(
+            {
+                "hash": torrent_hash,
+                "name": "Cross-seeded",
+                "category": "",
+                "size": 1,
+                "downloaded": 0,
+            }
+            for torrent_hash in ["a", "b"]
+        )
+
+        size, _ = collector._get_qbittorrent_by_torrent_metric_gauges(
+            Snapshot(torrents=torrents)
+        )
+
+        self.assertEqual(
+            [(s.labels["hash"], s.labels["name"]) for s in size.samples],
+            [("a", "Cross-seeded"), ("b", "Cross-seeded")],
+        )
+
+    def test_by_torrent_metric_gauges_identified_by_info(self):
+        self.collector.config["torrent_metrics_identity"] = "info"
+        self.collector.config["torrent_metrics_top_k"] = 1
+        collector = QbittorrentMetricsCollector(self.collector.config)
+        torrents = TorrentTable.from_dicts(
+            {
+                "hash": torrent_hash,
+                "name": f"Torrent {torrent_hash}",
+                "category": "Movies",
+                "size": size,
+                "downloaded": 0,
+                "upspeed": size,
+            }
+            for torrent_hash, size in [("a", 1), ("b", 2)]
+        )
+
+        size, _, info, _ = collector._get_qbittorrent_by_torrent_metric_gauges(
+            Snapshot(torrents=torrents)
+        )
+
+        self.assertEqual(
+            [(s.labels, s.value) for s in size.samples],
+            [
+                ({"hash": "b", "server": "localhost:8080/qbt/"}, 2),
+                ({"hash": "__other__", "server": "localhost:8080/qbt/"}, 1),
+            ],
+        )
+        self.assertEqual(info.name, "qbittorrent_torrent_info")
+        self.assertEqual(
+            [(s.labels, s.value) for s in info.samples],
+            [
+                (
+                    {
+                        "hash": "b",
+                        "name": "Torrent b",
+                        "category": "Movies",
+                        "server": "localhost:8080/qbt/",
+                    },
+                    1,
+                ),
+                (
+                    {
+                        "hash": "__other__",
+                        "name": "__other__",
+                        "category": "",
+                        "server": "localhost:8080/qbt/",
+                    },
+                    1,
+                ),
+            ],
+        )
+
+    @patch("qbittorrent_exporter.exporter.time.time")
+    def test_by_torrent_metric_fields(self, mock_time):
+        self.collector.config["torrent_metrics_fields"] = ["uploaded", "ratio"]
+        self.collector.config["torrent_metrics_top_k"] = 1
+        collector = QbittorrentMetricsCollector(self.collector.config)
+        torrents = TorrentTable.from_dicts(
+            {
+                "hash": torrent_hash,
+                "name": f"Torrent {torrent_hash}",
+                "category": "",
+                "size": 1,
+                "downloaded": 0,
+                "upspeed": uploaded,
+                "uploaded": uploaded,
+                "ratio": uploaded / 10,
+            }
+            for torrent_hash, uploaded in [("a", 10), ("b", 20), ("c", 5)]
+        )
+        mock_time.return_value = 1000.0
+
+        size, _, uploaded, ratio, _ = (
+            collector._get_qbittorrent_by_torrent_metric_gauges(
+                Snapshot(torrents=torrents)
+            )
+        )
+
+        self.assertEqual(uploaded.name, "qbittorrent_torrent_uploaded")
+        self.assertEqual(
+            [(s.name, s.labels["name"], s.value) for s in uploaded.samples],
+            [
+                ("qbittorrent_torrent_uploaded_total", "Torrent b", 20),
+                ("qbittorrent_torrent_uploaded_created", "Torrent b", 1000),
+            ],
+        )
+        # Neither counters nor ratios of the other torrents can be added up
+        self.assertEqual(
+            [(s.labels["name"], s.value) for s in ratio.samples], [("Torrent b", 2)]
+        )
+        self.assertEqual(
+            [(s.labels["name"], s.value) for s in size.samples],
+            [("Torrent b", 1), ("__other__", 2)],
+        )
+
+        # Added again, the counters of a torrent start over
+        torrents.remove("b")
+        mock_time.return_value = 2000.0
+        collector._get_qbittorrent_by_torrent_metric_gauges(Snapshot(torrents=torrents))
+        torrents.update("b", {"name": "Torrent b", "upspeed": 30, "uploaded": 30})
+        _, _, uploaded, _, _ = collector._get_qbittorrent_by_torrent_metric_gauges(
+            Snapshot(torrents=torrents)
+        )
+
+        self.assertEqual(
+            [(s.labels["name"], s.value) for s in uploaded.samples[:2]],
+            [("Torrent b", 30), ("Torrent b", 2000)],
+        )
+
+    def test_by_torrent_metric_gauges_top_k_not_reached(self):
+        self.collector.config["torrent_metrics_top_k"] = 10
+        snapshot = Snapshot(
+            torrents=TorrentTable.from_dicts(
+                [{"name": "Torrent 1", "category": "", "size": 1, "downloaded": 1}]
+            )
+        )
+
+        size, _, dropped = self.collector._get_qbittorrent_by_torrent_metric_gauges(
+            snapshot
+        )
+
+        self.assertEqual([s.labels["name"] for s in size.samples], ["Torrent 1"])
+        self.assertEqual(dropped.samples[0].value, 0)
+
+    @patch("qbittorrent_exporter.exporter.time.monotonic")
+    def test_by_torrent_metric_gauges_changed_within(self, mock_monotonic):
+        self.collector.config["torrent_metrics_changed_within"] = 60
+        torrents = TorrentTable(
+            ["name", "category", "size", "downloaded", "dlspeed", "upspeed"],
+            tracked_fields=["size", "downloaded", "dlspeed", "upspeed"],
+        )
+        mock_monotonic.return_value = 0.0
+        for i in range(4):
+            torrents.update(str(i), {"name": f"Torrent {i}", "size": 100})
+        torrents.update("1", {"upspeed": 10})
+        mock_monotonic.return_value = 100.0
+        torrents.update("2", {"downloaded": 5})
+        torrents.update("3", {"size": 100})
+        mock_monotonic.return_value = 120.0
+
+        size, _, dropped = self.collector._get_qbittorrent_by_torrent_metric_gauges(
+            Snapshot(torrents=torrents)
+        )
+
+        # Torrent 1 is active, torrent 2 changed and torrents 0 and 3 are idle
+        self.assertEqual(
+            [(s.labels["name"], s.value) for s in size.samples],
+            [("Torrent 1", 100), ("Torrent 2", 100), ("__other__", 200)],
+        )
+        self.assertEqual(dropped.samples[0].value, 2)
+
     def test_collect_torrent_tags_metric_gauge(self):
-        result = self.collector._get_qbittorrent_torrent_tags_metrics_gauge()
+        result = self.collector._get_qbittorrent_torrent_tags_metrics_gauge(
+            self.collector._fetch_snapshot()
+        )
 
         self.assertIsInstance(result, GaugeMetricFamily)
         self.assertEqual(result.name, "qbittorrent_torrents_count")
@@ -173,103 +471,485 @@ class TestQbittorrentMetricsCollector(unittest.TestCase):
         metrics = list(self.collector.collect())
         self.assertNotEqual(len(metrics), 0)
 
-    def test_fetch_categories(self):
-        # Mock the client.torrent_categories.categories attribute
-        self.collector.client.torrent_categories.categories = {
-            "category1": {"name": "Category 1"},
-            "category2": {"name": "Category 2"},
-            "category3": {"name": "Category 3"},
+    def test_collect_calls_each_endpoint_once(self):
+        client = self.collector.client
+        client.reset_mock()
+        client.sync_maindata.return_value = {
+            "rid": 1,
+            "full_update": True,
+            "torrents": {
+                "hash1": {
+                    "name": "Torrent 1",
+                    "size": 100,
+                    "category": "Movies",
+                    "downloaded": 50,
+                    "state": "downloading",
+                },
+            },
+            "categories": {"Movies": {"name": "Movies"}},
         }
 
-        categories = self.collector._fetch_categories()
-        self.assertIsInstance(categories, dict)
-        self.assertNotEqual(len(categories), 0)
-        self.assertEqual(categories["category1"]["name"], "Category 1")
-        self.assertEqual(categories["category2"]["name"], "Category 2")
-        self.assertEqual(categories["category3"]["name"], "Category 3")
-
-    def test_fetch_categories_exception(self):
-        self.collector.client.torrent_categories.categories = Exception(
-            "Error fetching categories"
-        )
-        categories = self.collector._fetch_categories()
-        self.assertEqual(categories, {})
-
-    def test_fetch_torrents_success(self):
-        # Mock the return value of self.client.torrents.info()
-        self.collector.client.torrents.info.return_value = [
-            {"name": "Torrent 1", "size": 100},
-            {"name": "Torrent 2", "size": 200},
-            {"name": "Torrent 3", "size": 300},
-        ]
+        list(self.collector.collect())
 
-        expected_result = [
-            {"name": "Torrent 1", "size": 100},
-            {"name": "Torrent 2", "size": 200},
-            {"name": "Torrent 3", "size": 300},
-        ]
+        client.sync_maindata.assert_called_once_with(rid=0)
+        client.torrents.info.assert_not_called()
 
-        result = self.collector._fetch_torrents()
-        self.assertEqual(result, expected_result)
+    def test_collect_requests_incremental_updates(self):
+        client = self.collector.client
+        client.sync_maindata.return_value = {"rid": 7, "full_update": True}
+        list(self.collector.collect())
+        client.sync_maindata.return_value = {"rid": 8}
+        list(self.collector.collect())
 
-    def test_fetch_torrents_exception(self):
-        # Mock an exception being raised by self.client.torrents.info()
-        self.collector.client.torrents.info.side_effect = Exception("Connection error")
+        self.assertEqual(
+            [c.kwargs for c in client.sync_maindata.call_args_list],
+            [{"rid": 0}, {"rid": 7}],
+        )
 
-        expected_result = []
+    def test_collect_resets_mirror_on_reconnect(self):
+        client = self.collector.client
+        client.sync_maindata.return_value = {
+            "rid": 3,
+            "full_update": True,
+            "torrents": {
+                "hash1": {
+                    "name": "Torrent 1",
+                    "size": 100,
+                    "category": "",
+                    "downloaded": 50,
+                    "state": "downloading",
+                }
+            },
+        }
+        list(self.collector.collect())
+        client.sync_maindata.side_effect = APIConnectionError("Connection error")
+        list(self.collector.collect())
+        client.sync_maindata.side_effect = None
+        client.sync_maindata.return_value = {"rid": 1, "full_update": True}
+        list(self.collector.collect())
 
-        result = self.collector._fetch_torrents()
-        self.assertEqual(result, expected_result)
+        self.assertEqual(client.sync_maindata.call_args_list[-1].kwargs, {"rid": 0})
+        self.assertEqual(len(self.collector.mirror.torrents), 0)
 
-    def test_filter_torrents_by_state(self):
-        expected = [
-            {"name": "Torrent DOWNLOADING 1", "state": TorrentStates.DOWNLOADING},
-            {"name": "Torrent DOWNLOADING 2", "state": TorrentStates.DOWNLOADING},
-        ]
-        result = self.collector._filter_torrents_by_state(
-            TorrentStates.DOWNLOADING, self.torrentsState
+    def test_concurrent_scrapes_share_one_fetch(self):
+        client = self.collector.client
+        fetching = threading.Event()
+        release = threading.Event()
+        post = client._post.side_effect
+
+        def slow_post(**kwargs):
+            fetching.set()
+            release.wait(5)
+            return post(**kwargs)
+
+        client._post.side_effect = slow_post
+        client.sync_maindata.return_value = {
+            "rid": 1,
+            "full_update": True,
+            "server_state": {"connection_status": "connected"},
+        }
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            first = executor.submit(lambda: list(self.collector.collect()))
+            fetching.wait(5)
+            others = [
+                executor.submit(lambda: list(self.collector.collect()))
+                for _ in range(4)
+            ]
+            threading.Timer(0.1, release.set).start()
+            results = [future.result() for future in [first, *others]]
+
+        client._post.assert_called_once()
+        for families in results:
+            self.assertIn("qbittorrent_up", [family.name for family in families])
+
+    def test_min_refresh_interval(self):
+        self.config["min_refresh_interval"] = 60
+        collector = QbittorrentMetricsCollector(self.config)
+        list(collector.collect())
+        list(collector.collect())
+        self.mock_client.return_value._post.assert_called_once()
+
+    @patch("qbittorrent_exporter.exporter.time.time")
+    def test_torrent_histograms(self, mock_time):
+        mock_time.return_value = 10_000
+        self.collector.config["torrent_histograms"] = ["ratio", "age"]
+        self.collector.config["torrent_histograms_by_category"] = True
+        self.collector.config["torrent_histogram_buckets"] = {"ratio": [1, 0.5]}
+        snapshot = Snapshot(
+            torrents=TorrentTable.from_dicts(
+                [
+                    {"category": "", "ratio": 0.1, "added_on": 9_000},
+                    {"category": "", "ratio": 0.7, "added_on": 1_000},
+                    {"category": "Movies", "ratio": 3.0, "added_on": 0},
+                ],
+                ["category", "ratio", "added_on"],
+            )
         )
-        self.assertEqual(result, expected)
 
-        expected = [
-            {"name": "Torrent UPLOADING 1", "state": TorrentStates.UPLOADING},
-            {"name": "Torrent UPLOADING 2", "state": TorrentStates.UPLOADING},
+        ratio, age = self.collector._get_qbittorrent_torrent_histograms(snapshot)
+
+        self.assertEqual(ratio.name, "qbittorrent_torrents_by_ratio")
+        self.assertEqual(ratio.type, "histogram")
+        buckets = {
+            (sample.labels["category"], sample.labels["le"]): sample.value
+            for sample in ratio.samples
+            if sample.name.endswith("_bucket")
+        }
+        self.assertEqual(
+            buckets,
+            {
+                ("Uncategorized", "0.5"): 1,
+                ("Uncategorized", "1.0"): 2,
+                ("Uncategorized", "+Inf"): 2,
+                ("Movies", "0.5"): 0,
+                ("Movies", "1.0"): 0,
+                ("Movies", "+Inf"): 1,
+            },
+        )
+        (age_sum,) = [
+            sample.value
+            for sample in age.samples
+            if sample.name == "qbittorrent_torrents_by_age_seconds_sum"
+            and sample.labels["category"] == "Uncategorized"
         ]
-        result = self.collector._filter_torrents_by_state(
-            TorrentStates.UPLOADING, self.torrentsState
+        self.assertEqual(age_sum, 10_000)
+
+    def test_no_torrent_histograms_by_default(self):
+        self.assertEqual(
+            self.collector._get_qbittorrent_torrent_histograms(Snapshot()), []
         )
-        self.assertEqual(result, expected)
 
-        expected = []
-        result = self.collector._filter_torrents_by_state(
-            TorrentStates.ERROR, self.torrentsState
+    def test_collect_serves_last_refresh_when_polling(self):
+        self.collector.config["poll_interval"] = 15
+        client = self.collector.client
+        client.sync_maindata.return_value = {
+            "rid": 1,
+            "full_update": True,
+            "server_state": {"connection_status": "connected"},
+        }
+
+        self.collector.refresh()
+        first = list(self.collector.collect())
+        second = list(self.collector.collect())
+
+        client.sync_maindata.assert_called_once()
+        self.assertEqual(
+            [metric.name for metric in first], [metric.name for metric in second]
         )
-        self.assertEqual(result, expected)
+        self.assertIn("qbittorrent_up", [metric.name for metric in first])
 
-    def test_filter_torrents_by_category(self):
-        expected_result = [
-            {"name": "Torrent Movies 1", "category": "Movies"},
-            {"name": "Torrent Movies 2", "category": "Movies"},
-        ]
-        result = self.collector._filter_torrents_by_category(
-            "Movies", self.torrentsCategories
+    def test_collect_before_first_poll(self):
+        self.collector.config["poll_interval"] = 15
+        names = [metric.name for metric in self.collector.collect()]
+        self.collector.client.sync_maindata.assert_not_called()
+        self.assertNotIn("qbittorrent_up", names)
+        self.assertIn("qbittorrent_exporter_logins", names)
+
+    def test_backs_off_after_failures(self):
+        self.collector.config["max_backoff"] = 300
+        collector = QbittorrentMetricsCollector(self.collector.config)
+        client = self.mock_client.return_value
+        client._post.side_effect = Exception("Boom")
+
+        first = collector.refresh()
+        second = collector.refresh()
+
+        client._post.assert_called_once()
+        self.assertIs(first, second)
+        metrics = {m.name: m for m in collector._get_exporter_metrics()}
+        self.assertEqual(metrics["qbittorrent_exporter_consecutive_failures"].value, 1)
+        self.assertEqual(metrics["qbittorrent_exporter_skipped_refreshes"].value, 1)
+        self.assertGreaterEqual(
+            metrics["qbittorrent_exporter_poll_interval_seconds"].value, 0.5
+        )
+        self.assertGreater(collector.seconds_to_next_fetch(), 0)
+
+    @patch("qbittorrent_exporter.exporter.time.monotonic")
+    def test_requests_args(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        self.assertEqual(self.collector._requests_args(None), {})
+        self.assertEqual(self.collector._requests_args(102.5), {"timeout": 2.5})
+        self.assertEqual(self.collector._requests_args(99.0), {"timeout": 0.001})
+
+        self.collector.config["timeout"] = 10
+        self.assertEqual(self.collector._requests_args(None), {"timeout": 10})
+        self.assertEqual(self.collector._requests_args(102.5), {"timeout": 2.5})
+        self.assertEqual(self.collector._requests_args(200.0), {"timeout": 10})
+
+    def test_no_scheduler_metrics_by_default(self):
+        names = [m.name for m in self.collector._get_exporter_metrics()]
+        self.assertNotIn("qbittorrent_exporter_poll_interval_seconds", names)
+        self.assertEqual(self.collector.seconds_to_next_fetch(), 0.0)
+
+    @patch("qbittorrent_exporter.exporter.time.time")
+    def test_staleness_metrics(self, mock_time):
+        self.collector.client.sync_maindata.return_value = {"rid": 1}
+
+        mock_time.return_value = 1000.0
+        self.collector._fetch_snapshot()
+        mock_time.return_value = 1012.5
+        metrics = {m.name: m for m in self.collector._get_exporter_metrics()}
+
+        self.assertEqual(
+            metrics[
+                "qbittorrent_exporter_last_successful_poll_timestamp_seconds"
+            ].value,
+            1000.0,
+        )
+        self.assertEqual(metrics["qbittorrent_exporter_data_age_seconds"].value, 12.5)
+
+    def test_staleness_metrics_without_data(self):
+        self.collector.client.sync_maindata.side_effect = Exception("Boom")
+        self.collector._fetch_snapshot()
+        names = [m.name for m in self.collector._get_exporter_metrics()]
+        self.assertNotIn("qbittorrent_exporter_data_age_seconds", names)
+
+    def test_fetch_snapshot(self):
+        self.collector.client.sync_maindata.return_value = {
+            "rid": 1,
+            "full_update": True,
+            "server_state": {"connection_status": "connected"},
+            "categories": {"category1": {"name": "Category 1"}},
+            "tags": ["tag2", "tag1"],
+            "torrents": {"hash1": {"name": "Torrent 1", "size": 100}},
+        }
+        self.collector.client.app.version = "1.2.3"
+
+        snapshot = self.collector._fetch_snapshot()
+
+        self.assertEqual(snapshot.server_state, {"connection_status": "connected"})
+        self.assertEqual(snapshot.version, "1.2.3")
+        self.assertEqual(snapshot.categories, {"category1": {"name": "Category 1"}})
+        self.assertEqual(snapshot.tags, ["tag1", "tag2"])
+        # Only the fields used by the enabled metrics are kept
+        self.assertEqual(
+            snapshot.torrents.get("hash1"),
+            {
+                "hash": "hash1",
+                "name": "Torrent 1",
+                "category": "",
+                "state": "",
+                "size": 100,
+                "downloaded": 0,
+            },
+        )
+
+    def test_fetch_snapshot_exception(self):
+        self.collector.client.sync_maindata.side_effect = Exception("Connection error")
+        snapshot = self.collector._fetch_snapshot()
+        self.assertEqual(snapshot.server_state, {})
+        self.assertEqual(snapshot.version, "")
+        self.assertEqual(len(snapshot.torrents), 0)
+
+    def test_count_torrents_by_category_and_state(self):
+        torrents = TorrentTable.from_dicts(
+            [
+                {"name": "Torrent 1", "category": "Movies", "state": "downloading"},
+                {"name": "Torrent 2", "category": "Music", "state": "uploading"},
+                {"name": "Torrent 3", "category": "Movies", "state": "downloading"},
+                {"name": "Torrent 4", "category": "", "state": "uploading"},
+                {"name": "Torrent 5", "category": "Movies", "state": "uploading"},
+                {
+                    "name": "Torrent 6",
+                    "category": "Uncategorized",
+                    "state": "uploading",
+                },
+            ]
+        )
+
+        result = self.collector._count_torrents_by_category_and_state(torrents)
+
+        self.assertEqual(
+            result,
+            {
+                ("Movies", "downloading"): 2,
+                ("Movies", "uploading"): 1,
+                ("Music", "uploading"): 1,
+                ("Uncategorized", "uploading"): 2,
+            },
         )
-        self.assertEqual(result, expected_result)
 
-        expected_result = [
-            {"name": "Torrent unknown", "category": ""},
-            {"name": "Torrent Uncategorized 1", "category": "Uncategorized"},
+    def test_torrents_count_gauge(self):
+        snapshot = Snapshot(
+            categories={"Movies": {"name": "Movies"}},
+            torrents=TorrentTable.from_dicts(
+                [
+                    {"name": "Torrent 1", "category": "Movies", "state": "downloading"},
+                    {"name": "Torrent 2", "category": "", "state": "uploading"},
+                    {"name": "Torrent 3", "category": "Books", "state": "uploading"},
+                ]
+            ),
+        )
+
+        result = self.collector._get_qbittorrent_torrent_tags_metrics_gauge(snapshot)
+
+        values = {
+            (sample.labels["category"], sample.labels["status"]): sample.value
+            for sample in result.samples
+        }
+        self.assertEqual(len(values), 2 * len(TorrentStates))
+        self.assertEqual(values[("Movies", "downloading")], 1)
+        self.assertEqual(values[("Movies", "uploading")], 0)
+        self.assertEqual(values[("Uncategorized", "uploading")], 1)
+        self.assertEqual(values[("Uncategorized", "error")], 0)
+        # Torrents in categories unknown to the server are not counted
+        self.assertEqual(sum(values.values()), 2)
+
+    def test_aggregate_metric_gauges(self):
+        self.config["aggregate_metrics_by"] = ["category", "tag"]
+        collector = QbittorrentMetricsCollector(self.config)
+        self.assertTrue(
+            {"uploaded", "num_leechs", "tags"}.issubset(collector.mirror.torrent_fields)
+        )
+        collector.mirror.apply(
+            {
+                "rid": 1,
+                "full_update": True,
+                "torrents": {
+                    "hash1": {"category": "Movies", "tags": "a, b", "upspeed": 1},
+                    "hash2": {"category": "Movies", "tags": "a", "upspeed": 2},
+                    "hash3": {"category": "", "tags": "", "upspeed": 4},
+                    "hash4": {"category": "Uncategorized", "tags": "", "upspeed": 8},
+                },
+            }
+        )
+        snapshot = Snapshot(torrents=collector.mirror.torrents.copy())
+
+        gauges = {
+            gauge.name: gauge
+            for gauge in collector._get_qbittorrent_aggregate_metric_gauges(snapshot)
+        }
+
+        self.assertEqual(len(gauges), 8)
+        upspeed = gauges["qbittorrent_torrents_upspeed"]
+        self.assertEqual(
+            {
+                (sample.labels["category"], sample.labels["tag"]): sample.value
+                for sample in upspeed.samples
+            },
+            {
+                ("Movies", "a"): 3,
+                ("Movies", "b"): 1,
+                ("Uncategorized", "Untagged"): 12,
+            },
+        )
+        self.assertEqual(upspeed.samples[0].labels["server"], "localhost:8080/qbt/")
+
+    def test_aggregate_metric_gauges_disabled(self):
+        self.assertEqual(
+            self.collector._get_qbittorrent_aggregate_metric_gauges(Snapshot()), []
+        )
+
+    @patch.dict(os.environ, {"AGGREGATE_METRICS_BY": "category, status"})
+    def test_aggregate_metrics_by_config(self):
+        self.assertEqual(get_config()["aggregate_metrics_by"], ["category", "status"])
+
+    def test_tracker_metric_gauges(self):
+        self.config["tracker_metrics"] = True
+        collector = QbittorrentMetricsCollector(self.config)
+        collector.mirror.apply(
+            {
+                "rid": 1,
+                "torrents": {
+                    "hash1": {"tracker": "https://one.org/announce", "upspeed": 1},
+                    "hash2": {"tracker": "udp://one.org:6969", "upspeed": 2},
+                    "hash3": {"tracker": "https://two.org/announce", "dlspeed": 4},
+                    "hash4": {"tracker": ""},
+                },
+            }
+        )
+        snapshot = Snapshot(torrents=collector.mirror.torrents.copy())
+
+        gauges = {
+            gauge.name: {
+                sample.labels.get("tracker"): sample.value for sample in gauge.samples
+            }
+            for gauge in collector._get_qbittorrent_tracker_metric_gauges(snapshot)
+        }
+
+        self.assertEqual(
+            gauges,
+            {
+                "qbittorrent_tracker_torrents": {"one.org": 2, "two.org": 1},
+                "qbittorrent_tracker_dlspeed": {"one.org": 0, "two.org": 4},
+                "qbittorrent_tracker_upspeed": {"one.org": 3, "two.org": 0},
+                "qbittorrent_torrents_without_tracker": {None: 1},
+            },
+        )
+
+    def test_tracker_status_gauges(self):
+        self.config["tracker_crawl_rate"] = 100
+        collector = QbittorrentMetricsCollector(self.config)
+        collector.mirror.apply({"rid": 1, "torrents": {"hash1": {"name": "T"}}})
+        self.mock_client.return_value.torrents_trackers.return_value = [
+            {"url": "https://one.org/announce", "status": 4}
         ]
-        result = self.collector._filter_torrents_by_category(
-            "Uncategorized", self.torrentsCategories
+        collector.tracker_crawler.crawl_next()
+
+        gauges = {
+            gauge.name: gauge.samples
+            for gauge in collector._get_qbittorrent_tracker_metric_gauges(Snapshot())
+        }
+
+        self.assertEqual(
+            [s.labels for s in gauges["qbittorrent_tracker_status_torrents"]],
+            [
+                {
+                    "tracker": "one.org",
+                    "status": "Not working",
+                    "server": "localhost:8080/qbt/",
+                }
+            ],
         )
-        self.assertEqual(result, expected_result)
+        self.assertEqual(gauges["qbittorrent_tracker_crawled_torrents"][0].value, 1)
+        self.mock_client.return_value.torrents_trackers.assert_called_once_with(
+            torrent_hash="hash1"
+        )
+
+    def test_malformed_trackers_dont_break_collect(self):
+        self.config["tracker_crawl_rate"] = 100
+        collector = QbittorrentMetricsCollector(self.config)
+        self.mock_client.return_value.sync_maindata.return_value = {
+            "rid": 1,
+            "server_state": {"connection_status": "connected"},
+            "torrents": {"hash1": {"name": "T"}},
+        }
+        self.mock_client.return_value.torrents_trackers.return_value = [
+            {"url": "https://one.org/announce", "status": 7}
+        ]
+        self.addCleanup(collector.tracker_crawler.stop)
+
+        list(collector.collect())
+        deadline = time.monotonic() + 5
+        while not collector.tracker_crawler.errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        metrics = {metric.name: metric for metric in collector.collect()}
+
+        self.assertGreater(collector.tracker_crawler.errors, 0)
+        self.assertTrue(collector.tracker_crawler.is_alive())
+        self.assertEqual(metrics["qbittorrent_up"].samples[0].value, True)
 
-        expected_result = []
-        result = self.collector._filter_torrents_by_category(
-            "Books", self.torrentsCategories
+    def test_tracker_crawler_starts_once_the_server_answers(self):
+        self.config["tracker_crawl_rate"] = 100
+        collector = QbittorrentMetricsCollector(self.config)
+        collector.tracker_crawler.start = MagicMock()
+        client = self.mock_client.return_value
+        client.sync_maindata.side_effect = APIConnectionError("Boom")
+
+        list(collector.collect())
+        collector.tracker_crawler.start.assert_not_called()
+
+        client.sync_maindata.side_effect = None
+        list(collector.collect())
+        list(collector.collect())
+        collector.tracker_crawler.start.assert_called_once_with()
+
+    def test_tracker_metrics_disabled(self):
+        self.assertIsNone(self.collector.tracker_crawler)
+        self.assertEqual(
+            self.collector._get_qbittorrent_tracker_metric_gauges(Snapshot()), []
         )
-        self.assertEqual(result, expected_result)
 
     def test_get_qbittorrent_status_metrics(self):
         self.collector.client.sync_maindata.return_value = {
@@ -347,7 +1027,9 @@ class TestQbittorrentMetricsCollector(unittest.TestCase):
             ),
         ]
 
-        metrics = self.collector._get_qbittorrent_status_metrics()
+        metrics = self.collector._get_qbittorrent_status_metrics(
+            self.collector._fetch_snapshot()
+        )
         self.assertEqual(metrics, expected_metrics)
 
     def test_server_string_with_different_settings(self):
@@ -0,0 +1,273 @@
+"""
+A fake qBittorrent WebUI serving canned responses for the few endpoints used by
+the exporter, optionally delaying each of them.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from unittest.mock import MagicMock
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeQbittorrentHandler(BaseHTTPRequestHandler):
+    server: "FakeQbittorrentServer"
+
+    def do_GET(self) -> None:
+        self._handle(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        self._handle(parse_qs(self.rfile.read(length).decode()))
+
+    def _handle(self, params: dict[str, list[str]]) -> None:
+        endpoint = urlparse(self.path).path.removeprefix("/api/v2/")
+        self.server.record(endpoint)
+        time.sleep(self.server.latency.get(endpoint, 0))
+
+        fake = self.server.fake
+        body: Any
+        if endpoint == "auth/login":
+            body = "Ok."
+        elif endpoint == "app/version":
+            body = fake.version
+        elif endpoint == "app/webapiVersion":
+            body = fake.web_api_version
+        elif endpoint == "sync/maindata":
+            body = fake.maindata(int(params.get("rid", ["0"])[0]))
+        elif endpoint == "torrents/info":
+            body = [{"hash": h, **t} for h, t in fake.torrents.items()]
+        elif endpoint == "torrents/categories":
+            body = fake.categories
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            "text/plain" if isinstance(body, str) else "application/json",
+        )
+        self.send_header("Content-Length", str(len(payload)))
+        if endpoint == "auth/login":
+            self.send_header("Set-Cookie", "SID=fake; HttpOnly; path=/")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log nothing."""
+
+
+class FakeQbittorrent:
+    """
+    The state served by `FakeQbittorrentServer`. `sync/maindata` answers with a
+    full update unless `churn` is set. Then, requests with the last served `rid`
+    get a delta changing the speeds of that fraction of the torrents.
+    """
+
+    def __init__(
+        self,
+        torrents: dict[str, dict] | None = None,
+        categories: dict[str, dict] | None = None,
+        tags: list[str] | None = None,
+        server_state: dict[str, Any] | None = None,
+        churn: float = 0.0,
+    ) -> None:
+        self.version = "v5.0.0"
+        self.web_api_version = "2.11.0"
+        self.torrents = torrents or {}
+        self.categories = categories or {}
+        self.tags = tags or []
+        self.server_state = server_state or {"connection_status": "connected"}
+        self.churn = churn
+        self.rid = 0
+        self._rng = random.Random(0)
+
+    @classmethod
+    def synthetic(
+        cls, torrents: int, categories: int = 10, tags: int = 0, churn: float = 0.0
+    ) -> "FakeQbittorrent":
+        """A server with `synthetic_torrents()`."""
+        return cls(
+            torrents=synthetic_torrents(torrents, categories, tags),
+            categories={
+                f"category{i}": {"name": f"category{i}", "savePath": ""}
+                for i in range(categories)
+            },
+            tags=[f"tag{i}" for i in range(tags)],
+            churn=churn,
+        )
+
+    def maindata(self, rid: int) -> dict[str, Any]:
+        self.rid += 1
+        if self.churn and rid and rid == self.rid - 1:
+            changed = self._rng.sample(
+                sorted(self.torrents), int(len(self.torrents) * self.churn)
+            )
+            for torrent_hash in changed:
+                self.torrents[torrent_hash]["dlspeed"] = self._rng.randint(0, 1 << 22)
+                self.torrents[torrent_hash]["upspeed"] = self._rng.randint(0, 1 << 22)
+            return {
+                "rid": self.rid,
+                "torrents": {
+                    torrent_hash: {
+                        "dlspeed": self.torrents[torrent_hash]["dlspeed"],
+                        "upspeed": self.torrents[torrent_hash]["upspeed"],
+                    }
+                    for torrent_hash in changed
+                },
+            }
+        return {
+            "rid": self.rid,
+            "full_update": True,
+            "server_state": self.server_state,
+            "categories": self.categories,
+            "tags": self.tags,
+            "torrents": self.torrents,
+        }
+
+
+def answer_with_sync_maindata(client: MagicMock) -> None:
+    """
+    Makes a mocked client answer the raw `sync/maindata` requests sent by the
+    exporter with whatever its `sync_maindata()` mock returns, so tests can
+    keep setting `sync_maindata.return_value` and `side_effect`. The same goes
+    for `app_version()` and `app.version`.
+    """
+    client.sync_maindata.return_value = {}
+    client.app_version.side_effect = lambda **kwargs: client.app.version
+    client._post.side_effect = lambda **kwargs: json.dumps(
+        client.sync_maindata(rid=kwargs["data"]["rid"])
+    ).encode()
+
+
+def synthetic_torrents(
+    count: int, categories: int = 10, tags: int = 0, seed: int = 42
+) -> dict[str, dict[str, Any]]:
+    """
+    Builds `count` torrents keyed by hash with all the fields qBittorrent 5.0
+    returns, spread randomly across `categories` categories and every state,
+    with up to two of `tags` tags each.
+    """
+    rng = random.Random(seed)
+    states = [
+        "error", "missingFiles", "uploading", "stoppedUP", "queuedUP", "stalledUP",
+        "checkingUP", "forcedUP", "allocating", "downloading", "metaDL",
+        "stoppedDL", "queuedDL", "stalledDL", "checkingDL", "forcedDL",
+        "checkingResumeData", "moving", "unknown",
+    ]  # fmt: skip
+    torrents = {}
+    for i in range(count):
+        torrent_hash = f"{rng.getrandbits(160):040x}"
+        size = rng.randint(1 << 20, 1 << 36)
+        downloaded = rng.randint(0, size)
+        uploaded = rng.randint(0, size * 3)
+        category = f"category{rng.randrange(categories)}" if categories else ""
+        torrents[torrent_hash] = {
+            "added_on": 1_700_000_000 + i,
+            "amount_left": size - downloaded,
+            "auto_tmm": False,
+            "availability": rng.random() * 10,
+            "category": category,
+            "comment": "",
+            "completed": downloaded,
+            "completion_on": 1_700_100_000 + i,
+            "content_path": f"/downloads/{category}/Torrent {i}",
+            "dl_limit": 0,
+            "dlspeed": rng.randint(0, 1 << 22),
+            "download_path": "",
+            "downloaded": downloaded,
+            "downloaded_session": downloaded // 2,
+            "eta": rng.randint(0, 8_640_000),
+            "f_l_piece_prio": False,
+            "force_start": False,
+            "has_metadata": True,
+            "inactive_seeding_time_limit": -2,
+            "infohash_v1": torrent_hash,
+            "infohash_v2": "",
+            "last_activity": 1_700_200_000 + i,
+            "magnet_uri": f"magnet:?xt=urn:btih:{torrent_hash}&dn=Torrent%20{i}",
+            "max_inactive_seeding_time": -1,
+            "max_ratio": -1,
+            "max_seeding_time": -1,
+            "name": f"Torrent {i}",
+            "num_complete": rng.randint(0, 500),
+            "num_incomplete": rng.randint(0, 500),
+            "num_leechs": rng.randint(0, 50),
+            "num_seeds": rng.randint(0, 50),
+            "popularity": rng.random(),
+            "priority": 0,
+            "private": False,
+            "progress": downloaded / size,
+            "ratio": uploaded / size,
+            "ratio_limit": -2,
+            "reannounce": rng.randint(0, 1800),
+            "root_path": f"/downloads/{category}/Torrent {i}",
+            "save_path": f"/downloads/{category}",
+            "seeding_time": rng.randint(0, 1 << 24),
+            "seeding_time_limit": -2,
+            "seen_complete": 1_700_300_000 + i,
+            "seq_dl": False,
+            "size": size,
+            "state": rng.choice(states),
+            "super_seeding": False,
+            "tags": (
+                ", ".join(
+                    sorted(
+                        {f"tag{rng.randrange(tags)}" for _ in range(rng.randint(0, 2))}
+                    )
+                )
+                if tags
+                else ""
+            ),
+            "time_active": rng.randint(0, 1 << 24),
+            "total_size": size,
+            "tracker": f"https://tracker{rng.randrange(5)}.example.org/announce",
+            "trackers_count": 1,
+            "up_limit": 0,
+            "uploaded": uploaded,
+            "uploaded_session": uploaded // 2,
+            "upspeed": rng.randint(0, 1 << 22),
+        }
+    return torrents
+
+
+class FakeQbittorrentServer(ThreadingHTTPServer):
+    """
+    Serves a `FakeQbittorrent` on a random local port. `latency` maps endpoints
+    (e.g. `sync/maindata`) to the seconds to wait before answering them.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        fake: FakeQbittorrent | None = None,
+        latency: dict[str, float] | None = None,
+    ) -> None:
+        self.fake = fake or FakeQbittorrent()
+        self.latency = latency or {}
+        self.requests: list[str] = []
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeQbittorrentHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def record(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests.append(endpoint)
+
+    def __enter__(self) -> "FakeQbittorrentServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,107 @@
+import unittest
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from qbittorrentapi import APIConnectionError, HTTP403Error
+
+from qbittorrent_exporter.instrumentation import Instrumentation, endpoint_of
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation("qbittorrent", "localhost:8080")
+
+    def _value(self, name, **labels):
+        for family in self.instrumentation.collect():
+            for sample in family.samples:
+                if sample.name == name and labels.items() <= sample.labels.items():
+                    return sample.value
+        return None
+
+    def _response(self, url, status_code=200, content=b"{}"):
+        response = MagicMock(url=url, status_code=status_code, content=content)
+        response.elapsed = timedelta(milliseconds=20)
+        return response
+
+    def test_endpoint_of(self):
+        self.assertEqual(
+            endpoint_of("http://localhost:8080/qbt/api/v2/sync/maindata?rid=1"),
+            "sync/maindata",
+        )
+        self.assertEqual(endpoint_of("http://localhost:8080/"), "")
+
+    def test_record_response(self):
+        self.instrumentation.record_response(
+            self._response("http://localhost/api/v2/sync/maindata", content=b"x" * 10)
+        )
+        self.instrumentation.record_response(
+            self._response("http://localhost/api/v2/sync/maindata", status_code=403)
+        )
+        self.instrumentation.record_response(self._response("http://localhost/"))
+
+        self.assertEqual(
+            self._value(
+                "qbittorrent_exporter_request_seconds_count", endpoint="sync/maindata"
+            ),
+            2,
+        )
+        self.assertEqual(
+            self._value(
+                "qbittorrent_exporter_response_bytes_total", endpoint="sync/maindata"
+            ),
+            12,
+        )
+        self.assertEqual(
+            self._value(
+                "qbittorrent_exporter_request_errors_total", endpoint="sync/maindata"
+            ),
+            1,
+        )
+        self.assertIsNone(
+            self._value("qbittorrent_exporter_request_seconds_count", endpoint="")
+        )
+
+    def test_count_errors(self):
+        def fail(error):
+            raise error
+
+        self.assertEqual(self.instrumentation.count_errors("app/version", lambda: 1), 1)
+        for error in [APIConnectionError("Boom"), HTTP403Error("Forbidden")]:
+            with self.assertRaises(type(error)):
+                self.instrumentation.count_errors("app/version", lambda: fail(error))
+
+        # Error responses are recorded by the response hook instead
+        self.assertEqual(
+            self._value(
+                "qbittorrent_exporter_request_errors_total", endpoint="app/version"
+            ),
+            1,
+        )
+
+    def test_phase(self):
+        with self.instrumentation.phase("build"):
+            pass
+        with self.assertRaises(ValueError):
+            with self.instrumentation.phase("build"):
+                raise ValueError()
+
+        self.assertEqual(
+            self._value(
+                "qbittorrent_exporter_phase_seconds_count",
+                phase="build",
+                server="localhost:8080",
+            ),
+            2,
+        )
+
+    def test_record_series(self):
+        family = MagicMock(samples=[1, 2, 3])
+        family.name = "qbittorrent_torrents_count"
+        self.instrumentation.record_series([family])
+
+        self.assertEqual(
+            self._value(
+                "qbittorrent_exporter_series", family="qbittorrent_torrents_count"
+            ),
+            3,
+        )
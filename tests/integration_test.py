@@ -0,0 +1,175 @@
+import time
+import unittest
+import urllib.request
+
+from prometheus_client import CollectorRegistry
+
+from qbittorrent_exporter.exporter import QbittorrentMetricsCollector, WorkerProcess
+from qbittorrent_exporter.server import ExpositionCache, start_http_server
+from tests.fake_qbittorrent import FakeQbittorrent, FakeQbittorrentServer
+
+
+class TestCollectorWithFakeServer(unittest.TestCase):
+    """Runs the collector against a fake qBittorrent WebUI over HTTP."""
+
+    def setUp(self):
+        self.fake = FakeQbittorrent(
+            torrents={
+                "hash1": {
+                    "name": "Torrent 1",
+                    "category": "Movies",
+                    "state": "downloading",
+                    "size": 100,
+                    "downloaded": 50,
+                },
+            },
+            categories={"Movies": {"name": "Movies", "savePath": "/movies"}},
+        )
+        self.server = FakeQbittorrentServer(
+            self.fake, latency={"sync/maindata": 0.3, "app/version": 0.3}
+        ).__enter__()
+        self.config = {
+            "host": "127.0.0.1",
+            "port": str(self.server.port),
+            "ssl": False,
+            "url_base": "",
+            "username": "user",
+            "password": "pass",
+            "api_key": "",
+            "verify_webui_certificate": True,
+            "metrics_prefix": "qbittorrent",
+        }
+        self.collector = QbittorrentMetricsCollector(self.config)
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _samples(self, families, name):
+        (family,) = [family for family in families if family.name == name]
+        return family.samples
+
+    def test_api_calls_run_concurrently(self):
+        started = time.monotonic()
+        families = self.collector.refresh()
+        elapsed = time.monotonic() - started
+
+        # Latency is the one of the slowest call, not the sum of both
+        self.assertLess(elapsed, 0.55)
+        (up,) = self._samples(families, "qbittorrent_up")
+        self.assertEqual(up.value, True)
+        self.assertEqual(up.labels["version"], "v5.0.0")
+
+    def test_version_is_cached(self):
+        self.collector.refresh()
+        families = self.collector.refresh()
+
+        self.assertEqual(self.server.requests.count("app/version"), 1)
+        self.assertEqual(self.server.requests.count("sync/maindata"), 2)
+        (up,) = self._samples(families, "qbittorrent_up")
+        self.assertEqual(up.labels["version"], "v5.0.0")
+
+    def test_scrape_timeout(self):
+        self.collector.config["scrape_timeout"] = 0.1
+
+        started = time.monotonic()
+        families = self.collector.refresh()
+
+        self.assertLess(time.monotonic() - started, 0.25)
+        (up,) = self._samples(families, "qbittorrent_up")
+        self.assertEqual(up.value, False)
+
+    def test_deadline_returns_stale_data(self):
+        self.collector.refresh()
+        self.server.latency["sync/maindata"] = 2
+
+        started = time.monotonic()
+        families = self.collector.refresh(deadline=time.monotonic() + 0.1)
+
+        self.assertLess(time.monotonic() - started, 0.25)
+        (up,) = self._samples(families, "qbittorrent_up")
+        self.assertEqual(up.value, False)
+        # The torrents of the previous refresh are still exported
+        counts = {
+            (sample.labels["category"], sample.labels["status"]): sample.value
+            for sample in self._samples(families, "qbittorrent_torrents_count")
+        }
+        self.assertEqual(counts[("Movies", "downloading")], 1)
+
+    def test_torrents_from_fake_server(self):
+        families = self.collector.refresh()
+        counts = {
+            (sample.labels["category"], sample.labels["status"]): sample.value
+            for sample in self._samples(families, "qbittorrent_torrents_count")
+        }
+        self.assertEqual(counts[("Movies", "downloading")], 1)
+
+    def test_self_instrumentation(self):
+        self.collector.refresh()
+        families = self.collector._get_exporter_families()
+
+        requests = {
+            sample.labels["endpoint"]: sample.value
+            for sample in self._samples(
+                families, "qbittorrent_exporter_request_seconds"
+            )
+            if sample.name.endswith("_count")
+        }
+        self.assertEqual(requests, {"sync/maindata": 1, "app/version": 1})
+        (received,) = [
+            sample
+            for sample in self._samples(families, "qbittorrent_exporter_response_bytes")
+            if sample.name.endswith("_total")
+            and sample.labels["endpoint"] == "sync/maindata"
+        ]
+        self.assertGreater(received.value, 100)
+        phases = {
+            sample.labels["phase"]
+            for sample in self._samples(families, "qbittorrent_exporter_phase_seconds")
+        }
+        self.assertEqual(phases, {"fetch", "decode", "apply", "build"})
+        series = {
+            sample.labels["family"]: sample.value
+            for sample in self._samples(families, "qbittorrent_exporter_series")
+        }
+        self.assertEqual(series["qbittorrent_up"], 1)
+
+    def test_worker_process(self):
+        cache = ExpositionCache()
+        config = {
+            **self.config,
+            "targets": [],
+            "poll_interval": 0.1,
+            "log_level": "INFO",
+        }
+        worker = WorkerProcess(config, cache, restart_delay=2)
+        registry = CollectorRegistry()
+        registry.register(worker)
+        server, _ = start_http_server(0, "127.0.0.1", registry, cache)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        up = f'qbittorrent_up{{server="127.0.0.1:{self.server.port}",version='
+
+        worker.start()
+        try:
+            deadline = time.monotonic() + 30
+            while cache.current() is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+            with urllib.request.urlopen(url) as response:
+                self.assertIn(f'{up}"v5.0.0"}} 1.0'.encode(), response.read())
+
+            # Once the worker dies, its last metrics aren't served anymore
+            process = worker.process
+            process.kill()
+            while cache.current() is not None and time.monotonic() < deadline:
+                time.sleep(0.05)
+            with urllib.request.urlopen(url) as response:
+                self.assertIn(f'{up}""}} 0.0'.encode(), response.read())
+
+            # And it is started again
+            while worker.process is process and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertIsNot(worker.process, process)
+        finally:
+            worker.stop()
+        self.assertFalse(worker.process.is_alive())
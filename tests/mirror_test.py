@@ -0,0 +1,106 @@
+import unittest
+
+from qbittorrent_exporter.exporter import MaindataMirror
+
+
+class TestMaindataMirror(unittest.TestCase):
+    def setUp(self):
+        self.mirror = MaindataMirror(["name", "state"])
+        self.mirror.apply(
+            {
+                "rid": 1,
+                "full_update": True,
+                "server_state": {"connection_status": "connected", "dht_nodes": 10},
+                "categories": {
+                    "Movies": {"name": "Movies", "savePath": "/movies"},
+                    "Music": {"name": "Music", "savePath": "/music"},
+                },
+                "tags": ["tag1", "tag2"],
+                "torrents": {
+                    "hash1": {"name": "Torrent 1", "state": "downloading"},
+                    "hash2": {"name": "Torrent 2", "state": "uploading"},
+                },
+            }
+        )
+
+    def test_full_update(self):
+        self.assertEqual(self.mirror.rid, 1)
+        self.assertEqual(
+            self.mirror.server_state,
+            {"connection_status": "connected", "dht_nodes": 10},
+        )
+        self.assertEqual(set(self.mirror.categories), {"Movies", "Music"})
+        self.assertEqual(self.mirror.tags, {"tag1", "tag2"})
+        self.assertEqual(
+            self.mirror.torrents.get("hash1"),
+            {"hash": "hash1", "name": "Torrent 1", "state": "downloading"},
+        )
+
+    def test_partial_update(self):
+        self.mirror.apply(
+            {
+                "rid": 2,
+                "server_state": {"dht_nodes": 12},
+                "categories": {"Books": {"name": "Books", "savePath": "/books"}},
+                "categories_removed": ["Music"],
+                "tags": ["tag3"],
+                "tags_removed": ["tag1"],
+                "torrents": {
+                    "hash1": {"state": "uploading"},
+                    "hash3": {"name": "Torrent 3", "state": "metaDL"},
+                },
+                "torrents_removed": ["hash2"],
+            }
+        )
+
+        self.assertEqual(self.mirror.rid, 2)
+        self.assertEqual(
+            self.mirror.server_state,
+            {"connection_status": "connected", "dht_nodes": 12},
+        )
+        self.assertEqual(set(self.mirror.categories), {"Movies", "Books"})
+        self.assertEqual(self.mirror.tags, {"tag2", "tag3"})
+        self.assertEqual(
+            sorted(self.mirror.torrents.to_dicts(), key=lambda t: t["hash"]),
+            [
+                {"hash": "hash1", "name": "Torrent 1", "state": "uploading"},
+                {"hash": "hash3", "name": "Torrent 3", "state": "metaDL"},
+            ],
+        )
+
+    def test_full_update_replaces_everything(self):
+        # e.g. after a server restart the previous rid is unknown to the server
+        self.mirror.apply(
+            {
+                "rid": 1,
+                "full_update": True,
+                "server_state": {"connection_status": "firewalled"},
+                "torrents": {"hash3": {"name": "Torrent 3"}},
+            }
+        )
+
+        self.assertEqual(self.mirror.rid, 1)
+        self.assertEqual(self.mirror.server_state, {"connection_status": "firewalled"})
+        self.assertEqual(self.mirror.categories, {})
+        self.assertEqual(self.mirror.tags, set())
+        self.assertEqual(list(self.mirror.torrents.index), ["hash3"])
+
+    def test_empty_update_keeps_state(self):
+        self.mirror.apply({"rid": 2})
+        self.assertEqual(self.mirror.rid, 2)
+        self.assertEqual(len(self.mirror.torrents), 2)
+
+    def test_keeps_only_given_fields(self):
+        self.mirror.apply(
+            {"rid": 2, "torrents": {"hash4": {"name": "Torrent 4", "size": 100}}}
+        )
+        self.assertEqual(
+            self.mirror.torrents.get("hash4"),
+            {"hash": "hash4", "name": "Torrent 4", "state": ""},
+        )
+
+    def test_reset(self):
+        self.mirror.reset()
+        self.assertEqual(self.mirror.rid, 0)
+        self.assertEqual(len(self.mirror.torrents), 0)
+        self.assertEqual(self.mirror.server_state, {})
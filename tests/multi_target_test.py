@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from qbittorrent_exporter.exporter import MultiTargetCollector, get_config
+from tests.fake_qbittorrent import answer_with_sync_maindata
+
+
+class TestMultiTargetCollector(unittest.TestCase):
+    def setUp(self):
+        self.clients = {}
+        self.patcher = patch(
+            "qbittorrent_exporter.exporter.Client", side_effect=self._create_client
+        )
+        self.patcher.start()
+        self.release = threading.Event()
+        self.config = {
+            "host": "",
+            "port": "",
+            "ssl": False,
+            "url_base": "",
+            "username": "user",
+            "password": "pass",
+            "api_key": "",
+            "verify_webui_certificate": False,
+            "metrics_prefix": "qbittorrent",
+            "max_workers": 4,
+            "targets": [
+                {"host": "fast1", "port": "8080"},
+                {"host": "fast2", "port": "8080", "username": "other"},
+                {"host": "slow", "port": "8080", "timeout": 0.2},
+            ],
+        }
+        self.collector = MultiTargetCollector(self.config)
+
+    def tearDown(self):
+        self.release.set()
+        self.patcher.stop()
+
+    def _create_client(self, host, **kwargs):
+        client = MagicMock()
+        answer_with_sync_maindata(client)
+        client.sync_maindata.return_value = {
+            "rid": 1,
+            "full_update": True,
+            "server_state": {"connection_status": "connected"},
+        }
+        if "slow" in host:
+            client.sync_maindata.side_effect = lambda rid: (
+                self.release.wait(5),
+                client.sync_maindata.return_value,
+            )[1]
+        self.clients[host] = (client, kwargs)
+        return client
+
+    def _up_samples(self, families):
+        (up,) = [family for family in families if family.name == "qbittorrent_up"]
+        return {sample.labels["server"]: sample.value for sample in up.samples}
+
+    def test_targets_inherit_global_settings(self):
+        list(self.collector.collect())
+        self.assertEqual(self.clients["http://fast1:8080"][1]["username"], "user")
+        self.assertEqual(self.clients["http://fast2:8080"][1]["username"], "other")
+
+    def test_collect_merges_families(self):
+        self.collector.collectors = self.collector.collectors[:2]
+        families = list(self.collector.collect())
+
+        names = [family.name for family in families]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(
+            self._up_samples(families), {"fast1:8080": True, "fast2:8080": True}
+        )
+
+    def test_slow_target_times_out(self):
+        started = time.monotonic()
+        families = list(self.collector.collect())
+        self.assertLess(time.monotonic() - started, 2)
+
+        self.assertEqual(
+            self._up_samples(families),
+            {"fast1:8080": True, "fast2:8080": True, "slow:8080": False},
+        )
+
+    def test_scrape_deadline(self):
+        self.collector.collectors[2].config["timeout"] = 5
+
+        started = time.monotonic()
+        families = self.collector.refresh(deadline=time.monotonic() + 0.2)
+        self.assertLess(time.monotonic() - started, 1)
+
+        self.assertEqual(self._up_samples(families)["slow:8080"], False)
+
+    def test_hung_target_is_not_resubmitted(self):
+        list(self.collector.collect())
+        list(self.collector.collect())
+        self.release.set()
+        time.sleep(0.1)
+
+        slow_client = self.clients["http://slow:8080"][0]
+        self.assertEqual(slow_client.sync_maindata.call_count, 1)
+
+    def test_refresh_does_not_alter_cached_families(self):
+        self.collector.collectors = self.collector.collectors[:2]
+        self.collector.refresh()
+        self.collector.refresh()
+        for target in self.collector.collectors:
+            (up,) = [f for f in target._families if f.name == "qbittorrent_up"]
+            self.assertEqual(len(up.samples), 1)
+
+
+class TestTargetsConfig(unittest.TestCase):
+    @patch.dict(
+        os.environ,
+        {
+            "QBITTORRENT_TARGETS": (
+                '[{"host": "one", "port": 8080},'
+                ' {"host": "two", "port": "443", "url_base": "qbt"}]'
+            )
+        },
+    )
+    def test_targets(self):
+        targets = get_config()["targets"]
+        self.assertEqual(
+            targets,
+            [
+                {"host": "one", "port": "8080"},
+                {"host": "two", "port": "443", "url_base": "qbt"},
+            ],
+        )
+
+    def test_invalid_targets(self):
+        for targets in ["not json", '{"host": "box1"}', '["box1:8080"]']:
+            with (
+                self.subTest(targets=targets),
+                patch.dict(os.environ, {"QBITTORRENT_TARGETS": targets}),
+            ):
+                with self.assertRaises(SystemExit):
+                    get_config()
+
+    def test_invalid_modules(self):
+        for modules in ["not json", '["seedbox"]', '{"seedbox": "admin"}']:
+            with (
+                self.subTest(modules=modules),
+                patch.dict(os.environ, {"EXPORTER_MODULES": modules}),
+            ):
+                with self.assertRaises(SystemExit):
+                    get_config()
+
+    @patch.dict(os.environ, {}, clear=True)
+    def test_no_targets(self):
+        self.assertEqual(get_config()["targets"], [])
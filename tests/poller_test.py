@@ -0,0 +1,45 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from qbittorrent_exporter.exporter import Poller
+
+
+class TestPoller(unittest.TestCase):
+    def test_refreshes_until_stopped(self):
+        collector = MagicMock()
+        collector.seconds_to_next_fetch.return_value = 0.0
+        refreshed = threading.Event()
+
+        def refresh():
+            if collector.refresh.call_count >= 3:
+                refreshed.set()
+
+        collector.refresh.side_effect = refresh
+
+        poller = Poller(collector, 0.01)
+        poller.start()
+        self.assertTrue(refreshed.wait(5))
+        poller.stop()
+        poller.join(5)
+
+        self.assertFalse(poller.is_alive())
+        self.assertGreaterEqual(collector.refresh.call_count, 3)
+
+    def test_keeps_polling_after_errors(self):
+        collector = MagicMock()
+        collector.seconds_to_next_fetch.return_value = 0.0
+        refreshed = threading.Event()
+
+        def refresh():
+            if collector.refresh.call_count >= 2:
+                refreshed.set()
+            raise Exception("Boom")
+
+        collector.refresh.side_effect = refresh
+
+        poller = Poller(collector, 0.01)
+        poller.start()
+        self.assertTrue(refreshed.wait(5))
+        poller.stop()
+        poller.join(5)
@@ -0,0 +1,110 @@
+import unittest
+from unittest.mock import patch
+
+from qbittorrent_exporter.exporter import ProbeCollectorPool, _parse_probe_target
+
+
+class TestProbeCollectorPool(unittest.TestCase):
+    def setUp(self):
+        self.patcher = patch("qbittorrent_exporter.exporter.Client")
+        self.mock_client = self.patcher.start()
+        self.config = {
+            "host": "",
+            "port": "",
+            "ssl": False,
+            "url_base": "",
+            "username": "user",
+            "password": "pass",
+            "api_key": "",
+            "verify_webui_certificate": True,
+            "metrics_prefix": "qbittorrent",
+            "poll_interval": 30,
+            "modules": {
+                "default": {},
+                "seedbox": {"username": "admin", "password": "secret", "ssl": True},
+            },
+            "probe_cache_size": 2,
+            "probe_idle_timeout": 600,
+        }
+        self.pool = ProbeCollectorPool(self.config)
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_default_module(self):
+        collector = self.pool.get("box1:8080")
+        self.assertEqual(collector.server, "box1:8080")
+        self.assertEqual(collector.connection_string, "http://box1:8080")
+        self.assertEqual(collector.config["verify_webui_certificate"], True)
+        # Probes always query the target
+        self.assertEqual(collector.config["poll_interval"], 0)
+
+    def test_no_credentials_of_the_single_server(self):
+        self.config["api_key"] = "key"
+        pool = ProbeCollectorPool({**self.config, "modules": {"public": {}}})
+
+        with self.assertRaises(ValueError):
+            pool.get("attacker:80")
+        collector = pool.get("attacker:80", "public")
+        collector._get_client()
+
+        for setting in ["username", "password", "api_key"]:
+            self.assertEqual(collector.config[setting], "")
+        client_args = self.mock_client.call_args.kwargs
+        self.assertEqual((client_args["username"], client_args["password"]), ("", ""))
+        self.assertNotIn("EXTRA_HEADERS", client_args)
+
+    def test_module_settings(self):
+        collector = self.pool.get("box1:8080", "seedbox")
+        self.assertEqual(collector.connection_string, "https://box1:8080")
+        self.assertEqual(collector.config["username"], "admin")
+        self.assertEqual(collector.config["password"], "secret")
+
+    def test_unknown_module(self):
+        with self.assertRaises(ValueError):
+            self.pool.get("box1:8080", "unknown")
+
+    def test_reuses_collectors(self):
+        collector = self.pool.get("box1:8080")
+        self.assertIs(self.pool.get("box1:8080"), collector)
+        self.assertIsNot(self.pool.get("box1:8080", "seedbox"), collector)
+
+    def test_evicts_least_recently_used(self):
+        first = self.pool.get("box1:8080")
+        second = self.pool.get("box2:8080")
+        self.pool.get("box1:8080")
+        self.pool.get("box3:8080")
+
+        self.assertIs(self.pool.get("box1:8080"), first)
+        self.assertIsNot(self.pool.get("box2:8080"), second)
+
+    @patch("qbittorrent_exporter.exporter.time.monotonic")
+    def test_evicts_idle_collectors(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        collector = self.pool.get("box1:8080")
+        mock_monotonic.return_value = 1500
+        self.assertIs(self.pool.get("box1:8080"), collector)
+        mock_monotonic.return_value = 2101
+        self.assertIsNot(self.pool.get("box1:8080"), collector)
+
+
+class TestParseProbeTarget(unittest.TestCase):
+    def test_host_and_port(self):
+        self.assertEqual(
+            _parse_probe_target("box1:8080"), {"host": "box1", "port": "8080"}
+        )
+
+    def test_url(self):
+        self.assertEqual(
+            _parse_probe_target("https://box1/qbt/"),
+            {"host": "box1", "port": "443", "url_base": "qbt", "ssl": True},
+        )
+        self.assertEqual(
+            _parse_probe_target("http://box1:8080"),
+            {"host": "box1", "port": "8080", "ssl": False},
+        )
+
+    def test_invalid(self):
+        for target in ["box1", "box1:port", ":8080", ""]:
+            with self.assertRaises(ValueError):
+                _parse_probe_target(target)
@@ -0,0 +1,172 @@
+import copy
+import unittest
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.exposition import generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics
+
+from qbittorrent_exporter.rendering import (
+    CounterStarts,
+    LabelCache,
+    PrerenderedCounterFamily,
+    PrerenderedGaugeFamily,
+    generate_openmetrics,
+    generate_text,
+)
+
+
+class StaticCollector:
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+class TestLabelCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LabelCache(["name", "category"])
+
+    def test_renders_sorted_and_escaped_labels(self):
+        labels = self.cache.get("hash1", ('My "torrent"\\\n', "Movies"))
+        self.assertEqual(
+            labels.text, '{category="Movies",name="My \\"torrent\\"\\\\\\n"} '
+        )
+
+    def test_reuses_entries_until_labels_change(self):
+        first = self.cache.get("hash1", ("Torrent", "Movies"))
+        self.assertIs(self.cache.get("hash1", ("Torrent", "Movies")), first)
+
+        renamed = self.cache.get("hash1", ("Torrent", "Music"))
+        self.assertEqual(renamed.text, '{category="Music",name="Torrent"} ')
+
+    def test_retain(self):
+        self.cache.get("hash1", ("Torrent 1", ""))
+        self.cache.get("hash2", ("Torrent 2", ""))
+        self.cache.retain(["hash2"])
+        self.assertEqual(len(self.cache), 1)
+
+
+class TestCounterStarts(unittest.TestCase):
+    def test_created(self):
+        starts = CounterStarts()
+        self.assertEqual(starts.created("hash1", 10, now=100), 100)
+        self.assertEqual(starts.created("hash1", 20, now=200), 100)
+        # The counter went down, so it started over
+        self.assertEqual(starts.created("hash1", 5, now=300), 300)
+
+    def test_retain(self):
+        starts = CounterStarts()
+        starts.created("hash1", 10, now=100)
+        starts.created("hash2", 10, now=100)
+        starts.retain(["hash2"])
+
+        self.assertEqual(len(starts), 1)
+        self.assertEqual(starts.created("hash1", 20, now=200), 200)
+
+
+class TestPrerenderedGaugeFamily(unittest.TestCase):
+    def setUp(self):
+        self.cache = LabelCache(["name", "server"])
+        self.family = PrerenderedGaugeFamily(
+            "test_size", 'Size\\of "it"\nall', labels=["name", "server"]
+        )
+        for i, value in enumerate([0, 1.5, 2**40, -3, float("inf")]):
+            labels = self.cache.get(str(i), (f"Tørrent {i}", "localhost:8080"))
+            self.family.add_rendered(labels, value)
+
+    def test_renders_like_generate_latest(self):
+        plain = GaugeMetricFamily(
+            "test_size", 'Size\\of "it"\nall', labels=["name", "server"]
+        )
+        for sample in copy.copy(self.family).samples:
+            plain.add_metric(list(sample.labels.values()), sample.value)
+        counter = CounterMetricFamily("test_requests", "Requests", value=3)
+
+        self.assertEqual(
+            generate_text(StaticCollector([self.family, counter])),
+            generate_latest(StaticCollector([plain, counter])),
+        )
+        for escaping in [openmetrics.UNDERSCORES, openmetrics.ALLOWUTF8]:
+            with self.subTest(escaping=escaping):
+                self.assertEqual(
+                    generate_openmetrics(
+                        StaticCollector([self.family, counter]), escaping=escaping
+                    ),
+                    openmetrics.generate_latest(
+                        StaticCollector([plain, counter]), escaping=escaping
+                    ),
+                )
+
+    def test_samples(self):
+        self.assertEqual(self.family.count_samples(), 5)
+        sample = self.family.samples[1]
+        self.assertEqual(sample.name, "test_size")
+        self.assertEqual(
+            sample.labels, {"name": "Tørrent 1", "server": "localhost:8080"}
+        )
+        self.assertEqual(sample.value, 1.5)
+
+        # Reading the samples leaves the family prerendered
+        self.assertIsNot(self.family.samples, self.family.samples)
+        self.assertEqual(self.family.count_samples(), 5)
+        self.assertIsNotNone(self.family.render())
+
+        # Samples added the usual way are rendered the usual way
+        self.family.add_metric(["Other", "localhost:8080"], 7)
+        self.assertEqual(self.family.count_samples(), 6)
+        self.assertIsNone(self.family.render())
+        registry = CollectorRegistry()
+        registry.register(StaticCollector([self.family]))
+        self.assertEqual(generate_text(registry), generate_latest(registry))
+
+    def test_copies_can_replace_their_samples(self):
+        merged = copy.copy(self.family)
+        merged.samples = list(self.family.samples)
+        merged.samples.extend(self.family.samples[:1])
+
+        self.assertEqual(len(merged.samples), 6)
+        self.assertEqual(len(self.family.samples), 5)
+
+
+class TestPrerenderedCounterFamily(unittest.TestCase):
+    def setUp(self):
+        self.cache = LabelCache(["name", "server"])
+        self.family = PrerenderedCounterFamily(
+            "test_uploaded", "Uploaded data", labels=["name", "server"]
+        )
+        for i, value in enumerate([0, 1.5, 2**40]):
+            labels = self.cache.get(str(i), (f"Torrent {i}", "localhost:8080"))
+            self.family.add_rendered(labels, value, created=1700000000 + i)
+
+    def test_renders_like_generate_latest(self):
+        plain = CounterMetricFamily(
+            "test_uploaded", "Uploaded data", labels=["name", "server"]
+        )
+        for i, value in enumerate([0, 1.5, 2**40]):
+            plain.add_metric(
+                [f"Torrent {i}", "localhost:8080"], value, created=1700000000 + i
+            )
+
+        self.assertEqual(
+            generate_text(StaticCollector([self.family])),
+            generate_latest(StaticCollector([plain])),
+        )
+        self.assertEqual(
+            generate_text(StaticCollector([copy.copy(self.family)])),
+            generate_latest(StaticCollector([plain])),
+        )
+        self.assertEqual(
+            generate_openmetrics(StaticCollector([self.family])),
+            openmetrics.generate_latest(StaticCollector([plain])),
+        )
+
+    def test_samples(self):
+        self.assertEqual(self.family.count_samples(), 6)
+        self.assertEqual(
+            [(s.name, s.value) for s in self.family.samples[:2]],
+            [("test_uploaded_total", 0), ("test_uploaded_created", 1700000000)],
+        )
+        self.assertEqual(self.family.count_samples(), 6)
+        self.assertIsNotNone(self.family.render())
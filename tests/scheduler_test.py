@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from qbittorrent_exporter.scheduler import AdaptiveScheduler
+
+
+@patch("qbittorrent_exporter.scheduler.time.monotonic")
+class TestAdaptiveScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = AdaptiveScheduler(interval=0, max_interval=60)
+
+    def test_due_at_first(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        self.assertTrue(self.scheduler.due())
+        self.assertEqual(self.scheduler.seconds_to_next_fetch(), 0.0)
+
+    def test_backs_off_exponentially_with_jitter(self, mock_monotonic):
+        delays = []
+        for _ in range(8):
+            self.scheduler.record_failure(100.0)
+            delays.append(self.scheduler.delay)
+
+        for failures, delay in enumerate(delays[:6]):
+            self.assertGreaterEqual(delay, 2**failures / 2)
+            self.assertLessEqual(delay, 2**failures)
+        self.assertLessEqual(delays[-1], 60)
+        self.assertEqual(self.scheduler.failures, 8)
+
+        mock_monotonic.return_value = 100.0 + delays[-1] - 1
+        self.assertFalse(self.scheduler.due())
+        mock_monotonic.return_value = 100.0 + delays[-1]
+        self.assertTrue(self.scheduler.due())
+
+    def test_backoff_starts_from_the_poll_interval(self, mock_monotonic):
+        scheduler = AdaptiveScheduler(interval=15, max_interval=300)
+        scheduler.record_failure(100.0)
+        self.assertGreaterEqual(scheduler.delay, 7.5)
+        scheduler.record_failure(100.0)
+        self.assertGreaterEqual(scheduler.delay, 15)
+        self.assertEqual(scheduler.interval, max(15, scheduler.delay))
+
+    def test_stretches_after_slow_responses(self, mock_monotonic):
+        self.scheduler.record_success(100.0, 4.0)
+        self.assertEqual(self.scheduler.interval, 20.0)
+        mock_monotonic.return_value = 110.0
+        self.assertEqual(self.scheduler.seconds_to_next_fetch(), 10.0)
+
+        self.scheduler.record_success(120.0, 30.0)
+        self.assertEqual(self.scheduler.interval, 60)
+
+    def test_recovers_after_one_success(self, mock_monotonic):
+        for _ in range(5):
+            self.scheduler.record_failure(100.0)
+        self.scheduler.record_success(130.0, 0.01)
+
+        mock_monotonic.return_value = 130.1
+        self.assertTrue(self.scheduler.due())
+        self.assertEqual(self.scheduler.failures, 0)
+        self.assertAlmostEqual(self.scheduler.interval, 0.05)
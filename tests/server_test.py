@@ -0,0 +1,229 @@
+import gzip
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock, patch
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+
+from qbittorrent_exporter.server import (
+    Exposition,
+    ExpositionCache,
+    scrape_deadline,
+    start_http_server,
+)
+
+# The Accept header Prometheus scrapes with
+PROMETHEUS_ACCEPT = (
+    "application/openmetrics-text;version=1.0.0;escaping=allow-utf-8;q=0.6,"
+    "application/openmetrics-text;version=0.0.1;q=0.5,"
+    "text/plain;version=1.0.0;escaping=allow-utf-8;q=0.4,"
+    "text/plain;version=0.0.4;q=0.3,*/*;q=0.2"
+)
+
+
+class CountingCollector:
+    """Collector exposing how many times it has been collected."""
+
+    def __init__(self):
+        self.collections = 0
+
+    def collect(self):
+        self.collections += 1
+        gauge = GaugeMetricFamily("test_collections", "Times collected")
+        gauge.add_metric([], self.collections)
+        yield gauge
+
+
+class TestExporterServer(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.collector = CountingCollector()
+        self.registry.register(self.collector)
+        self.cache = ExpositionCache(self.registry)
+        self.server, self.thread = start_http_server(
+            0, "127.0.0.1", self.registry, self.cache
+        )
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/metrics"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, headers=None):
+        request = urllib.request.Request(self.url, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def test_renders_live_without_cache(self):
+        _, _, first = self.get()
+        _, _, second = self.get()
+        self.assertIn(b"test_collections 1.0", first)
+        self.assertIn(b"test_collections 2.0", second)
+
+    def test_renders_openmetrics_for_prometheus(self):
+        status, headers, body = self.get({"Accept": PROMETHEUS_ACCEPT})
+        self.assertEqual(status, 200)
+        self.assertTrue(
+            headers["Content-Type"].startswith("application/openmetrics-text")
+        )
+        self.assertIn(b"test_collections 1.0\n", body)
+        self.assertTrue(body.endswith(b"# EOF\n"))
+
+    def test_serves_cached_exposition(self):
+        _, live_headers, _ = self.get()
+        self.cache.update()
+        collections = self.collector.collections
+
+        status, headers, body = self.get()
+        self.get()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], live_headers["Content-Type"])
+        self.assertEqual(body, self.cache.exposition.body)
+        self.assertEqual(headers["ETag"], self.cache.exposition.etag)
+        self.assertEqual(self.collector.collections, collections)
+
+    def test_serves_gzipped_exposition(self):
+        self.cache.update()
+        status, headers, body = self.get({"Accept-Encoding": "gzip"})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body), self.cache.exposition.body)
+
+    @patch("qbittorrent_exporter.server.time.monotonic")
+    def test_stale_exposition_is_not_served(self, mock_monotonic):
+        self.cache.max_age = 60
+        mock_monotonic.return_value = 1000.0
+        self.cache.update()
+
+        mock_monotonic.return_value = 1060.0
+        self.assertIs(self.cache.current(), self.cache.exposition)
+        mock_monotonic.return_value = 1061.0
+        self.assertIsNone(self.cache.current())
+        _, _, body = self.get()
+        self.assertIn(b"test_collections 2.0", body)
+
+    def test_not_modified(self):
+        self.cache.update()
+        etag = self.cache.exposition.etag
+
+        status, _, body = self.get({"If-None-Match": etag})
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+
+        self.cache.update()
+        status, _, _ = self.get({"If-None-Match": etag})
+        self.assertEqual(status, 200)
+
+
+class DeadlineCollector:
+    """Collector recording the scrape deadline it was collected with."""
+
+    def __init__(self):
+        self.deadlines = []
+
+    def collect(self):
+        self.deadlines.append(scrape_deadline.get())
+        return []
+
+
+class TestScrapeDeadline(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.collector = DeadlineCollector()
+        self.registry.register(self.collector)
+        self.server, self.thread = start_http_server(
+            0, "127.0.0.1", self.registry, timeout_offset=0.5
+        )
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/metrics"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, headers):
+        request = urllib.request.Request(self.url, headers=headers)
+        with urllib.request.urlopen(request) as response:
+            response.read()
+
+    def test_deadline_from_scrape_timeout(self):
+        started = time.monotonic()
+        self.get({"X-Prometheus-Scrape-Timeout-Seconds": "10"})
+
+        (deadline,) = self.collector.deadlines
+        self.assertGreater(deadline, started + 9)
+        self.assertLessEqual(deadline, time.monotonic() + 9.5)
+
+    def test_no_deadline(self):
+        self.get({})
+        self.get({"X-Prometheus-Scrape-Timeout-Seconds": "soon"})
+        self.get({"X-Prometheus-Scrape-Timeout-Seconds": "0"})
+        self.assertEqual(self.collector.deadlines, [None, None, None])
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.pool = MagicMock()
+        self.pool.get.return_value = CountingCollector()
+        self.server, self.thread = start_http_server(
+            0, "127.0.0.1", CollectorRegistry(), probe_pool=self.pool
+        )
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/probe"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, query):
+        try:
+            with urllib.request.urlopen(f"{self.url}?{query}") as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def test_probe(self):
+        status, body = self.get("target=box1:8080&module=seedbox")
+        self.assertEqual(status, 200)
+        self.assertIn(b"test_collections 1.0", body)
+        self.pool.get.assert_called_once_with("box1:8080", "seedbox")
+
+    def test_probe_default_module(self):
+        self.get("target=box1:8080")
+        self.pool.get.assert_called_once_with("box1:8080", "default")
+
+    def test_probe_disabled(self):
+        server, _ = start_http_server(0, "127.0.0.1", CollectorRegistry())
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f"http://127.0.0.1:{server.server_address[1]}/probe"
+
+        status, _ = self.get("target=box1:8080")
+        self.assertEqual(status, 404)
+
+    def test_probe_without_target(self):
+        status, _ = self.get("module=seedbox")
+        self.assertEqual(status, 400)
+
+    def test_probe_invalid_target(self):
+        self.pool.get.side_effect = ValueError("Unknown module 'foo'")
+        status, body = self.get("target=box1:8080&module=foo")
+        self.assertEqual(status, 400)
+        self.assertEqual(body, b"Unknown module 'foo'\n")
+
+
+class TestExposition(unittest.TestCase):
+    def test_render(self):
+        registry = CollectorRegistry()
+        registry.register(CountingCollector())
+
+        exposition = Exposition.render(registry)
+
+        self.assertIn(b"test_collections 1.0", exposition.body)
+        self.assertEqual(gzip.decompress(exposition.gzipped_body), exposition.body)
+        self.assertTrue(exposition.etag.startswith('"'))
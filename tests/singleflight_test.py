@@ -0,0 +1,73 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from qbittorrent_exporter.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def _slow_call(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.calls
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(flight.run, self._slow_call, 5) for _ in range(8)
+            ]
+            # Let every caller reach the flight before the first call returns
+            while flight._future is None:
+                pass
+            threading.Timer(0.1, self.release.set).start()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(results, [1] * 8)
+        self.assertEqual(self.calls, 1)
+
+    def test_sequential_calls_run_again(self):
+        flight = SingleFlight()
+        self.release.set()
+        self.assertEqual(flight.run(self._slow_call), 1)
+        self.assertEqual(flight.run(self._slow_call), 2)
+
+    @patch("qbittorrent_exporter.singleflight.time.monotonic")
+    def test_reuses_recent_result(self, mock_monotonic):
+        flight = SingleFlight(min_interval=5)
+        self.release.set()
+
+        mock_monotonic.return_value = 100.0
+        self.assertEqual(flight.run(self._slow_call), 1)
+        mock_monotonic.return_value = 104.0
+        self.assertEqual(flight.run(self._slow_call), 1)
+        mock_monotonic.return_value = 105.0
+        self.assertEqual(flight.run(self._slow_call), 2)
+
+    def test_errors_are_not_reused(self):
+        flight = SingleFlight(min_interval=60)
+
+        def fail():
+            raise ValueError("Boom")
+
+        with self.assertRaises(ValueError):
+            flight.run(fail)
+        self.assertEqual(flight.run(lambda: 1), 1)
+
+    def test_waiting_times_out(self):
+        flight = SingleFlight()
+        thread = threading.Thread(target=flight.run, args=(self._slow_call,))
+        thread.start()
+        while flight._future is None:
+            pass
+
+        with self.assertRaises(TimeoutError):
+            flight.run(self._slow_call, timeout=0.05)
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(self.calls, 1)
@@ -0,0 +1,245 @@
+import json
+import random
+import unittest
+from array import array
+from unittest.mock import patch
+
+from qbittorrent_exporter.torrents import TorrentTable, load_maindata
+
+
+class TestTorrentTable(unittest.TestCase):
+    def setUp(self):
+        self.table = TorrentTable(["name", "size", "progress"])
+
+    def test_update_adds_torrents_with_defaults(self):
+        self.table.update("hash1", {"name": "Torrent 1", "state": "uploading"})
+
+        self.assertEqual(len(self.table), 1)
+        self.assertIn("hash1", self.table)
+        self.assertEqual(
+            self.table.get("hash1"),
+            {"hash": "hash1", "name": "Torrent 1", "size": 0, "progress": 0.0},
+        )
+
+    def test_numbers_are_stored_in_arrays(self):
+        self.assertIsInstance(self.table.column("size"), array)
+        self.assertIsInstance(self.table.column("progress"), array)
+        self.assertIsInstance(self.table.column("name"), list)
+
+    def test_update_patches_existing_torrents(self):
+        self.table.update("hash1", {"name": "Torrent 1", "size": 100})
+        self.table.update("hash1", {"progress": 0.5})
+
+        self.assertEqual(len(self.table), 1)
+        self.assertEqual(
+            self.table.get("hash1"),
+            {"hash": "hash1", "name": "Torrent 1", "size": 100, "progress": 0.5},
+        )
+
+    def test_remove_moves_last_row(self):
+        for i in range(3):
+            self.table.update(f"hash{i}", {"name": f"Torrent {i}", "size": i})
+
+        self.table.remove("hash0")
+        self.table.remove("unknown")
+
+        self.assertEqual(len(self.table), 2)
+        self.assertNotIn("hash0", self.table)
+        self.assertEqual(self.table.index, {"hash2": 0, "hash1": 1})
+        self.assertEqual(
+            list(self.table.rows("name", "size")), [("Torrent 2", 2), ("Torrent 1", 1)]
+        )
+
+        self.table.remove("hash1")
+        self.assertEqual(self.table.index, {"hash2": 0})
+        self.assertEqual(self.table.get("hash2")["size"], 2)
+
+    @patch("qbittorrent_exporter.torrents.time.monotonic")
+    def test_changes_are_tracked(self, mock_monotonic):
+        table = TorrentTable(["size", "ratio"], tracked_fields=["size"])
+        mock_monotonic.return_value = 1.0
+        table.update("a", {"size": 1})
+        table.update("b", {"size": 2})
+        table.update("c", {"size": 3})
+
+        mock_monotonic.return_value = 2.0
+        table.update("a", {"size": 1, "ratio": 0.5})
+        table.update("b", {"size": 20})
+        self.assertEqual(list(table.changed_at), [1.0, 2.0, 1.0])
+
+        table.remove("a")
+        self.assertEqual(list(table.changed_at), [1.0, 2.0])
+        self.assertEqual(list(table.copy().changed_at), [1.0, 2.0])
+
+    def test_copy_is_independent(self):
+        self.table.update("hash1", {"name": "Torrent 1", "size": 100})
+        copy = self.table.copy()
+        self.table.update("hash1", {"size": 200})
+        self.table.remove("hash1")
+
+        self.assertEqual(copy.get("hash1")["size"], 100)
+
+    def test_from_dicts(self):
+        table = TorrentTable.from_dicts(
+            [{"hash": "hash1", "name": "Torrent 1"}, {"name": "Torrent 2"}]
+        )
+
+        self.assertEqual(table.fields, ("hash", "name"))
+        self.assertEqual(
+            table.to_dicts(),
+            [
+                {"hash": "hash1", "name": "Torrent 1"},
+                {"hash": "1", "name": "Torrent 2"},
+            ],
+        )
+
+
+class TestTorrentTableAggregations(unittest.TestCase):
+    def setUp(self):
+        self.table = TorrentTable.from_dicts(
+            [
+                {"category": "Movies", "state": "uploading", "tags": "", "size": 1},
+                {"category": "Movies", "state": "uploading", "tags": "a", "size": 2},
+                {"category": "Movies", "state": "stalledDL", "tags": "a, b", "size": 4},
+                {"category": "", "state": "uploading", "tags": "b", "size": 8},
+            ],
+            ["category", "state", "tags", "size", "ratio"],
+        )
+
+    def test_strings_are_interned(self):
+        self.assertEqual(list(self.table.columns["category"]), [0, 0, 0, 1])
+        self.assertEqual(self.table.interned["category"], ["Movies", ""])
+        self.assertEqual(self.table.column("category"), ["Movies"] * 3 + [""])
+        self.assertEqual(self.table.get("3")["state"], "uploading")
+
+    def test_copy_keeps_its_own_values(self):
+        copy = self.table.copy()
+        self.table.update("0", {"category": "Books"})
+
+        self.assertEqual(copy.get("0")["category"], "Movies")
+        self.assertNotIn("Books", copy.interned["category"])
+
+    def test_count_by(self):
+        self.assertEqual(
+            self.table.count_by("category", "state"),
+            {
+                ("Movies", "uploading"): 2,
+                ("Movies", "stalledDL"): 1,
+                ("", "uploading"): 1,
+            },
+        )
+
+    def test_count_by_tags(self):
+        self.assertEqual(self.table.count_by("tags"), {("",): 1, ("a",): 2, ("b",): 2})
+
+    def test_sum_by(self):
+        self.assertEqual(
+            self.table.sum_by(["state"], ["size", "ratio"]),
+            {
+                ("uploading",): {"size": 11, "ratio": 0.0},
+                ("stalledDL",): {"size": 4, "ratio": 0.0},
+            },
+        )
+
+    def test_sum_by_tags(self):
+        self.assertEqual(
+            self.table.sum_by(["category", "tags"], ["size"]),
+            {
+                ("Movies", ""): {"size": 1},
+                ("Movies", "a"): {"size": 6},
+                ("Movies", "b"): {"size": 4},
+                ("", "b"): {"size": 8},
+            },
+        )
+
+    def test_histogram_by(self):
+        self.assertEqual(
+            self.table.histogram_by([], "size", [1, 4]), {(): ([1, 3, 4], 15)}
+        )
+        self.assertEqual(
+            self.table.histogram_by(["category"], "size", [1, 4]),
+            {("Movies",): ([1, 3, 3], 7), ("",): ([0, 0, 1], 8)},
+        )
+        self.assertEqual(
+            self.table.histogram_by(["tags"], "size", [2], lambda size: size * 2),
+            {("",): ([1, 1], 2), ("a",): ([0, 2], 12), ("b",): ([0, 2], 24)},
+        )
+        self.assertEqual(TorrentTable(["size"]).histogram_by([], "size", [1]), {})
+
+    def test_kept_aggregations_follow_changes(self):
+        rng = random.Random(0)
+        table = TorrentTable(
+            ["name"], [(("category", "state"), ("size",)), (("tags",), ())]
+        )
+        for _ in range(500):
+            torrent_hash = f"hash{rng.randrange(50)}"
+            if rng.random() < 0.2:
+                table.remove(torrent_hash)
+                continue
+            table.update(
+                torrent_hash,
+                {
+                    "category": rng.choice(["", "Movies", "Music"]),
+                    "state": rng.choice(["uploading", "stalledDL"]),
+                    "tags": rng.choice(["", "a", "a, b"]),
+                    "size": rng.randrange(100),
+                },
+            )
+
+        rebuilt = TorrentTable.from_dicts(table.to_dicts())
+        self.assertEqual(
+            table.sum_by(["category", "state"], ["size"]),
+            rebuilt.sum_by(["category", "state"], ["size"]),
+        )
+        self.assertEqual(table.count_by("tags"), rebuilt.count_by("tags"))
+        self.assertEqual(table.copy().count_by("tags"), rebuilt.count_by("tags"))
+
+    def test_aggregations_follow_updates(self):
+        self.table.update("1", {"state": "stalledDL"})
+        self.table.remove("0")
+
+        self.assertEqual(
+            self.table.count_by("state"), {("uploading",): 1, ("stalledDL",): 2}
+        )
+        self.assertEqual(TorrentTable(["state"]).count_by("state"), {})
+
+
+class TestLoadMaindata(unittest.TestCase):
+    def test_keeps_only_given_torrent_fields(self):
+        maindata = {
+            "rid": 3,
+            "full_update": True,
+            "server_state": {"dl_info_speed": 10, "connection_status": "connected"},
+            "categories": {"Movies": {"name": "Movies", "savePath": "/movies"}},
+            "tags": ["tag1"],
+            "torrents": {
+                "hash1": {"name": "Torrent 1", "size": 100, "magnet_uri": "magnet:"},
+                "hash2": {"name": 'Torrent é "2"', "trackers_count": 3},
+            },
+            "torrents_removed": ["hash3"],
+        }
+
+        result = load_maindata(
+            json.dumps(maindata, indent=2).encode(), ["name", "size"]
+        )
+
+        self.assertEqual(
+            result,
+            {
+                **maindata,
+                "torrents": {
+                    "hash1": {"name": "Torrent 1", "size": 100},
+                    "hash2": {"name": 'Torrent é "2"'},
+                },
+            },
+        )
+
+    def test_empty_objects(self):
+        self.assertEqual(load_maindata(b"{}", ["name"]), {})
+        self.assertEqual(load_maindata('{"torrents": {}}', ["name"]), {"torrents": {}})
+
+    def test_invalid_json(self):
+        for payload in [b"", b"[]", b'{"rid": 1,}', b'{"rid" 1}', b'{"rid": 1} x']:
+            with self.subTest(payload=payload):
+                with self.assertRaises(json.JSONDecodeError):
+                    load_maindata(payload, ["name"])
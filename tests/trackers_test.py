@@ -0,0 +1,126 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from qbittorrent_exporter.trackers import TrackerCrawler, tracker_host
+
+
+class TestTrackerHost(unittest.TestCase):
+    def test_tracker_host(self):
+        self.assertEqual(
+            tracker_host("https://tracker.example.org:443/announce?k=1"),
+            "tracker.example.org",
+        )
+        self.assertEqual(
+            tracker_host("udp://Tracker.Example.org:6969"), "tracker.example.org"
+        )
+        self.assertEqual(tracker_host("not a url"), "not a url")
+        self.assertEqual(tracker_host("http://[::1"), "http://[::1")
+
+
+class TestTrackerCrawler(unittest.TestCase):
+    def setUp(self):
+        self.torrents = ["hash1", "hash2"]
+        self.trackers = {
+            "hash1": [
+                {"url": "** [DHT] **", "status": 0},
+                {"url": "https://one.example.org/announce", "status": 2},
+                {"url": "https://two.example.org/announce", "status": 4},
+            ],
+            "hash2": [{"url": "https://one.example.org/announce", "status": 2}],
+        }
+        self.fetched = []
+        self.crawler = TrackerCrawler(
+            lambda: list(self.torrents), self._fetch_trackers, rate=10, ttl=60
+        )
+
+    def _fetch_trackers(self, torrent_hash):
+        self.fetched.append(torrent_hash)
+        return self.trackers[torrent_hash]
+
+    def test_crawls_every_torrent_in_turn(self):
+        self.assertEqual(self.crawler.crawl_next(), 0.1)
+        self.assertEqual(self.crawler.crawl_next(), 0.1)
+
+        self.assertEqual(self.fetched, ["hash1", "hash2"])
+        self.assertEqual(
+            self.crawler.status_counts(),
+            {
+                ("one.example.org", "Working"): 2,
+                ("two.example.org", "Not working"): 1,
+            },
+        )
+        self.assertEqual(self.crawler.crawled_torrents(), 2)
+
+    @patch("qbittorrent_exporter.trackers.time.monotonic")
+    def test_waits_for_stale_torrents(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        self.crawler.crawl_next()
+        self.crawler.crawl_next()
+
+        mock_monotonic.return_value = 130.0
+        self.assertEqual(self.crawler.crawl_next(), 30.0)
+        self.assertEqual(self.fetched, ["hash1", "hash2"])
+
+        mock_monotonic.return_value = 160.0
+        self.trackers["hash1"] = []
+        self.crawler.crawl_next()
+        self.assertEqual(self.fetched, ["hash1", "hash2", "hash1"])
+        self.assertEqual(
+            self.crawler.status_counts(), {("one.example.org", "Working"): 1}
+        )
+
+    def test_finds_new_torrents_soon(self):
+        self.torrents = []
+        self.assertEqual(self.crawler.crawl_next(), 60)
+
+        self.torrents = ["hash1", "hash2"]
+        self.crawler.crawl_next()
+        self.crawler.crawl_next()
+        self.assertLessEqual(self.crawler.crawl_next(), 60)
+
+        self.torrents.append("hash3")
+        self.trackers["hash3"] = []
+        self.crawler.crawl_next()
+        self.assertEqual(self.fetched, ["hash1", "hash2", "hash3"])
+
+    def test_forgets_removed_torrents(self):
+        self.crawler.crawl_next()
+        self.crawler.crawl_next()
+        self.torrents.remove("hash1")
+        self.crawler.crawl_next()
+
+        self.assertEqual(
+            self.crawler.status_counts(), {("one.example.org", "Working"): 1}
+        )
+        self.assertEqual(self.crawler.crawled_torrents(), 1)
+
+    def test_errors_are_counted(self):
+        self.trackers = {}
+        self.crawler.crawl_next()
+
+        self.assertEqual(self.crawler.requests, 1)
+        self.assertEqual(self.crawler.errors, 1)
+        self.assertEqual(self.crawler.status_counts(), {})
+
+    def test_unexpected_trackers_are_errors(self):
+        self.trackers["hash1"] = [{"url": "https://one.example.org", "status": 7}]
+        self.trackers["hash2"] = [{"status": 2}]
+        self.crawler.crawl_next()
+        self.crawler.crawl_next()
+
+        self.assertEqual(self.crawler.errors, 2)
+        self.assertEqual(self.crawler.status_counts(), {})
+
+    def test_run_survives_errors(self):
+        def fail():
+            raise ValueError("Boom")
+
+        crawler = TrackerCrawler(fail, self._fetch_trackers, rate=100, ttl=60)
+        crawler.start()
+        time.sleep(0.05)
+
+        self.assertTrue(crawler.is_alive())
+        crawler.stop()
+        crawler.join(1)
+        self.assertFalse(crawler.is_alive())